@@ -15,87 +15,541 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 import json
+import math
 import sqlite3
-import hashlib
-import uuid
 import os
 import sys
-from datetime import datetime, timedelta, timezone
-from email import message_from_string
+import queue
+import threading
+import time
+import itertools
+from collections import OrderedDict
 from urllib.parse import parse_qs
 
-SERVER_CONF_PATH = './server.conf'
+from Admission import AdmissionStore, parse_rate
+from Common import make_threaded_server, prefix_upper_bound
+from Config import get_config_value, get_path_from_config
+from RequestBody import MAX_BODY_SIZE, RequestBodyError, parse_body
+from Compression import (COMPRESS_MIN_SIZE, compress_stream, encode_etag_header, etag_matches, negotiate_encoding,
+                         rechunk, wants_encoded_etag)
+from Metrics import (PROMETHEUS_CONTENT_TYPE, begin_request, configure_metrics, count_bytes, end_request,
+                     get_connection_factory, iter_with_metrics, metrics_endpoint_enabled, record_cache,
+                     render_prometheus)
 
 # Construct the absolute path to the database file to ensure it's always in the correct location.
 # SCRIPT_DIR is /var/www/html/Api
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 
+def get_data_shards_from_config():
+    """Reads data-shards from server.conf. 0 (the default) keeps all user data in DB_FILE."""
+    value = get_config_value('data-shards')
+    try:
+        return max(int(value), 0) if value else 0
+    except ValueError:
+        return 0
+
+def get_history_sizes_from_config():
+    """Reads history-size and history-min-size from server.conf. Returns (size, min_size).
+
+    history-size is how many commands are kept per user. A client's HISTSIZE may
+    lower it for its user, but not below history-min-size, so a stray setting
+    such as HISTSIZE=1 cannot wipe a user's history.
+    """
+    def read(name, default, minimum, maximum):
+        try:
+            return min(max(int(get_config_value(name) or default), minimum), maximum)
+        except ValueError:
+            return default
+    size = read('history-size', 1000, 1, HISTORY_MAX_SIZE)
+    return size, read('history-min-size', min(100, size), 1, size)
+
 def get_db_file_from_config():
     """Reads the database-location from server.conf."""
     # Default path if not found in config, relative to SCRIPT_DIR
-    default_db_path_relative_to_api = '../db/users.db'
-    resolved_default_db_path = os.path.abspath(os.path.join(SCRIPT_DIR, default_db_path_relative_to_api))
+    return get_path_from_config('database-location', '../db/users.db')
 
-    try:
-        with open(SERVER_CONF_PATH, 'r') as f:
-            for line in f:
-                if line.strip().startswith('database-location'):
-                    _, raw_value = line.split('=', 1)
-                    value = raw_value.strip().strip('"') # Remove whitespace and surrounding quotes
-                    return os.path.abspath(os.path.join(SCRIPT_DIR, value))
-    except FileNotFoundError:
-        pass  # Config file not found, will use default
-    return resolved_default_db_path
+def get_admission_limits_from_config():
+    """Applies the concurrency-limit-* and rate-limit-* settings in server.conf to the defaults."""
+    concurrency_limits = {}
+    for action, default in DEFAULT_CONCURRENCY_LIMITS.items():
+        try:
+            limit = int(get_config_value(f'concurrency-limit-{action}') or default)
+        except ValueError:
+            limit = default
+        if limit > 0:
+            concurrency_limits[action] = limit
+    rate_limits = {}
+    for (action, scope), default in DEFAULT_RATE_LIMITS.items():
+        try:
+            rate = parse_rate(get_config_value(f'rate-limit-{action}-{scope}') or default)
+        except ValueError:
+            rate = parse_rate(default)
+        if rate:
+            rate_limits[(action, scope)] = rate
+    return concurrency_limits, rate_limits
+
+def get_trusted_proxies_from_config():
+    """Reads trusted-proxies, a comma-separated list of addresses whose X-Forwarded-For is believed."""
+    value = get_config_value('trusted-proxies') or ''
+    return {address.strip() for address in value.split(',') if address.strip()}
 
 DB_FILE = get_db_file_from_config()
 DB_DIR = os.path.dirname(DB_FILE) # Derive DB_DIR from the resolved DB_FILE
+# The actions handle_request() dispatches.
+ACTIONS = ('validate', 'add_user', 'login', 'change_password', 'logout', 'logout_all', 'get_data', 'set_data',
+           'delete_data', 'batch', 'history_append', 'history_tail', 'history_range', 'history_search',
+           'watch_ticket', 'watch', 'metrics')
+configure_metrics('accounting', ACTIONS)
 
-def init_db():
-    """Initializes the database and creates tables if they don't exist."""
-    # Ensure the db directory exists before trying to connect to the database.
-    os.makedirs(DB_DIR, exist_ok=True)
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    # Create users table
-    cursor.execute('''
+# With data-shards = "N" in server.conf, user_data and history are split across N
+# database files by a hash of the username, so users no longer queue on a single
+# write lock. users and sessions always stay in DB_FILE.
+DATA_SHARDS = get_data_shards_from_config()
+SHARD_DIR = os.path.join(DB_DIR, 'shards')
+# Tables that live in a user's shard.
+SHARDED_TABLES = ('user_data', 'user_data_versions', 'history')
+
+# Maximum number of idle connections kept around by a long-running worker.
+DB_POOL_SIZE = 8
+
+# --- Session Settings ---
+# Lifetimes are in seconds, the unit of the stored timestamps.
+SESSION_LIFETIME = 7 * 24 * 3600
+# Sliding expiry is only written back once the remaining lifetime drops below this,
+# so an active session costs at most one UPDATE per day instead of one per page load.
+SESSION_REFRESH_THRESHOLD = 6 * 24 * 3600
+# How long a looked-up session may be served from memory before re-reading the table.
+# This bounds how long a logout performed by another worker process can go unnoticed.
+SESSION_CACHE_TTL = 60
+SESSION_CACHE_SIZE = 1024
+# Expired sessions are removed by a sweeper instead of on login: every
+# SESSION_SWEEP_INTERVAL seconds when serving, or by the sweep-sessions command.
+SESSION_SWEEP_INTERVAL = 600
+SESSION_SWEEP_BATCH_SIZE = 500
+
+# Upper bound on the number of operations accepted by a single batch request.
+BATCH_MAX_OPERATIONS = 500
+
+# Upper bound on the page size a client may request from get_data.
+GET_DATA_MAX_LIMIT = 1000
+
+# Shell history is trimmed to the user's HISTSIZE on every append, within the
+# server's bounds. HISTORY_MAX_SIZE also caps the entries returned by one read.
+HISTORY_MAX_SIZE = 10000
+HISTORY_DEFAULT_SIZE, HISTORY_MIN_SIZE = get_history_sizes_from_config()
+# The category history was kept under in user_data before it got its own table.
+# Watchers now see history appends as changes to this category.
+HISTORY_CATEGORY = 'HISTORY'
+
+# A long-poll watch request returns after this many seconds even if nothing changed.
+WATCH_TIMEOUT = 25
+# Changes committed by another process (a CGI request or another worker) are not
+# signalled in-process, so watchers also re-read the versions this often.
+WATCH_POLL_INTERVAL = 5
+# An event stream sends a keep-alive comment after this long without events, and
+# is closed after WATCH_STREAM_DURATION so the browser reconnects with Last-Event-ID
+# instead of one worker thread being held forever.
+WATCH_HEARTBEAT_INTERVAL = 15
+WATCH_STREAM_DURATION = 300
+# EventSource cannot send a header or a body, so a stream is opened with a ticket
+# in its URL instead of the session token. A ticket is only good for watch, only
+# while its session lasts and only for this many seconds after it was issued.
+WATCH_TICKET_LIFETIME = 300
+
+# The backup command copies this many pages per step. Between steps other
+# connections can use the database, so live traffic is never blocked for long.
+BACKUP_PAGES_PER_STEP = 1024
+# Rows per transaction when importing an NDJSON export.
+IMPORT_BATCH_SIZE = 5000
+# Tables covered by export and import, in an order that keeps foreign keys satisfied.
+EXPORT_TABLES = ('users', 'sessions', 'user_data', 'user_data_versions', 'history')
+
+# A batch carries many values in one field, so it may use the whole request body.
+FIELD_SIZE_LIMITS = {'operations': MAX_BODY_SIZE}
+
+# --- Admission Control Settings ---
+# Expensive or abuse-prone actions are limited before they touch the database.
+# Every limit can be changed in server.conf, e.g. `concurrency-limit-login = "8"`
+# or `rate-limit-login-ip = "60/60"` (60 requests per 60 seconds, in bursts of
+# up to 60). "0" turns a limit off.
+# Requests of an action in progress at the same time, across all worker processes.
+# Under CGI every open watch holds a process, so watches are capped as well.
+DEFAULT_CONCURRENCY_LIMITS = {'login': 4, 'add_user': 2, 'change_password': 2, 'watch': 32}
+# Token buckets per client address ('ip') or per submitted username ('user').
+DEFAULT_RATE_LIMITS = {
+    ('login', 'ip'): '30/60',
+    ('login', 'user'): '10/60',
+    ('add_user', 'ip'): '10/3600',
+    ('change_password', 'ip'): '10/60',
+}
+CONCURRENCY_LIMITS, RATE_LIMITS = get_admission_limits_from_config()
+# Behind a reverse proxy every request comes from the proxy's address.
+TRUSTED_PROXIES = get_trusted_proxies_from_config()
+# A request turned away by a concurrency limit is told to retry after this many seconds.
+CONCURRENCY_RETRY_AFTER = 1
+# How long a slot is held if its process dies without releasing it, for actions
+# that legitimately run longer than Admission.SLOT_LEASE.
+CONCURRENCY_LEASES = {'watch': WATCH_STREAM_DURATION + 60}
+# The limiter state shared by the worker processes. It may be deleted at any time.
+ADMISSION_DB_FILE = os.path.join(DB_DIR, 'admission.db')
+
+# --- Connection Management ---
+# In CGI mode every request is a fresh process, so the pool simply makes sure that
+# validate_token() and the action handler share one connection. In WSGI mode the
+# connections outlive the request and are handed from one request to the next.
+_db_pools = {}
+_db_pools_lock = threading.Lock()
+_db_local = threading.local()
+_db_init_lock = threading.Lock()
+_db_initialized = set()
+
+def connect_db(path):
+    """Opens a connection to a database file."""
+    # The connection is only ever used by one thread at a time, but it may be
+    # handed to a different worker thread once it's back in the pool.
+    conn = sqlite3.connect(path, check_same_thread=False, factory=get_connection_factory())
+    # In WAL mode a commit doesn't need to sync the main file, and NORMAL is still
+    # safe against corruption.
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+def get_pool(path):
+    """Returns the pool of idle connections to a database file."""
+    with _db_pools_lock:
+        if path not in _db_pools:
+            _db_pools[path] = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+        return _db_pools[path]
+
+def get_db(path=None):
+    """Returns the connection to a database file (DB_FILE by default) bound to the current request."""
+    path = path or DB_FILE
+    conns = getattr(_db_local, 'conns', None)
+    if conns is None:
+        conns = _db_local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        try:
+            conn = get_pool(path).get_nowait()
+        except queue.Empty:
+            conn = connect_db(path)
+        conns[path] = conn
+    return conn
+
+def release_db():
+    """Returns the current request's connections to their pools."""
+    conns = getattr(_db_local, 'conns', None)
+    if not conns:
+        return
+    _db_local.conns = {}
+    for path, conn in conns.items():
+        # Never hand a half-finished transaction to the next request.
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            get_pool(path).put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+def ensure_db(path=None):
+    """Runs init_db() once per process for a database file."""
+    path = path or DB_FILE
+    if path in _db_initialized:
+        return
+    with _db_init_lock:
+        if path not in _db_initialized:
+            init_db(path)
+            _db_initialized.add(path)
+
+def get_shard_file(username):
+    """Returns the database file that holds a user's data."""
+    if not DATA_SHARDS:
+        return DB_FILE
+    # A stable hash; Python's hash() of a str changes between processes.
+    import hashlib
+    index = int(hashlib.sha1(username.encode('utf-8')).hexdigest()[:8], 16) % DATA_SHARDS
+    return os.path.join(SHARD_DIR, f'user_data_{index:03d}.db')
+
+def get_data_db(username):
+    """Returns the connection to the database that holds a user's data and history."""
+    path = get_shard_file(username)
+    ensure_db(path)
+    return get_db(path)
+
+class SessionCache:
+    """A small thread-safe TTL/LRU cache of token -> (username, expires_at)."""
+
+    def __init__(self, max_size, ttl):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        """Returns the cached (username, expires_at) for a token, or None."""
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            username, expires_at, cached_at = entry
+            if cached_at + self._ttl < current_timestamp():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return username, expires_at
+
+    def put(self, token, username, expires_at):
+        """Caches a session, evicting the least recently used entry when full."""
+        with self._lock:
+            self._entries[token] = (username, expires_at, current_timestamp())
+            self._entries.move_to_end(token)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, token):
+        """Drops a single token from the cache."""
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def invalidate_user(self, username):
+        """Drops every cached token that belongs to a user."""
+        with self._lock:
+            for token in [t for t, entry in self._entries.items() if entry[0] == username]:
+                del self._entries[token]
+
+_session_cache = SessionCache(SESSION_CACHE_SIZE, SESSION_CACHE_TTL)
+
+def current_timestamp():
+    """Returns the current UTC time as an integer Unix timestamp."""
+    return int(time.time())
+
+def new_session_expiry():
+    """Returns the expiry timestamp for a session created or refreshed now."""
+    return current_timestamp() + SESSION_LIFETIME
+
+USER_DATA_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS user_data (
+        username TEXT NOT NULL,
+        category TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value TEXT,
+        PRIMARY KEY (username, category, key)
+    )
+'''
+# Every write to a category bumps its version, which get_data uses as its ETag.
+USER_DATA_VERSIONS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS user_data_versions (
+        username TEXT NOT NULL,
+        category TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        PRIMARY KEY (username, category)
+    )
+'''
+# Append-only shell history. seq increases per user, so the newest entries
+# and any range of them are found through the primary key alone.
+HISTORY_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS history (
+        username TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        command TEXT NOT NULL,
+        created_at INTEGER NOT NULL,
+        PRIMARY KEY (username, seq)
+    ) WITHOUT ROWID
+'''
+
+# Each entry upgrades the schema by one version. The version a database is at is
+# kept in PRAGMA user_version, so a process only has to read one integer to find
+# out that there is nothing to do. Append new steps; never edit old ones. They may
+# use SQL up to MIN_SQLITE_VERSION; the history move needs window functions.
+MIN_SQLITE_VERSION = (3, 25, 0)
+SCHEMA_MIGRATIONS = [
+    [
+        '''
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             username TEXT UNIQUE NOT NULL,
             password_hash TEXT NOT NULL
         )
-    ''')
-    # Create sessions table
-    cursor.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS sessions (
             token TEXT PRIMARY KEY,
             expires_at INTEGER NOT NULL,
             username TEXT NOT NULL,
             FOREIGN KEY (username) REFERENCES users (username)
         )
-    ''')
-    # Create a generic user_data table for all user-specific remote data
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_data (
-            username TEXT NOT NULL,
-            category TEXT NOT NULL,
-            key TEXT NOT NULL,
-            value TEXT,
-            PRIMARY KEY (username, category, key)
+        ''',
+        # A generic user_data table for all user-specific remote data
+        USER_DATA_TABLE_SQL,
+        USER_DATA_VERSIONS_TABLE_SQL,
+    ],
+    [
+        # The expiry sweeper and "log out everywhere" would otherwise scan every session.
+        "CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)",
+        "CREATE INDEX IF NOT EXISTS sessions_username ON sessions (username)",
+    ],
+    [
+        HISTORY_TABLE_SQL,
+        # Move the history kept in user_data, whose keys are ISO timestamps, into the new table.
+        f'''
+        INSERT INTO history (username, seq, command, created_at)
+        SELECT username, ROW_NUMBER() OVER (PARTITION BY username ORDER BY key),
+               COALESCE(value, ''), COALESCE(CAST(strftime('%s', key) AS INTEGER), 0)
+        FROM user_data WHERE category = '{HISTORY_CATEGORY}'
+        ''',
+        f"DELETE FROM user_data WHERE category = '{HISTORY_CATEGORY}'",
+        f"DELETE FROM user_data_versions WHERE category = '{HISTORY_CATEGORY}'",
+    ],
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS watch_tickets (
+            ticket TEXT PRIMARY KEY,
+            token TEXT NOT NULL,
+            expires_at INTEGER NOT NULL
         )
-    ''')
-    conn.commit()
-    conn.close()
+        ''',
+        "CREATE INDEX IF NOT EXISTS watch_tickets_expires_at ON watch_tickets (expires_at)",
+    ],
+]
+
+# The same, for the shard files, which only hold the SHARDED_TABLES.
+SHARD_SCHEMA_MIGRATIONS = [
+    [USER_DATA_TABLE_SQL, USER_DATA_VERSIONS_TABLE_SQL, HISTORY_TABLE_SQL],
+]
+
+def init_db(path=None):
+    """Brings the schema of a database file (DB_FILE by default) up to date."""
+    path = path or DB_FILE
+    # Ensure the db directory exists before trying to connect to the database.
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = get_db(path)
+    # Let readers carry on while a writer commits. The mode is stored in the file,
+    # so this only does work the first time.
+    conn.execute("PRAGMA journal_mode = WAL")
+    # migrate_db() reads PRAGMA user_version on the connection the request is
+    # about to use anyway, so an up-to-date file costs one extra statement.
+    migrate_db(conn, get_migrations(path))
+
+def get_migrations(path):
+    """Returns the migrations that apply to a database file."""
+    return SCHEMA_MIGRATIONS if path == DB_FILE else SHARD_SCHEMA_MIGRATIONS
+
+def migrate_db(conn, migrations=SCHEMA_MIGRATIONS):
+    """Applies the pending migrations. Returns the resulting schema version."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= len(migrations):
+        return version
+    if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+        required = '.'.join(map(str, MIN_SQLITE_VERSION))
+        raise RuntimeError(f"Upgrading the database needs SQLite {required} or newer; "
+                           f"Python is using SQLite {sqlite3.sqlite_version}.")
+    cursor = conn.cursor()
+    # Take the write lock first so two processes starting at once don't both migrate.
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        for statements in migrations[version:]:
+            for statement in statements:
+                cursor.execute(statement)
+        version = len(migrations)
+        cursor.execute(f"PRAGMA user_version = {version}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return version
+
+def sweep_expired_sessions(batch_size=SESSION_SWEEP_BATCH_SIZE):
+    """Deletes expired sessions in small transactions so writers are never blocked for long.
+
+    Returns the number of sessions removed.
+    """
+    conn = get_db()
+    cursor = conn.cursor()
+    now = current_timestamp()
+    removed = 0
+    while True:
+        cursor.execute(
+            "DELETE FROM sessions WHERE token IN "
+            "(SELECT token FROM sessions WHERE expires_at < ? LIMIT ?)",
+            (now, batch_size)
+        )
+        conn.commit()
+        removed += cursor.rowcount
+        if cursor.rowcount < batch_size:
+            return removed
+
+def run_session_sweeper(interval):
+    """Sweeps expired sessions every `interval` seconds. Runs in a daemon thread of the server."""
+    while True:
+        time.sleep(interval)
+        try:
+            sweep_expired_sessions()
+        except sqlite3.Error as e:
+            print(f"Session sweep failed: {e}", file=sys.stderr)
+        finally:
+            release_db()
 
-def cleanup_expired_tokens():
-    """Removes all expired tokens from the sessions table."""
-    conn = sqlite3.connect(DB_FILE)
+def start_session_sweeper(interval=SESSION_SWEEP_INTERVAL):
+    """Starts the background expiry sweeper."""
+    threading.Thread(target=run_session_sweeper, args=(interval,), name='session-sweeper', daemon=True).start()
+
+def list_data_files():
+    """Returns every database file that may hold user data: DB_FILE and any existing shard."""
+    files = [DB_FILE]
+    if os.path.isdir(SHARD_DIR):
+        files += sorted(os.path.join(SHARD_DIR, name) for name in os.listdir(SHARD_DIR)
+                        if name.startswith('user_data_') and name.endswith('.db'))
+    return files
+
+def reshard_user_data():
+    """Moves every user's data and history to the file get_shard_file() assigns it to.
+
+    Handles going from the single-file layout to shards, changing the shard count,
+    and going back to a single file. Each user is copied in its own transaction and
+    only then deleted from its old file, so an interrupted run can simply be repeated.
+    Run it with the servers stopped. Returns the number of users moved.
+    """
+    moved = 0
+    for source_file in list_data_files():
+        ensure_db(source_file)
+        source = get_db(source_file)
+        usernames = set()
+        for table in SHARDED_TABLES:
+            usernames.update(row[0] for row in source.execute(f"SELECT DISTINCT username FROM {table}"))
+        for username in sorted(usernames):
+            target_file = get_shard_file(username)
+            if target_file == source_file:
+                continue
+            target = get_data_db(username)
+            for table in SHARDED_TABLES:
+                rows = source.execute(f"SELECT * FROM {table} WHERE username = ?", (username,)).fetchall()
+                if rows:
+                    placeholders = ', '.join('?' * len(rows[0]))
+                    target.executemany(f"INSERT OR REPLACE INTO {table} VALUES ({placeholders})", rows)
+            target.commit()
+            for table in SHARDED_TABLES:
+                source.execute(f"DELETE FROM {table} WHERE username = ?", (username,))
+            source.commit()
+            moved += 1
+    return moved
+
+def revoke_user_sessions(username, keep_token=None):
+    """Logs a user out of every session, optionally except the current one. Returns the count."""
+    conn = get_db()
     cursor = conn.cursor()
-    cursor.execute("DELETE FROM sessions WHERE expires_at < ?", (int(datetime.now(timezone.utc).timestamp()),))
+    if keep_token:
+        cursor.execute("DELETE FROM sessions WHERE username = ? AND token != ?", (username, keep_token))
+    else:
+        cursor.execute("DELETE FROM sessions WHERE username = ?", (username,))
     conn.commit()
-    conn.close()
+    # The kept session is simply cached again on its next lookup.
+    _session_cache.invalidate_user(username)
+    return cursor.rowcount
 
 def hash_password(password):
     """Hashes a password using SHA-256."""
+    # Imported where needed: the actions that don't hash anything skip loading OpenSSL.
+    import hashlib
     return hashlib.sha256(password.encode()).hexdigest()
 
 def handle_useradd(form_data):
@@ -106,7 +560,7 @@ def handle_useradd(form_data):
     if not username or not password:
         return {'status': 'error', 'message': 'Username and password are required.'}
 
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     cursor = conn.cursor()
     try:
         cursor.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)", (username, hash_password(password)))
@@ -114,8 +568,6 @@ def handle_useradd(form_data):
         return {'status': 'success', 'message': f'User "{username}" created successfully.'}
     except sqlite3.IntegrityError:
         return {'status': 'error', 'message': f'User "{username}" already exists.'}
-    finally:
-        conn.close()
 
 def handle_login(form_data):
     """Handles user login and session token generation."""
@@ -125,24 +577,22 @@ def handle_login(form_data):
     if not username or not password:
         return {'status': 'error', 'message': 'Username and password are required.'}
 
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute("SELECT password_hash FROM users WHERE username = ?", (username,))
     result = cursor.fetchone()
 
     if result and result[0] == hash_password(password):
-        # Clean up any old, expired tokens before creating a new one.
-        cleanup_expired_tokens()
-
+        # Imported here: no other action needs it, and a CGI process pays for every import.
+        import uuid
         token = str(uuid.uuid4())
-        expires_at = int((datetime.now(timezone.utc) + timedelta(days=7)).timestamp())
+        expires_at = new_session_expiry()
         # Create a new session
         cursor.execute("INSERT INTO sessions (token, username, expires_at) VALUES (?, ?, ?)", (token, username, expires_at))
         conn.commit()
-        conn.close()
+        _session_cache.put(token, username, expires_at)
         return {'status': 'success', 'message': 'Login successful.', 'token': token, 'user': username, 'expires_at': expires_at}
     else:
-        conn.close()
         return {'status': 'error', 'message': 'Invalid username or password.'}
 
 def handle_logout(form_data):
@@ -151,20 +601,28 @@ def handle_logout(form_data):
     if not token:
         return {'status': 'error', 'message': 'Token is required.'}
 
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     cursor = conn.cursor()
     # First, validate the token to ensure it's not expired.
     if validate_token(token):
         # If token is valid, delete it for logout.
         cursor.execute("DELETE FROM sessions WHERE token = ?", (token,))
         conn.commit()
-        conn.close()
+        _session_cache.invalidate(token)
         return {'status': 'success', 'message': 'Logout successful.'}
     else:
         # Token was invalid or expired and has been cleaned up.
-        conn.close()
         return {'status': 'error', 'message': 'Invalid or expired session.'}
 
+def handle_logout_all(form_data):
+    """Logs the user out of every session, including the one making the request."""
+    token = form_data.get('token')
+    username = validate_token(token)
+    if not username:
+        return {'status': 'error', 'message': 'Invalid or expired session.'}
+    count = revoke_user_sessions(username)
+    return {'status': 'success', 'message': f'Logged out of {count} session(s).'}
+
 def handle_passwd(form_data):
     """Handles a user's password change request."""
     token = form_data.get('token')
@@ -178,96 +636,110 @@ def handle_passwd(form_data):
     if not old_password or not new_password:
         return {'status': 'error', 'message': 'Old and new passwords are required.'}
 
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     cursor = conn.cursor()
-    try:
-        # First, verify the old password is correct
-        cursor.execute("SELECT password_hash FROM users WHERE username = ?", (username,))
-        result = cursor.fetchone()
-        if result and result[0] == hash_password(old_password):
-            # Old password is correct, update to the new one
-            cursor.execute("UPDATE users SET password_hash = ? WHERE username = ?", (hash_password(new_password), username))
-            conn.commit()
-            return {'status': 'success', 'message': 'Password changed successfully.'}
-        else:
-            return {'status': 'error', 'message': 'Incorrect old password.'}
-    finally:
-        conn.close()
+    # First, verify the old password is correct
+    cursor.execute("SELECT password_hash FROM users WHERE username = ?", (username,))
+    result = cursor.fetchone()
+    if result and result[0] == hash_password(old_password):
+        # Old password is correct, update to the new one
+        cursor.execute("UPDATE users SET password_hash = ? WHERE username = ?", (hash_password(new_password), username))
+        conn.commit()
+        # Anyone holding an old session must log in again with the new password.
+        revoke_user_sessions(username, keep_token=token)
+        return {'status': 'success', 'message': 'Password changed successfully.'}
+    else:
+        return {'status': 'error', 'message': 'Incorrect old password.'}
 
-def validate_token(token):
-    """Checks if a token is valid and not expired, deleting it if it is expired."""
+def lookup_session(token):
+    """Returns (username, expires_at) for a live token, deleting it if it is expired."""
     if not token:
         return None
 
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT username, expires_at FROM sessions WHERE token = ?", (token,))
-    result = cursor.fetchone()
+    session = _session_cache.get(token)
+    record_cache('session', session is not None)
+    if session is None:
+        conn = get_db()
+        cursor = conn.cursor()
+        cursor.execute("SELECT username, expires_at FROM sessions WHERE token = ?", (token,))
+        session = cursor.fetchone()
 
-    if not result:
-        conn.close()
-        return None # Token does not exist.
+        if not session:
+            return None # Token does not exist.
 
-    username, expires_at = result
+        _session_cache.put(token, *session)
 
-    if expires_at < int(datetime.now(timezone.utc).timestamp()):
+    username, expires_at = session
+
+    if expires_at < current_timestamp():
         # Token is expired, delete it and return failure.
+        _session_cache.invalidate(token)
+        conn = get_db()
+        cursor = conn.cursor()
         cursor.execute("DELETE FROM sessions WHERE token = ?", (token,))
         conn.commit()
-        conn.close()
         return None
 
-    conn.close()
-    return username # Return the associated username on success.
+    return username, expires_at
+
+def validate_token(token):
+    """Checks if a token is valid and not expired, deleting it if it is expired."""
+    session = lookup_session(token)
+    if not session:
+        return None
+    return session[0] # Return the associated username on success.
 
 def validate_and_update_token(token):
     """Checks if a token is valid and not expired, and extends its life."""
-    if not token:
+    session = lookup_session(token)
+    if not session:
         return None
 
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT username, expires_at FROM sessions WHERE token = ?", (token,))
-    result = cursor.fetchone()
-
-    if not result:
-        conn.close()
-        return None # Token does not exist.
+    username, expires_at = session
 
-    username, expires_at = result
-
-    if expires_at < int(datetime.now(timezone.utc).timestamp()):
-        # Token is expired, delete it and return failure.
-        cursor.execute("DELETE FROM sessions WHERE token = ?", (token,))
+    # Token is valid, extend its expiration once enough of its lifetime has been used up.
+    if expires_at - current_timestamp() < SESSION_REFRESH_THRESHOLD:
+        new_expires_at = new_session_expiry()
+        conn = get_db()
+        cursor = conn.cursor()
+        cursor.execute("UPDATE sessions SET expires_at = ? WHERE token = ?", (new_expires_at, token))
         conn.commit()
-        conn.close()
-        return None
-
-    # Token is valid, extend its expiration.
-    new_expires_at = int((datetime.now(timezone.utc) + timedelta(days=7)).timestamp())
-    cursor.execute("UPDATE sessions SET expires_at = ? WHERE token = ?", (new_expires_at, token))
-    conn.commit()
-    conn.close()
+        _session_cache.put(token, username, new_expires_at)
     return username # Return the associated username on success.
 
-def handle_get_data(form_data):
-    """Fetches all data for a given data_key for a validated user."""
-    token = form_data.get('token')
-    category = form_data.get('category')
-    sort_order = form_data.get('sort_order', 'ASC').upper() # Default to ASC
-    username = validate_token(token)
-    if not username:
-        return {'status': 'error', 'message': 'Invalid or expired session.'}
+def parse_page_params(source):
+    """Extracts limit/after_key/before_key/prefix paging parameters. Raises ValueError if invalid."""
+    page = {}
+    limit = source.get('limit')
+    if limit not in (None, ''):
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            limit = 0
+        if limit < 1:
+            raise ValueError('limit must be a positive integer.')
+        page['limit'] = min(limit, GET_DATA_MAX_LIMIT)
+    for name in ('after_key', 'before_key', 'prefix'):
+        value = source.get(name)
+        if value not in (None, ''):
+            if not isinstance(value, str):
+                raise ValueError(f'{name} must be a string.')
+            page[name] = value
+    return page
 
-    if not category:
-        return {'status': 'error', 'message': 'category is required.'}
+def fetch_user_data(cursor, username, category, sort_order='ASC', page=None):
+    """Reads one category, or a comma-separated list of categories, for a user.
 
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    Returns a (data, next_cursor) tuple. next_cursor is only set when a limit was
+    given and there may be more rows to read.
+    """
     data = {}
+    next_cursor = None
 
     # Check if category is a comma-separated list
     if ',' in category:
+        if page:
+            raise ValueError('Paging is only supported for a single category.')
         categories = [c.strip() for c in category.split(',') if c.strip()]
         # Initialize data structure for multiple categories
         for cat in categories:
@@ -279,15 +751,264 @@ def handle_get_data(form_data):
             cat, key, value = row
             data[cat][key] = value
     else:
-        # Fetch a single category
+        # Fetch a single category. Every condition is a range on the (username, category, key)
+        # primary key, so SQLite answers it with an index range scan.
+        page = page or {}
+        conditions = ["username = ?", "category = ?"]
+        params = [username, category]
+        if 'after_key' in page:
+            conditions.append("key > ?")
+            params.append(page['after_key'])
+        if 'before_key' in page:
+            conditions.append("key < ?")
+            params.append(page['before_key'])
+        if 'prefix' in page:
+            conditions.append("key >= ?")
+            params.append(page['prefix'])
+            upper_bound = prefix_upper_bound(page['prefix'])
+            if upper_bound is not None:
+                conditions.append("key < ?")
+                params.append(upper_bound)
+
         order_by_clause = ""
         if sort_order in ['ASC', 'DESC']:
             order_by_clause = f"ORDER BY key {sort_order}"
-        cursor.execute(f"SELECT key, value FROM user_data WHERE username = ? AND category = ? {order_by_clause}", (username, category))
+        limit_clause = ""
+        if 'limit' in page:
+            # Without an explicit order the page boundaries would be meaningless.
+            order_by_clause = order_by_clause or "ORDER BY key ASC"
+            limit_clause = "LIMIT ?"
+            params.append(page['limit'])
+
+        cursor.execute(f"SELECT key, value FROM user_data WHERE {' AND '.join(conditions)} {order_by_clause} {limit_clause}", params)
         rows = cursor.fetchall()
         data = {row[0]: row[1] for row in rows}
-    conn.close()
-    return {'status': 'success', 'data': data}
+        if 'limit' in page and len(rows) == page['limit']:
+            next_cursor = rows[-1][0]
+    return data, next_cursor
+
+def bump_data_version(cursor, username, category):
+    """Marks a category as changed so cached copies of it are no longer considered current.
+
+    Versions are drawn from one increasing sequence per user, so the highest version
+    doubles as a cursor: everything that changed after it has a larger version.
+    """
+    cursor.execute("""
+        INSERT INTO user_data_versions (username, category, version)
+        VALUES (?, ?, (SELECT COALESCE(MAX(version), 0) + 1 FROM user_data_versions WHERE username = ?))
+        ON CONFLICT (username, category) DO UPDATE SET version = excluded.version
+    """, (username, category, username))
+
+def get_data_etag(cursor, username, category, sort_order, page):
+    """Builds the ETag of a get_data response from the versions of the categories it reads."""
+    categories = sorted(c.strip() for c in category.split(',') if c.strip())
+    placeholders = ','.join('?' for _ in categories)
+    cursor.execute(f"SELECT category, version FROM user_data_versions WHERE username = ? AND category IN ({placeholders})",
+                   (username, *categories))
+    versions = dict(cursor.fetchall())
+    # The request parameters are part of the tag: a different page is a different document.
+    state = [username, [(c, versions.get(c, 0)) for c in categories], sort_order, sorted(page.items())]
+    import hashlib
+    return '"' + hashlib.sha256(json.dumps(state).encode('utf-8')).hexdigest()[:32] + '"'
+
+def store_user_data(cursor, username, category, key, value):
+    """Writes a single data item without committing."""
+    # Use INSERT OR REPLACE to handle both creation and update
+    cursor.execute("INSERT OR REPLACE INTO user_data (username, category, key, value) VALUES (?, ?, ?, ?)",
+                   (username, category, key, value))
+    bump_data_version(cursor, username, category)
+
+def remove_user_data(cursor, username, category, key):
+    """Deletes a single data item without committing."""
+    cursor.execute("DELETE FROM user_data WHERE username = ? AND category = ? AND key = ?",
+                   (username, category, key))
+    if cursor.rowcount:
+        bump_data_version(cursor, username, category)
+
+# --- Change Notifications ---
+
+class ChangeNotifier:
+    """Wakes up the watch requests of a user when a handler in this process commits a change."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._generations = {}
+
+    def generation(self, username):
+        """Returns a counter that changes whenever notify() is called for the user."""
+        with self._condition:
+            return self._generations.get(username, 0)
+
+    def notify(self, username):
+        with self._condition:
+            self._generations[username] = self._generations.get(username, 0) + 1
+            self._condition.notify_all()
+
+    def wait(self, username, generation, timeout):
+        """Blocks until notify() is called for the user after `generation`, or the timeout passes."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._generations.get(username, 0) != generation, timeout)
+
+_change_notifier = ChangeNotifier()
+
+def get_latest_version(username):
+    """Returns the user's current change cursor."""
+    cursor = get_data_db(username).cursor()
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM user_data_versions WHERE username = ?", (username,))
+    return cursor.fetchone()[0]
+
+def fetch_changes(username, since):
+    """Returns the categories changed after version `since`, oldest change first."""
+    cursor = get_data_db(username).cursor()
+    cursor.execute(
+        "SELECT category, version FROM user_data_versions WHERE username = ? AND version > ? ORDER BY version",
+        (username, since)
+    )
+    return [{'category': category, 'version': version} for category, version in cursor.fetchall()]
+
+def wait_for_changes(username, since, timeout):
+    """Waits up to `timeout` seconds for changes after version `since` and returns them."""
+    deadline = time.monotonic() + timeout
+    while True:
+        generation = _change_notifier.generation(username)
+        changes = fetch_changes(username, since)
+        # Don't keep pooled connections out of circulation while idle.
+        release_db()
+        remaining = deadline - time.monotonic()
+        if changes or remaining <= 0:
+            return changes
+        _change_notifier.wait(username, generation, min(remaining, WATCH_POLL_INTERVAL))
+
+def iter_change_events(username, since, duration=WATCH_STREAM_DURATION):
+    """Yields Server-Sent Events for the user's changes until `duration` seconds have passed."""
+    deadline = time.monotonic() + duration
+    try:
+        # Ask the browser to reconnect quickly once the stream is closed.
+        yield b'retry: 1000\n\n'
+        while time.monotonic() < deadline:
+            changes = wait_for_changes(username, since, min(WATCH_HEARTBEAT_INTERVAL, deadline - time.monotonic()))
+            if not changes:
+                yield b': keep-alive\n\n'
+                continue
+            for change in changes:
+                # The id comes back as Last-Event-ID when the browser reconnects.
+                yield f"id: {change['version']}\nevent: change\ndata: {json.dumps(change)}\n\n".encode('utf-8')
+            since = changes[-1]['version']
+    finally:
+        release_db()
+
+def handle_watch_ticket(form_data):
+    """Issues a ticket that opens a watch for the session, for clients that cannot send the token."""
+    token = form_data.get('token')
+    if not validate_token(token):
+        return {'status': 'error', 'message': 'Invalid or expired session.'}
+
+    import uuid
+    ticket = str(uuid.uuid4())
+    now = current_timestamp()
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM watch_tickets WHERE expires_at < ?", (now,))
+    cursor.execute("INSERT INTO watch_tickets (ticket, token, expires_at) VALUES (?, ?, ?)",
+                   (ticket, token, now + WATCH_TICKET_LIFETIME))
+    conn.commit()
+    return {'status': 'success', 'ticket': ticket, 'expires_in': WATCH_TICKET_LIFETIME}
+
+def validate_watch_ticket(ticket):
+    """Returns the user a watch ticket was issued to, or None if it or its session has expired."""
+    now = current_timestamp()
+    cursor = get_db().cursor()
+    cursor.execute(
+        "SELECT s.username FROM watch_tickets t JOIN sessions s ON s.token = t.token "
+        "WHERE t.ticket = ? AND t.expires_at >= ? AND s.expires_at >= ?",
+        (ticket, now, now)
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def handle_watch(form_data, environ):
+    """Reports changes to the user's data, as Server-Sent Events or as a long-poll answer.
+
+    `cursor` (or the Last-Event-ID header of a reconnecting EventSource) is the last
+    version the client has seen; without one, only changes from now on are reported.
+    Each change names a category and its new version; the client then re-reads that
+    category with get_data (or history_tail for HISTORY).
+
+    A POST authenticates with its `token`. Since EventSource cannot send a body,
+    `ticket` (from watch_ticket) and `cursor` are also accepted in the query string,
+    which never carries the session token itself. Under plain CGI every watch holds
+    a whole process, so an event stream there ends after one long-poll period and
+    the browser reconnects.
+    """
+    query_params = parse_qs(environ.get('QUERY_STRING', ''))
+    def get_param(name):
+        return form_data.get(name) or query_params.get(name, [None])[0]
+
+    ticket = get_param('ticket')
+    username = validate_watch_ticket(ticket) if ticket else validate_token(form_data.get('token'))
+    if not username:
+        return {'status': 'error', 'message': 'Invalid or expired session.'}
+    try:
+        since = parse_history_int(environ.get('HTTP_LAST_EVENT_ID') or get_param('cursor'), 'cursor', None)
+    except ValueError as e:
+        return {'status': 'error', 'message': str(e)}
+    if since is None:
+        since = get_latest_version(username)
+
+    if 'text/event-stream' in environ.get('HTTP_ACCEPT', ''):
+        # WSGI servers pass wsgi.input; a CGI process gets its environment from os.environ.
+        duration = WATCH_STREAM_DURATION if 'wsgi.input' in environ else WATCH_TIMEOUT
+        return EventStream(iter_change_events(username, since, duration))
+    changes = wait_for_changes(username, since, WATCH_TIMEOUT)
+    return {'status': 'success', 'cursor': changes[-1]['version'] if changes else since, 'changes': changes}
+
+def handle_get_data(form_data, environ):
+    """Fetches data for a given category for a validated user.
+
+    A single category can be read page by page: `limit` caps the number of rows,
+    `after_key`/`before_key` bound the key range and `prefix` filters on the key.
+    When a limit is given the response carries a `next_cursor`, the last key of the
+    page, to pass as `after_key` (ascending) or `before_key` (descending) next time.
+
+    The response carries an ETag derived from the categories' version counters. It
+    may also be requested with a GET, its fields in the query string and the token
+    in an X-Token header, so the browser caches it and revalidates it with
+    If-None-Match. A GET whose tag still matches gets a 304 without reading any
+    rows; any other method gets a 412. URLs end up in access logs, so a token in
+    the query string of a GET is ignored.
+    """
+    conditional = environ.get('REQUEST_METHOD', 'POST') in ('GET', 'HEAD')
+    if conditional:
+        form_data = {name: values[0] for name, values in parse_qs(environ.get('QUERY_STRING', '')).items()}
+        token = environ.get('HTTP_X_TOKEN')
+    else:
+        token = form_data.get('token')
+    category = form_data.get('category')
+    sort_order = form_data.get('sort_order', 'ASC').upper() # Default to ASC
+    username = validate_token(token)
+    if not username:
+        return {'status': 'error', 'message': 'Invalid or expired session.'}
+
+    if not category:
+        return {'status': 'error', 'message': 'category is required.'}
+
+    try:
+        page = parse_page_params(form_data)
+        conn = get_data_db(username)
+        cursor = conn.cursor()
+        etag = get_data_etag(cursor, username, category, sort_order, page)
+        headers = [('ETag', etag), ('Cache-Control', 'private, no-cache'), ('Vary', 'X-Token')]
+        if etag_matches(environ.get('HTTP_IF_NONE_MATCH'), etag):
+            if not conditional:
+                return Response({'status': 'error', 'message': 'Precondition failed.'}, '412 Precondition Failed')
+            return Response(None, '304 Not Modified', headers)
+        data, next_cursor = fetch_user_data(cursor, username, category, sort_order, page)
+    except ValueError as e:
+        return {'status': 'error', 'message': str(e)}
+    response = {'status': 'success', 'data': data}
+    if 'limit' in page:
+        response['next_cursor'] = next_cursor
+    return Response(response, headers=headers)
 
 def handle_set_data(form_data):
     """Sets a single data item for a validated user."""
@@ -303,16 +1024,12 @@ def handle_set_data(form_data):
     if not category or key is None or value is None:
         return {'status': 'error', 'message': 'category, key, and value are required.'}
 
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_data_db(username)
     cursor = conn.cursor()
-    try:
-        # Use INSERT OR REPLACE to handle both creation and update
-        cursor.execute("INSERT OR REPLACE INTO user_data (username, category, key, value) VALUES (?, ?, ?, ?)",
-                       (username, category, key, value))
-        conn.commit()
-        return {'status': 'success', 'message': f'Data for category {category} set.'}
-    finally:
-        conn.close()
+    store_user_data(cursor, username, category, key, value)
+    conn.commit()
+    _change_notifier.notify(username)
+    return {'status': 'success', 'message': f'Data for category {category} set.'}
 
 def handle_delete_data(form_data):
     """Deletes a single data item for a validated user."""
@@ -325,80 +1042,643 @@ def handle_delete_data(form_data):
     if not category or not key:
         return {'status': 'error', 'message': 'category and key are required.'}
 
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_data_db(username)
     cursor = conn.cursor()
+    remove_user_data(cursor, username, category, key)
+    conn.commit()
+    _change_notifier.notify(username)
+    return {'status': 'success', 'message': f'Data for category {category} at key {key} deleted.'}
+
+def validate_batch_operation(operation):
+    """Returns an error message for a malformed batch operation, or None if it is valid."""
+    if not isinstance(operation, dict):
+        return 'operation must be an object.'
+    op = operation.get('op')
+    category = operation.get('category')
+    key = operation.get('key')
+    if op not in ('get', 'set', 'delete'):
+        return 'op must be one of get, set or delete.'
+    if not isinstance(category, str) or not category:
+        return 'category is required.'
+    if op == 'set' and (not isinstance(key, str) or not isinstance(operation.get('value'), str)):
+        return 'key and value are required.'
+    if op == 'delete' and (not isinstance(key, str) or not key):
+        return 'key is required.'
+    if op == 'get':
+        try:
+            page = parse_page_params(operation)
+        except ValueError as e:
+            return str(e)
+        if page and ',' in category:
+            return 'Paging is only supported for a single category.'
+    return None
+
+def handle_batch(form_data):
+    """Applies an ordered list of get/set/delete operations in a single transaction."""
+    token = form_data.get('token')
+    username = validate_token(token)
+    if not username:
+        return {'status': 'error', 'message': 'Invalid or expired session.'}
+
     try:
-        cursor.execute("DELETE FROM user_data WHERE username = ? AND category = ? AND key = ?",
-                       (username, category, key))
-        conn.commit()
-        return {'status': 'success', 'message': f'Data for category {category} at key {key} deleted.'}
+        operations = json.loads(form_data.get('operations', ''))
+    except ValueError:
+        return {'status': 'error', 'message': 'operations must be a JSON list.'}
+    if not isinstance(operations, list):
+        return {'status': 'error', 'message': 'operations must be a JSON list.'}
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return {'status': 'error', 'message': f'A batch may contain at most {BATCH_MAX_OPERATIONS} operations.'}
+
+    # Reject the whole batch up front so it is never partially applied.
+    for index, operation in enumerate(operations):
+        error = validate_batch_operation(operation)
+        if error:
+            return {'status': 'error', 'message': f'Operation {index}: {error}'}
+
+    conn = get_data_db(username)
+    cursor = conn.cursor()
+    results = []
+    for operation in operations:
+        op = operation['op']
+        category = operation['category']
+        if op == 'get':
+            sort_order = str(operation.get('sort_order', 'ASC')).upper()
+            page = parse_page_params(operation)
+            data, next_cursor = fetch_user_data(cursor, username, category, sort_order, page)
+            result = {'status': 'success', 'data': data}
+            if 'limit' in page:
+                result['next_cursor'] = next_cursor
+            results.append(result)
+        elif op == 'set':
+            store_user_data(cursor, username, category, operation['key'], operation['value'])
+            results.append({'status': 'success'})
+        else:
+            remove_user_data(cursor, username, category, operation['key'])
+            results.append({'status': 'success'})
+    # One commit for the whole batch; release_db() rolls back if anything above raised.
+    conn.commit()
+    if any(operation['op'] != 'get' for operation in operations):
+        _change_notifier.notify(username)
+    return {'status': 'success', 'results': results}
+
+def parse_history_int(value, name, default, minimum=0, maximum=None):
+    """Parses an integer history parameter. Raises ValueError if invalid."""
+    if value in (None, ''):
+        return default
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be an integer.')
+    if value < minimum:
+        raise ValueError(f'{name} must be at least {minimum}.')
+    return min(value, maximum) if maximum is not None else value
+
+def history_rows_to_entries(rows):
+    """Turns (seq, command, created_at) rows into response entries."""
+    return [{'seq': seq, 'command': command, 'created_at': created_at} for seq, command, created_at in rows]
+
+def append_history(cursor, username, command, histsize):
+    """Appends a command and trims the user's history to `histsize` entries. Returns its seq.
+
+    A command identical to the previous one is not stored again.
+    """
+    cursor.execute(
+        "SELECT seq, command FROM history WHERE username = ? ORDER BY seq DESC LIMIT 1", (username,)
+    )
+    last = cursor.fetchone()
+    if last and last[1] == command:
+        return last[0]
+    seq = last[0] + 1 if last else 1
+    cursor.execute(
+        "INSERT INTO history (username, seq, command, created_at) VALUES (?, ?, ?, ?)",
+        (username, seq, command, current_timestamp())
+    )
+    # Only the entries that just fell out of the window are deleted, so this stays cheap.
+    cursor.execute("DELETE FROM history WHERE username = ? AND seq <= ?", (username, seq - histsize))
+    bump_data_version(cursor, username, HISTORY_CATEGORY)
+    return seq
+
+def handle_history_append(form_data):
+    """Appends a command to the user's shell history."""
+    token = form_data.get('token')
+    command = form_data.get('command')
+    username = validate_token(token)
+    if not username:
+        return {'status': 'error', 'message': 'Invalid or expired session.'}
+    if not command:
+        return {'status': 'error', 'message': 'command is required.'}
+    try:
+        histsize = parse_history_int(form_data.get('histsize'), 'histsize', HISTORY_DEFAULT_SIZE, 1, HISTORY_DEFAULT_SIZE)
+        histsize = max(histsize, HISTORY_MIN_SIZE)
+    except ValueError as e:
+        return {'status': 'error', 'message': str(e)}
+
+    conn = get_data_db(username)
+    cursor = conn.cursor()
+    # Serialize appends of concurrent requests so they never pick the same seq.
+    cursor.execute("BEGIN IMMEDIATE")
+    seq = append_history(cursor, username, command, histsize)
+    conn.commit()
+    _change_notifier.notify(username)
+    return {'status': 'success', 'seq': seq}
+
+def handle_history_tail(form_data):
+    """Returns the last `limit` history entries, oldest first."""
+    token = form_data.get('token')
+    username = validate_token(token)
+    if not username:
+        return {'status': 'error', 'message': 'Invalid or expired session.'}
+    try:
+        limit = parse_history_int(form_data.get('limit'), 'limit', HISTORY_MAX_SIZE, 1, HISTORY_MAX_SIZE)
+    except ValueError as e:
+        return {'status': 'error', 'message': str(e)}
+
+    conn = get_data_db(username)
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT seq, command, created_at FROM history WHERE username = ? ORDER BY seq DESC LIMIT ?",
+        (username, limit)
+    )
+    return {'status': 'success', 'entries': history_rows_to_entries(reversed(cursor.fetchall()))}
+
+def handle_history_range(form_data):
+    """Returns the history entries with start <= seq <= end, oldest first, at most `limit` of them."""
+    token = form_data.get('token')
+    username = validate_token(token)
+    if not username:
+        return {'status': 'error', 'message': 'Invalid or expired session.'}
+    try:
+        start = parse_history_int(form_data.get('start'), 'start', 1)
+        end = parse_history_int(form_data.get('end'), 'end', None)
+        limit = parse_history_int(form_data.get('limit'), 'limit', HISTORY_MAX_SIZE, 1, HISTORY_MAX_SIZE)
+    except ValueError as e:
+        return {'status': 'error', 'message': str(e)}
+
+    query = "SELECT seq, command, created_at FROM history WHERE username = ? AND seq >= ?"
+    params = [username, start]
+    if end is not None:
+        query += " AND seq <= ?"
+        params.append(end)
+    query += " ORDER BY seq LIMIT ?"
+    params.append(limit)
+
+    conn = get_data_db(username)
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    entries = history_rows_to_entries(cursor.fetchall())
+    # Where to continue from when the range was cut short by the limit.
+    next_start = entries[-1]['seq'] + 1 if len(entries) == limit else None
+    return {'status': 'success', 'entries': entries, 'next_start': next_start}
+
+def handle_history_search(form_data):
+    """Returns the history entries containing `query`, newest first."""
+    token = form_data.get('token')
+    query = form_data.get('query')
+    username = validate_token(token)
+    if not username:
+        return {'status': 'error', 'message': 'Invalid or expired session.'}
+    if not query:
+        return {'status': 'error', 'message': 'query is required.'}
+    try:
+        limit = parse_history_int(form_data.get('limit'), 'limit', HISTORY_DEFAULT_SIZE, 1, HISTORY_MAX_SIZE)
+        before = parse_history_int(form_data.get('before'), 'before', None)
+    except ValueError as e:
+        return {'status': 'error', 'message': str(e)}
+
+    sql = "SELECT seq, command, created_at FROM history WHERE username = ? AND instr(command, ?) > 0"
+    params = [username, query]
+    if before is not None:
+        # Lets a reverse search (Ctrl+R) continue past the match it is showing.
+        sql += " AND seq < ?"
+        params.append(before)
+    sql += " ORDER BY seq DESC LIMIT ?"
+    params.append(limit)
+
+    conn = get_data_db(username)
+    cursor = conn.cursor()
+    cursor.execute(sql, params)
+    return {'status': 'success', 'entries': history_rows_to_entries(cursor.fetchall())}
+
+def parse_form_data(stream=None, environ=None):
+    """Parses the request body into a dict of fields. Raises RequestBodyError for a bad or oversized body."""
+    if stream is None:
+        stream = sys.stdin.buffer
+    if environ is None:
+        environ = os.environ
+    return parse_body(stream, environ, field_limits=FIELD_SIZE_LIMITS)
+
+def handle_metrics():
+    """Returns the request metrics in the Prometheus text format, if server.conf enables the endpoint."""
+    if not metrics_endpoint_enabled():
+        return {'status': 'error', 'message': 'Invalid action.'}
+    return TextResponse(render_prometheus(), PROMETHEUS_CONTENT_TYPE)
+
+def handle_validate(form_data):
+    """Checks the token and extends its life, used on page load."""
+    token = form_data.get('token')
+    username = validate_and_update_token(token)
+    if username:
+        return {'status': 'success', 'message': 'Session is valid.'}
+    else:
+        return {'status': 'error', 'message': 'Invalid or expired session.'}
+
+class Response:
+    """A handler result that needs a status or headers other than the defaults."""
+
+    def __init__(self, data, status='200 OK', headers=None):
+        self.data = data
+        self.status = status
+        self.headers = headers or []
+
+class TextResponse:
+    """A handler result that is sent as-is instead of as JSON."""
+
+    def __init__(self, text, content_type='text/plain; charset=utf-8'):
+        self.text = text
+        self.content_type = content_type
+
+class EventStream:
+    """A handler result that is sent as a text/event-stream while it is being produced."""
+
+    def __init__(self, events):
+        # An iterable of bytes, each one or more complete events.
+        self.events = events
+
+def render_response(response, environ=None):
+    """Turns a handler result into (status, headers, body chunks) for the CGI and WSGI entry points."""
+    if environ is None:
+        environ = {}
+    if isinstance(response, EventStream):
+        # Never compressed: the compressor and proxies would hold events back.
+        headers = [('Content-Type', 'text/event-stream'), ('Cache-Control', 'no-store'), ('X-Accel-Buffering', 'no')]
+        return '200 OK', headers, response.events
+    if isinstance(response, TextResponse):
+        body = response.text.encode('utf-8')
+        headers = [('Content-Type', response.content_type), ('Content-Length', str(len(body))), ('Cache-Control', 'no-store')]
+        return '200 OK', headers, [body]
+    if not isinstance(response, Response):
+        response = Response(response)
+    encoding = negotiate_encoding(environ.get('HTTP_ACCEPT_ENCODING'))
+    extra_headers = list(response.headers)
+    # Responses may carry tokens or private data, so nothing is cached unless a handler says so.
+    if not any(name == 'Cache-Control' for name, _ in extra_headers):
+        extra_headers.append(('Cache-Control', 'no-store'))
+
+    if response.data is None:
+        # Echo the tag of the compressed variant if that is what the client has cached.
+        if encoding and wants_encoded_etag(environ.get('HTTP_IF_NONE_MATCH'), encoding):
+            extra_headers = encode_etag_header(extra_headers, encoding)
+        return response.status, extra_headers, [b'']
+
+    # Encode incrementally so a large result is never held as one string next to its compressed copy.
+    chunks = rechunk(piece.encode('utf-8') for piece in json.JSONEncoder().iterencode(response.data))
+    first = next(chunks, b'')
+    if encoding is None or len(first) < COMPRESS_MIN_SIZE:
+        # Either the client cannot decode it or the whole body fits in the first chunk
+        # and is too small to be worth compressing.
+        body = first + b''.join(chunks)
+        headers = [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))]
+        return response.status, headers + extra_headers, [body]
+
+    headers = [('Content-Type', 'application/json'), ('Content-Encoding', encoding), ('Vary', 'Accept-Encoding')]
+    body = compress_stream(itertools.chain([first], chunks), encoding)
+    return response.status, headers + encode_etag_header(extra_headers, encoding), body
+
+# --- Admission Control ---
+_admission_store = AdmissionStore(ADMISSION_DB_FILE)
+
+def get_client_address(environ):
+    """Returns the client's address, from X-Forwarded-For if the request came through a trusted proxy."""
+    address = environ.get('REMOTE_ADDR', '')
+    forwarded = environ.get('HTTP_X_FORWARDED_FOR')
+    if forwarded and address in TRUSTED_PROXIES:
+        # The last entry was added by our proxy; the ones before it could be forged by the client.
+        address = forwarded.split(',')[-1].strip()
+    return address
+
+def admit_request(action, form_data, environ):
+    """Applies the limits of an action. Returns (slot id or None, seconds to wait or 0).
+
+    The slot is taken first, so a request turned away for concurrency costs no tokens.
+    """
+    buckets = []
+    for scope, value in (('ip', get_client_address(environ)), ('user', form_data.get('username'))):
+        rate = RATE_LIMITS.get((action, scope))
+        if rate and value:
+            if scope == 'user':
+                # Keeps submitted names out of the state file and its keys short.
+                import hashlib
+                value = hashlib.sha256(str(value).encode('utf-8')).hexdigest()[:32]
+            buckets.append((f'{action}:{scope}:{value}', *rate))
+    limit = CONCURRENCY_LIMITS.get(action)
+    if not buckets and not limit:
+        return None, 0
+
+    slot_id = None
+    try:
+        if limit:
+            slot_id = _admission_store.acquire_slot(action, limit, CONCURRENCY_LEASES.get(action))
+            if slot_id is None:
+                return None, CONCURRENCY_RETRY_AFTER
+        retry_after = _admission_store.take_tokens(buckets)
+        if retry_after:
+            if slot_id:
+                release_admission_slot(slot_id)
+            return None, retry_after
+    except sqlite3.Error as e:
+        # The limits protect the service; a broken state file must not take it down.
+        print(f"Admission control unavailable: {e}", file=sys.stderr)
+    return slot_id, 0
+
+def release_admission_slot(slot_id):
+    """Gives back the slot taken by admit_request(). A leftover slot expires after its lease."""
+    try:
+        _admission_store.release_slot(slot_id)
+    except sqlite3.Error as e:
+        # The response is already computed; don't replace it with an error.
+        print(f"Admission control unavailable: {e}", file=sys.stderr)
+
+def release_slot_when_done(events, slot_id):
+    """Passes on the chunks of a stream, then gives back the admission slot it was sent under."""
+    try:
+        yield from events
     finally:
-        conn.close()
+        release_admission_slot(slot_id)
 
-def parse_form_data():
-    """Parses multipart/form-data from stdin without using the cgi module."""
+def too_many_requests(retry_after):
+    """Builds the 429 answer for a request turned away by admission control."""
+    return Response({'status': 'error', 'message': 'Too many requests. Please try again later.'},
+                    '429 Too Many Requests', [('Retry-After', str(max(1, math.ceil(retry_after))))])
+
+def handle_request(action, form_data, environ=None):
+    """Dispatches an action to its handler. Shared by the CGI and WSGI entry points."""
+    if environ is None:
+        environ = {}
+    slot_id = None
     try:
-        content_type = os.environ.get('CONTENT_TYPE', '')
-        if 'multipart/form-data' in content_type:
-            # Construct a full message header to use the email parser
-            headers = f"Content-Type: {content_type}\n\n"
-            # Read the body from stdin
-            body = sys.stdin.read()
-            msg = message_from_string(headers + body)
-            form_data = {}
-            if msg.is_multipart():
-                for part in msg.get_payload():
-                    name = part.get_param('name', header='content-disposition')
-                    if name:
-                        form_data[name] = part.get_payload(decode=True).decode('utf-8')
-            return form_data
-    except Exception as e:
-        return {}
-    return {}
+        slot_id, retry_after = admit_request(action, form_data, environ)
+        if retry_after:
+            return too_many_requests(retry_after)
+        ensure_db()
+
+        # Add a validate action to check and extend the token on page load
+        if action == 'validate':
+            return handle_validate(form_data)
+        elif action == 'add_user':
+            return handle_useradd(form_data)
+        elif action == 'login':
+            return handle_login(form_data)
+        elif action == 'change_password':
+            return handle_passwd(form_data)
+        elif action == 'logout':
+            return handle_logout(form_data)
+        elif action == 'logout_all':
+            return handle_logout_all(form_data)
+        elif action == 'get_data':
+            return handle_get_data(form_data, environ)
+        elif action == 'set_data':
+            return handle_set_data(form_data)
+        elif action == 'delete_data':
+            return handle_delete_data(form_data)
+        elif action == 'batch':
+            return handle_batch(form_data)
+        elif action == 'history_append':
+            return handle_history_append(form_data)
+        elif action == 'history_tail':
+            return handle_history_tail(form_data)
+        elif action == 'history_range':
+            return handle_history_range(form_data)
+        elif action == 'history_search':
+            return handle_history_search(form_data)
+        elif action == 'watch_ticket':
+            return handle_watch_ticket(form_data)
+        elif action == 'watch':
+            response = handle_watch(form_data, environ)
+            if isinstance(response, EventStream) and slot_id:
+                # Hold the slot until the stream ends, not just until it starts.
+                response.events = release_slot_when_done(response.events, slot_id)
+                slot_id = None
+            return response
+        elif action == 'metrics':
+            return handle_metrics()
+        else:
+            return {'status': 'error', 'message': 'Invalid action.'}
+    finally:
+        if slot_id:
+            release_admission_slot(slot_id)
+        release_db()
 
 def main():
     """Main function to handle CGI requests."""
-    print("Content-Type: application/json")
-    print() # End of headers
-
-    init_db()
-
     query_string = os.environ.get('QUERY_STRING', '')
     query_params = parse_qs(query_string)
     action = query_params.get('action', [None])[0]
+    request = begin_request(action, os.environ)
 
-    form_data = parse_form_data()
+    try:
+        form_data = parse_form_data()
+    except RequestBodyError as e:
+        response = Response({'status': 'error', 'message': str(e)}, e.status)
+    else:
+        response = handle_request(action, form_data, os.environ)
 
-    # Debug print to see what the server is receiving. This will go to the Apache error log.
-    print(f"DEBUG: action='{action}', form_data='{form_data}'", file=sys.stderr)
+    status, headers, body = render_response(response, os.environ)
+    print(f"Status: {status}")
+    for name, value in headers:
+        print(f"{name}: {value}")
+    print() # End of headers
+    sys.stdout.flush()
+    try:
+        # Flush every chunk so an event stream reaches the client as it is produced.
+        for chunk in count_bytes(request, body):
+            sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+    finally:
+        end_request(request, status)
 
-    response = {}
-    # Add a validate action to check and extend the token on page load
-    if action == 'validate':
-        token = form_data.get('token')
-        username = validate_and_update_token(token)
-        if username:
-            response = {'status': 'success', 'message': 'Session is valid.'}
-        else:
-            response = {'status': 'error', 'message': 'Invalid or expired session.'}
-    elif action == 'add_user':
-        response = handle_useradd(form_data)
-    elif action == 'login':
-        response = handle_login(form_data)
-    elif action == 'change_password':
-        response = handle_passwd(form_data)
-    elif action == 'logout':
-        response = handle_logout(form_data)
-    elif action == 'get_data':
-        response = handle_get_data(form_data)
-    elif action == 'set_data':
-        response = handle_set_data(form_data)
-    elif action == 'delete_data':
-        response = handle_delete_data(form_data)
+# --- WSGI Application ---
+
+def application(environ, start_response):
+    """WSGI entry point. Keeps the schema and database connections alive between requests."""
+    query_params = parse_qs(environ.get('QUERY_STRING', ''))
+    action = query_params.get('action', [None])[0]
+    request = begin_request(action, environ)
+
+    try:
+        form_data = parse_form_data(environ['wsgi.input'], environ)
+    except RequestBodyError as e:
+        response = Response({'status': 'error', 'message': str(e)}, e.status)
     else:
-        response = {'status': 'error', 'message': 'Invalid action.'}
+        response = handle_request(action, form_data, environ)
+
+    status, headers, body = render_response(response, environ)
+    start_response(status, headers)
+    # The request is recorded once its last chunk has been sent.
+    return iter_with_metrics(request, status, body)
+
+def serve(host, port):
+    """Runs the WSGI application on a local threaded server."""
+    ensure_db()
+    start_session_sweeper()
+    with make_threaded_server(host, port, application) as httpd:
+        print(f"Serving Accounting API on http://{host}:{port}/", file=sys.stderr)
+        httpd.serve_forever()
+
+# --- Backup and Bulk Transfer ---
 
-    print(json.dumps(response))
+def backup_file(source_file, dest_file, pages=BACKUP_PAGES_PER_STEP):
+    """Takes a consistent snapshot of a live database file with the sqlite3 backup API."""
+    os.makedirs(os.path.dirname(dest_file), exist_ok=True)
+    tmp_file = dest_file + '.tmp'
+    source = connect_db(source_file)
+    dest = sqlite3.connect(tmp_file)
+    try:
+        # Copy a bounded number of pages per step so writers only wait for one step.
+        # If another connection writes in between, SQLite restarts the copy itself.
+        source.backup(dest, pages=pages)
+    finally:
+        dest.close()
+        source.close()
+    os.replace(tmp_file, dest_file)
+
+def backup_databases(dest_dir, pages=BACKUP_PAGES_PER_STEP):
+    """Backs up DB_FILE and every shard into dest_dir. Returns the files written."""
+    written = []
+    for source_file in list_data_files():
+        relative = os.path.relpath(source_file, DB_DIR)
+        dest_file = os.path.join(dest_dir, relative)
+        backup_file(source_file, dest_file, pages)
+        written.append(dest_file)
+    return written
+
+def get_table_columns(conn, table):
+    """Returns the column names of a table."""
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+def export_ndjson(out):
+    """Writes every exported row as one `{"table": ..., "row": {...}}` line. Returns the row count.
+
+    Rows are streamed straight from the cursors, so memory use does not depend
+    on the size of the database.
+    """
+    count = 0
+    for table in EXPORT_TABLES:
+        files = list_data_files() if table in SHARDED_TABLES else [DB_FILE]
+        for path in files:
+            ensure_db(path)
+            conn = get_db(path)
+            columns = get_table_columns(conn, table)
+            for row in conn.execute(f"SELECT * FROM {table}"):
+                out.write(json.dumps({'table': table, 'row': dict(zip(columns, row))}) + '\n')
+                count += 1
+        release_db()
+    return count
+
+def import_ndjson(lines, batch_size=IMPORT_BATCH_SIZE):
+    """Inserts rows from an NDJSON export, replacing rows with the same key. Returns the row count.
+
+    Rows are routed to the main file or the user's shard and written in
+    transactions of at most batch_size rows, so memory use stays constant.
+    """
+    ensure_db()
+    known_columns = {table: set(get_table_columns(get_db(), table)) for table in EXPORT_TABLES}
+    pending = {}
+    buffered = 0
+    count = 0
+
+    def flush():
+        for (path, table, columns), rows in pending.items():
+            conn = get_db(path)
+            placeholders = ', '.join('?' for _ in columns)
+            conn.executemany(f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+        for conn in getattr(_db_local, 'conns', {}).values():
+            conn.commit()
+        pending.clear()
+
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            table, row = record['table'], record['row']
+        except (ValueError, KeyError, TypeError):
+            raise ValueError(f"Line {line_number}: not an export record.")
+        # Table and column names end up in SQL, so only known ones are accepted.
+        if table not in known_columns or not isinstance(row, dict) or not set(row) <= known_columns[table]:
+            raise ValueError(f"Line {line_number}: unknown table or columns.")
+        path = get_shard_file(row.get('username', '')) if table in SHARDED_TABLES else DB_FILE
+        ensure_db(path)
+        columns = tuple(sorted(row))
+        pending.setdefault((path, table, columns), []).append(tuple(row[c] for c in columns))
+        buffered += 1
+        count += 1
+        if buffered >= batch_size:
+            flush()
+            buffered = 0
+    flush()
+    release_db()
+    return count
+
+def cli(argv):
+    """Command line entry point for running Accounting.py outside of CGI."""
+    import argparse
+    parser = argparse.ArgumentParser(prog='Accounting.py', description='Nnoitra Terminal accounting API.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve', help='Run as a long-lived WSGI server.')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8001)
+
+    subparsers.add_parser('migrate', help='Bring the database schema up to date.')
+    subparsers.add_parser('reshard', help='Move user data to the files given by data-shards in server.conf. Stop the servers first.')
+    backup_parser = subparsers.add_parser('backup', help='Take a consistent snapshot of the live databases.')
+    backup_parser.add_argument('dest', help='Directory to write the snapshot to.')
+    backup_parser.add_argument('--pages', type=int, default=BACKUP_PAGES_PER_STEP, help='Pages copied per step.')
+    export_parser = subparsers.add_parser('export', help='Write all accounts and their data as NDJSON.')
+    export_parser.add_argument('file', nargs='?', default='-', help='Output file, or - for stdout.')
+    import_parser = subparsers.add_parser('import', help='Load an NDJSON export, replacing existing rows.')
+    import_parser.add_argument('file', nargs='?', default='-', help='Input file, or - for stdin.')
+    import_parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help='Rows per transaction.')
+    subparsers.add_parser('sweep-sessions', help='Delete expired sessions. Run this periodically (e.g. from cron) under CGI.')
+    subparsers.add_parser('metrics', help='Print the metrics collected in metrics-file by CGI requests.')
+
+    args = parser.parse_args(argv)
+    if args.command == 'serve':
+        serve(args.host, args.port)
+    elif args.command == 'migrate':
+        init_db()
+        print(f"Schema version {migrate_db(get_db())}")
+    elif args.command == 'reshard':
+        print(f"Moved the data of {reshard_user_data()} users")
+    elif args.command == 'backup':
+        for dest_file in backup_databases(args.dest, args.pages):
+            print(f"Wrote {dest_file}")
+    elif args.command == 'export':
+        if args.file == '-':
+            count = export_ndjson(sys.stdout)
+        else:
+            with open(args.file, 'w', encoding='utf-8') as f:
+                count = export_ndjson(f)
+        print(f"Exported {count} rows", file=sys.stderr)
+    elif args.command == 'import':
+        try:
+            if args.file == '-':
+                count = import_ndjson(sys.stdin, args.batch_size)
+            else:
+                with open(args.file, 'r', encoding='utf-8') as f:
+                    count = import_ndjson(f, args.batch_size)
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"Imported {count} rows", file=sys.stderr)
+    elif args.command == 'sweep-sessions':
+        ensure_db()
+        print(f"Removed {sweep_expired_sessions()} expired sessions")
+    elif args.command == 'metrics':
+        sys.stdout.write(render_prometheus())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # A CGI request never carries command line arguments.
+    if 'GATEWAY_INTERFACE' in os.environ or len(sys.argv) == 1:
+        main()
+    else:
+        cli(sys.argv[1:])
@@ -0,0 +1,158 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Concurrency limits and token buckets shared by all worker processes of an API script."""
+import os
+import time
+import sqlite3
+import threading
+
+# A concurrency slot whose process died without releasing it is reclaimed after this long.
+SLOT_LEASE = 60
+# About once per BUCKET_CLEANUP_ODDS checks, buckets that have filled up again are
+# deleted (a full bucket is the same as a missing one), and if more than MAX_BUCKETS
+# remain, those closest to full go too. This bounds the file however many
+# addresses or usernames clients send.
+BUCKET_CLEANUP_ODDS = 100
+MAX_BUCKETS = 100000
+# Bumped when the tables change; an older state file is simply emptied.
+STORE_VERSION = 2
+# Waiting this long for the state file is still cheaper than the work being limited.
+STORE_TIMEOUT = 2
+
+def parse_rate(value):
+    """Parses a rate like "20/60" (20 requests per 60 seconds) into (capacity, period), or None for "0"."""
+    count, _, period = str(value).partition('/')
+    count = int(count)
+    period = float(period or 1)
+    if count <= 0 or period <= 0:
+        return None
+    return count, period
+
+class AdmissionStore:
+    """Limiter state kept in a small SQLite file, so every CGI or WSGI process sees the same counts.
+
+    The file only holds state that is worth a few seconds; it may be deleted at any time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def connect(self):
+        """Returns this thread's connection to the state file, creating the schema if needed."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Autocommit mode: every check is its own BEGIN IMMEDIATE transaction.
+        conn = sqlite3.connect(self.path, timeout=STORE_TIMEOUT, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] != STORE_VERSION:
+                conn.execute("DROP TABLE IF EXISTS buckets")
+                conn.execute("DROP TABLE IF EXISTS slots")
+                conn.execute('''
+                    CREATE TABLE buckets (
+                        key TEXT PRIMARY KEY,
+                        tokens REAL NOT NULL,
+                        updated_at REAL NOT NULL,
+                        full_at REAL NOT NULL
+                    )''')
+                conn.execute("CREATE INDEX buckets_full_at ON buckets (full_at)")
+                conn.execute('''
+                    CREATE TABLE slots (
+                        id TEXT PRIMARY KEY,
+                        action TEXT NOT NULL,
+                        expires_at REAL NOT NULL
+                    )''')
+                conn.execute("CREATE INDEX slots_action ON slots (action, expires_at)")
+                conn.execute(f"PRAGMA user_version = {STORE_VERSION}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            conn.close()
+            raise
+        self._local.conn = conn
+        return conn
+
+    def take_tokens(self, buckets):
+        """Takes one token from each (key, capacity, period) bucket.
+
+        Either every bucket is charged or none is. Returns 0 on success, otherwise
+        the number of seconds until every bucket has a token again.
+        """
+        if not buckets:
+            return 0
+        conn = self.connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            levels = []
+            retry_after = 0
+            for key, capacity, period in buckets:
+                row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens = float(capacity)
+                if row:
+                    tokens = min(tokens, row[0] + (now - row[1]) * capacity / period)
+                if tokens < 1:
+                    retry_after = max(retry_after, (1 - tokens) * period / capacity)
+                levels.append((key, tokens - 1, now + (capacity - tokens + 1) * period / capacity))
+            if retry_after:
+                conn.rollback()
+                return retry_after
+            conn.executemany("INSERT OR REPLACE INTO buckets (key, tokens, updated_at, full_at) VALUES (?, ?, ?, ?)",
+                             [(key, tokens, now, full_at) for key, tokens, full_at in levels])
+            if int.from_bytes(os.urandom(4), 'big') % BUCKET_CLEANUP_ODDS == 0:
+                self.remove_spare_buckets(conn, now)
+            conn.commit()
+            return 0
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def remove_spare_buckets(self, conn, now):
+        """Deletes the buckets that are full again, then the fullest ones beyond MAX_BUCKETS."""
+        conn.execute("DELETE FROM buckets WHERE full_at <= ?", (now,))
+        conn.execute("DELETE FROM buckets WHERE key IN "
+                     "(SELECT key FROM buckets ORDER BY full_at DESC LIMIT -1 OFFSET ?)", (MAX_BUCKETS,))
+
+    def acquire_slot(self, action, limit, lease=None):
+        """Claims one of `limit` concurrent slots for an action. Returns the slot id, or None if all are taken.
+
+        The slot is reclaimed after `lease` seconds (SLOT_LEASE by default) if it is never released.
+        """
+        conn = self.connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM slots WHERE action = ? AND expires_at < ?", (action, now))
+            count = conn.execute("SELECT COUNT(*) FROM slots WHERE action = ?", (action,)).fetchone()[0]
+            if count >= limit:
+                conn.rollback()
+                return None
+            slot_id = os.urandom(16).hex()
+            conn.execute("INSERT INTO slots (id, action, expires_at) VALUES (?, ?, ?)", (slot_id, action, now + (lease or SLOT_LEASE)))
+            conn.commit()
+            return slot_id
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def release_slot(self, slot_id):
+        """Gives a slot back once its request is done."""
+        self.connect().execute("DELETE FROM slots WHERE id = ?", (slot_id,))
@@ -0,0 +1,37 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Small helpers shared by the API scripts."""
+import sys
+
+def prefix_upper_bound(prefix):
+    """Returns the smallest string greater than every string starting with prefix, or None."""
+    # Strip trailing characters that cannot be incremented, then bump the last one.
+    # Codepoint order matches SQLite's BINARY (UTF-8 byte) collation.
+    stripped = prefix.rstrip(chr(sys.maxunicode))
+    if not stripped:
+        return None
+    return stripped[:-1] + chr(ord(stripped[-1]) + 1)
+
+def make_threaded_server(host, port, application):
+    """Returns a local WSGI server that handles each request in its own thread."""
+    # Imported here so CGI requests don't pay for the HTTP server modules.
+    import socketserver
+    from wsgiref.simple_server import make_server, WSGIServer
+
+    class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+
+    return make_server(host, port, application, server_class=ThreadingWSGIServer)
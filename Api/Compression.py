@@ -0,0 +1,170 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Content-Encoding negotiation and streaming compression shared by the API scripts."""
+
+# brotli and zstandard are optional; gzip is always available.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Bodies smaller than this are sent as-is; compressing them saves less than it costs.
+COMPRESS_MIN_SIZE = 1024
+# Small pieces (e.g. from json.JSONEncoder.iterencode) are grouped to about this size
+# before being handed to the compressor.
+COMPRESS_CHUNK_SIZE = 16 * 1024
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/x-ndjson',
+                      'application/javascript', 'application/xml', 'image/svg+xml')
+
+def available_encodings():
+    """Returns the supported encodings, most preferred first."""
+    encodings = []
+    if zstandard is not None:
+        encodings.append('zstd')
+    if brotli is not None:
+        encodings.append('br')
+    encodings.append('gzip')
+    return encodings
+
+def negotiate_encoding(accept_encoding):
+    """Picks the best supported encoding allowed by an Accept-Encoding header, or None."""
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in available_encodings():
+        quality = qualities.get(encoding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def is_compressible(content_type):
+    """Checks whether a content type is worth compressing."""
+    return bool(content_type) and content_type.startswith(COMPRESSIBLE_TYPES)
+
+def encoded_etag(etag, encoding):
+    """Derives the ETag of the compressed variant of a response."""
+    if etag.endswith('"'):
+        return f'{etag[:-1]}-{encoding}"'
+    return etag
+
+def strip_encoding_from_etag(etag):
+    """Maps the ETag of a compressed variant back to the ETag of the original."""
+    for encoding in ('zstd', 'br', 'gzip'):
+        suffix = f'-{encoding}"'
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)] + '"'
+    return etag
+
+def encode_etag_header(headers, encoding):
+    """Replaces the ETag in a list of headers with the one of the compressed variant."""
+    return [(name, encoded_etag(value, encoding) if name == 'ETag' else value) for name, value in headers]
+
+def etag_matches(if_none_match, etag):
+    """Checks an If-None-Match header against an ETag."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # Compare weakly, as RFC 9110 requires for If-None-Match. A tag of a
+    # compressed variant still validates the resource it was derived from.
+    return etag in [strip_encoding_from_etag(tag.strip().removeprefix('W/')) for tag in if_none_match.split(',')]
+
+def wants_encoded_etag(if_none_match, encoding):
+    """Checks whether the copy a client revalidates is the compressed variant, whose tag a 304 should echo."""
+    return any(tag.strip().endswith(f'-{encoding}"') for tag in (if_none_match or '').split(','))
+
+class Compressor:
+    """A uniform streaming interface over the gzip, brotli and zstd compressors."""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'gzip':
+            # Imported here so responses that go out uncompressed don't load it.
+            import zlib
+            # wbits=31 selects the gzip container.
+            self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        elif encoding == 'br':
+            self._compressor = brotli.Compressor(quality=5)
+        elif encoding == 'zstd':
+            self._compressor = zstandard.ZstdCompressor(level=3).compressobj()
+        else:
+            raise ValueError(f"Unsupported encoding: {encoding}")
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def sync(self):
+        """Flushes everything compressed so far so the client can decode it right away."""
+        if self.encoding == 'gzip':
+            import zlib
+            return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == 'br':
+            return self._compressor.flush()
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+def rechunk(chunks, size=COMPRESS_CHUNK_SIZE):
+    """Groups an iterable of small bytes objects into pieces of roughly `size` bytes."""
+    buffer = []
+    buffered = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= size:
+            yield b''.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield b''.join(buffer)
+
+def compress_stream(chunks, encoding, sync=False):
+    """Compresses an iterable of bytes chunk by chunk, never holding the whole body.
+
+    With `sync`, every chunk is flushed on its own so a client reading a
+    progressive response (e.g. NDJSON) can decode each part as it arrives.
+    """
+    compressor = Compressor(encoding)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if sync:
+            data += compressor.sync()
+        if data:
+            yield data
+    yield compressor.finish()
@@ -0,0 +1,62 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""server.conf parsing shared by the API scripts."""
+import os
+
+# server.conf sits next to the scripts, whatever the working directory of the process.
+CONFIG_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_CONF_PATH = os.path.join(CONFIG_DIR, 'server.conf')
+
+_config = None
+
+def parse_config(path):
+    """Parses the `name = "value"` lines of a config file into a dict. A missing file is an empty config."""
+    config = {}
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#') or '=' not in line:
+                    continue
+                name, raw_value = line.split('=', 1)
+                raw_value = raw_value.strip()
+                if raw_value.startswith('"'):
+                    # A quoted value ends at its closing quote; anything after it is a comment.
+                    value = raw_value[1:].split('"', 1)[0]
+                else:
+                    value = raw_value.split('#', 1)[0].strip()
+                # The first occurrence of a setting wins.
+                config.setdefault(name.strip(), value)
+    except FileNotFoundError:
+        pass  # Config file not found, every setting uses its default
+    return config
+
+def get_config_value(name):
+    """Returns a setting from server.conf, or None. The file is read once per process."""
+    global _config
+    if _config is None:
+        _config = parse_config(SERVER_CONF_PATH)
+    return _config.get(name)
+
+def get_path_from_config(name, default_path=None):
+    """Reads a path setting from server.conf, resolved relative to the directory of the scripts.
+
+    Returns None if the setting is missing and there is no default.
+    """
+    value = get_config_value(name) or default_path
+    if not value:
+        return None
+    return os.path.abspath(os.path.join(CONFIG_DIR, value))
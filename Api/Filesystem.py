@@ -15,12 +15,34 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+# Every CGI request is a new process that pays for each import, so modules that
+# only some actions need (sqlite3, hashlib, mimetypes, Pillow, the HTTP server,
+# ...) are imported by the functions that use them.
 import os
+import re
+import sys
 import json
+import stat
+import codecs
+import bisect
+import fnmatch
+import random
+import threading
+import time
 import urllib.parse
-from pathlib import PurePath
+from collections import OrderedDict
 
-SERVER_CONF_PATH = './server.conf'
+from Common import make_threaded_server, prefix_upper_bound
+from Config import get_config_value, get_path_from_config
+from RequestBody import parse_json_body
+from Compression import (COMPRESS_MIN_SIZE, available_encodings, compress_stream, encode_etag_header, etag_matches,
+                         is_compressible, negotiate_encoding, wants_encoded_etag)
+from Metrics import (PROMETHEUS_CONTENT_TYPE, begin_request, configure_metrics, end_request,
+                     get_connection_factory, iter_with_metrics, metrics_endpoint_enabled, record_cache,
+                     render_prometheus)
+
+# Pillow is optional; only the thumbnail action needs it. See load_pillow().
+Image = ImageOps = None
 
 # --- Constants ---
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -28,19 +50,90 @@ WEBSITE_ROOT = os.path.dirname(SCRIPT_DIR)  # This should be /var/www/html
 
 def get_fs_root_from_config():
     """Reads the readonly-filesystem-location from server.conf."""
-    default_fs_path = '../fs'
-    try:
-        with open(SERVER_CONF_PATH, 'r') as f:
-            for line in f:
-                if line.strip().startswith('readonly-filesystem-location'):
-                    _, raw_value = line.split('=', 1)
-                    value = raw_value.strip().strip('"') # Remove whitespace and surrounding quotes
-                    return os.path.abspath(os.path.join(SCRIPT_DIR, value))
-    except FileNotFoundError:
-        pass  # Config file not found, will use default
-    return os.path.abspath(os.path.join(SCRIPT_DIR, default_fs_path))
+    return get_path_from_config('readonly-filesystem-location', '../fs')
+
+def get_cache_dir_from_config():
+    """Reads the cache-location from server.conf."""
+    return get_path_from_config('cache-location', '../cache')
+
+def get_cache_size_from_config(name, default):
+    """Reads a cache size in MiB from server.conf. Returns it in bytes."""
+    value = get_config_value(name)
+    try:
+        return max(int(value), 0) * 1024 * 1024 if value else default
+    except ValueError:
+        return default
 
 FS_ROOT = get_fs_root_from_config()
+# Derived data about FS_ROOT (listings, indexes, ...) is kept here. It can be deleted at any time.
+CACHE_DIR = get_cache_dir_from_config()
+# The actions dispatch_action() routes.
+ACTIONS = ('ls', 'cat', 'complete', 'thumbnail', 'search', 'tree', 'resolve', 'get_public_url', 'stat', 'metrics')
+configure_metrics('filesystem', ACTIONS)
+
+# Size of each read when streaming a file to the client.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+RANGE_HEADER_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Number of directory listings a long-running worker keeps in memory, and how many
+# seconds a cached listing is served before the sizes of its files are checked again.
+LISTING_CACHE_SIZE = 256
+LISTING_RECHECK_INTERVAL = 5
+
+# Number of directories a long-running worker keeps in the completion index,
+# and the default and maximum number of candidates returned per completion.
+PATH_INDEX_SIZE = 4096
+COMPLETE_DEFAULT_LIMIT = 50
+COMPLETE_MAX_LIMIT = 500
+
+# The filename search index lives next to the other derived data, and is
+# brought up to date at most once per SEARCH_REFRESH_INTERVAL seconds.
+SEARCH_INDEX_FILE = os.path.join(CACHE_DIR, 'search.db')
+SEARCH_REFRESH_INTERVAL = 60
+SEARCH_DEFAULT_LIMIT = 100
+SEARCH_MAX_LIMIT = 1000
+
+# Thumbnails are rendered at one of these bounding-box sizes (in pixels), so a
+# client asking for any size shares the cached variants with everybody else.
+THUMBNAIL_SIZES = (128, 256, 512, 1024)
+THUMBNAIL_DEFAULT_SIZE = 256
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_CACHE_MAX_BYTES = get_cache_size_from_config('thumbnail-cache-size', 256 * 1024 * 1024)
+
+# Precompressed copies of files served with Content-Encoding are kept under
+# CACHE_DIR/compressed, up to this many bytes.
+COMPRESSED_CACHE_MAX_BYTES = get_cache_size_from_config('compressed-cache-size', 256 * 1024 * 1024)
+
+# After writing a new entry, a process trims that cache back to its size limit with
+# this probability. A cache hit refreshes the mtime of its entry at most once per
+# CACHE_TOUCH_INTERVAL, so the sweep drops the least recently used entries first.
+# Temporary files older than CACHE_STALE_TMP_AGE were left by a crashed writer.
+CACHE_SWEEP_PROBABILITY = 0.01
+CACHE_TOUCH_INTERVAL = 3600
+CACHE_STALE_TMP_AGE = 3600
+
+# Upper bound on the number of paths in a single stat request.
+STAT_MAX_ITEMS = 200
+
+# Actions whose response depends only on the requested file or directory, and so
+# can be revalidated with its mtime and size. The read-only tree may be cached by
+# browsers and proxies but must be revalidated on every use.
+CACHEABLE_ACTIONS = ('ls', 'cat', 'thumbnail')
+FS_CACHE_CONTROL = 'public, no-cache'
+
+# Upper bounds for the recursive tree action.
+TREE_MAX_DEPTH = 32
+TREE_MAX_ENTRIES = 10000
+
+class JsonBody(str):
+    """A response that has already been serialized to JSON."""
+
+def serialize_response(response_data):
+    """Returns the JSON text for a response, reusing it if it is already serialized."""
+    if isinstance(response_data, JsonBody):
+        return response_data
+    return json.dumps(response_data)
 
 def get_query_param(params, name, default=''):
     """Safely gets a query parameter from the CGI environment."""
@@ -65,55 +158,1088 @@ def vfs_to_abs_sys_path(vfs_path, vfs_pwd, vfs_root_abs_sys_path):
 def abs_sys_to_relative_path(abs_sys_path, root_abs_sys_path):
     """Converts an absolute system path to a root-prefixed, POSIX-style path relative to a given root."""
     relative = os.path.relpath(abs_sys_path, root_abs_sys_path)
-    # Use PurePath to correctly join the root ('/') with the relative path.
-    # This handles the '.' case (for the root directory) automatically.
-    return PurePath('/').joinpath(relative).as_posix()
+    # relpath returns '.' for the root directory itself.
+    if relative == '.':
+        return '/'
+    return '/' + relative.replace(os.sep, '/')
 
 # --- Action Handlers ---
 
+# --- Directory Listing Cache ---
+# Listings are keyed by directory and revalidated against the directory's mtime,
+# which changes whenever an entry is added, removed or renamed. They are stored
+# sorted and serialized, in memory for long-running workers and on disk under
+# CACHE_DIR so that CGI processes benefit as well. Rewriting a file in place does
+# not touch the directory mtime, so a listing is also rescanned once it is older
+# than LISTING_RECHECK_INTERVAL: a changed size shows up within that many seconds.
+# The ETag of a listing is a hash of its body, so a 304 always means the client
+# holds what it would get now.
+_listing_cache = OrderedDict()
+_listing_cache_lock = threading.Lock()
+
+def scan_directory(abs_sys_path):
+    """Reads a directory. Returns its sorted listing and the newest mtime among it and its files."""
+    result = {"directories": [], "files": []}
+    last_modified = os.stat(abs_sys_path).st_mtime
+    with os.scandir(abs_sys_path) as it:
+        for entry in it:
+            if entry.name.startswith('.'):  # Hide dotfiles
+                continue
+            if entry.is_dir():
+                result["directories"].append({"name": entry.name})
+            elif not entry.name.endswith(".py"):
+                try:
+                    st = entry.stat()
+                    size = st.st_size
+                    last_modified = max(last_modified, st.st_mtime)
+                except OSError:
+                    size = None
+                result["files"].append({"name": entry.name, "size": size})
+
+    # Sort by name
+    result["directories"].sort(key=lambda x: x['name'])
+    result["files"].sort(key=lambda x: x['name'])
+    return result, int(last_modified)
+
+def get_cache_file(kind, key, suffix):
+    """Returns the path of the on-disk cache entry for a key, usually an absolute path."""
+    import hashlib
+    digest = hashlib.sha1(key.encode('utf-8', 'surrogateescape')).hexdigest()
+    return os.path.join(CACHE_DIR, kind, digest[:2], digest + suffix)
+
+def write_cache_file(cache_file, data):
+    """Atomically writes a cache entry. The cache is best effort, so failures are ignored."""
+    tmp_file = f"{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(tmp_file, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+
+def touch_cache_file(cache_file):
+    """Marks a cache entry as recently used for sweep_cache()."""
+    try:
+        if time.time() - os.stat(cache_file).st_mtime > CACHE_TOUCH_INTERVAL:
+            os.utime(cache_file)
+    except OSError:
+        pass
+
+def sweep_cache(kind, max_bytes):
+    """Deletes the least recently used entries of a cache until it fits in max_bytes. Returns the number deleted."""
+    entries = []
+    total = 0
+    deleted = 0
+    now = time.time()
+    for dir_path, _, file_names in os.walk(os.path.join(CACHE_DIR, kind)):
+        for name in file_names:
+            path = os.path.join(dir_path, name)
+            try:
+                st = os.stat(path)
+                if name.endswith('.tmp'):
+                    if now - st.st_mtime > CACHE_STALE_TMP_AGE:
+                        os.remove(path)
+                    continue
+            except OSError:
+                continue
+            entries.append((st.st_mtime, path, st.st_size))
+            total += st.st_size
+
+    entries.sort()
+    for _, path, size in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            deleted += 1
+        except OSError:
+            pass
+        total -= size
+    return deleted
+
+def maybe_sweep_cache(kind, max_bytes):
+    """Runs sweep_cache() on a small share of the calls, so the cost is spread across requests."""
+    if random.random() < CACHE_SWEEP_PROBABILITY:
+        sweep_cache(kind, max_bytes)
+
+def is_listing_current(cached, mtime_ns):
+    """Checks a cached (mtime_ns, checked_at, etag, last_modified, body) listing against its directory."""
+    return cached[0] == mtime_ns and cached[1] + LISTING_RECHECK_INTERVAL > time.time()
+
+def read_cached_listing(abs_sys_path, mtime_ns):
+    """Returns the on-disk listing for a directory if it is still current."""
+    try:
+        with open(get_cache_file('ls', abs_sys_path, '.json'), 'rb') as f:
+            header, body = f.read().split(b'\n', 1)
+        cached_mtime, checked_at, etag, last_modified = header.decode('ascii').split(' ')
+        cached = (int(cached_mtime), float(checked_at), etag, int(last_modified), JsonBody(body.decode('utf-8')))
+    except (OSError, ValueError):
+        return None
+    return cached if is_listing_current(cached, mtime_ns) else None
+
+def get_directory_listing(abs_sys_path, mtime_ns):
+    """Returns (body, etag, last_modified) for a directory's serialized listing, from cache when it is current."""
+    with _listing_cache_lock:
+        cached = _listing_cache.get(abs_sys_path)
+        if cached and is_listing_current(cached, mtime_ns):
+            _listing_cache.move_to_end(abs_sys_path)
+            record_cache('listing', True)
+            return cached[4], cached[2], cached[3]
+    record_cache('listing', False)
+
+    cached = read_cached_listing(abs_sys_path, mtime_ns)
+    record_cache('listing_file', cached is not None)
+    if cached is None:
+        import hashlib
+        listing, last_modified = scan_directory(abs_sys_path)
+        body = JsonBody(json.dumps(listing))
+        etag = '"' + hashlib.sha1(body.encode('utf-8')).hexdigest()[:20] + '"'
+        cached = (mtime_ns, time.time(), etag, last_modified, body)
+        data = f"{mtime_ns} {cached[1]!r} {etag} {last_modified}\n{body}".encode('utf-8')
+        write_cache_file(get_cache_file('ls', abs_sys_path, '.json'), data)
+
+    with _listing_cache_lock:
+        _listing_cache[abs_sys_path] = cached
+        _listing_cache.move_to_end(abs_sys_path)
+        while len(_listing_cache) > LISTING_CACHE_SIZE:
+            _listing_cache.popitem(last=False)
+    return cached[4], cached[2], cached[3]
+
+# --- Path Completion Index ---
+# For every directory the index keeps its entry names sorted, with a trailing
+# '/' on directories, plus a case-folded copy. A completion is then a binary
+# search in one directory's list. Entries are built from the listing cache and
+# revalidated against the directory mtime in the same way.
+_path_index = OrderedDict()
+_path_index_lock = threading.Lock()
+
+def get_directory_index(abs_sys_path, mtime_ns):
+    """Returns (names, folded) for a directory; folded is a sorted list of (name.lower(), name)."""
+    with _path_index_lock:
+        cached = _path_index.get(abs_sys_path)
+        if cached and cached[0] == mtime_ns:
+            _path_index.move_to_end(abs_sys_path)
+            record_cache('path_index', True)
+            return cached[1], cached[2]
+    record_cache('path_index', False)
+
+    listing = json.loads(get_directory_listing(abs_sys_path, mtime_ns)[0])
+    names = sorted([d["name"] + '/' for d in listing["directories"]] + [f["name"] for f in listing["files"]])
+    folded = sorted((name.lower(), name) for name in names)
+
+    with _path_index_lock:
+        _path_index[abs_sys_path] = (mtime_ns, names, folded)
+        _path_index.move_to_end(abs_sys_path)
+        while len(_path_index) > PATH_INDEX_SIZE:
+            _path_index.popitem(last=False)
+    return names, folded
+
+def warm_path_index():
+    """Loads every directory under FS_ROOT into the completion index."""
+    for dir_path, dir_names, _ in os.walk(FS_ROOT):
+        dir_names[:] = [d for d in dir_names if not d.startswith('.')]
+        try:
+            get_directory_index(dir_path, os.stat(dir_path).st_mtime_ns)
+        except OSError:
+            continue
+
+# --- Filename Search Index ---
+# An SQLite database with one row per entry under FS_ROOT. Substring and glob
+# queries go through an FTS5 trigram index when this SQLite supports it, and
+# prefix queries through the B-tree index on name/path. The index is refreshed
+# incrementally: only directories whose mtime changed since the last refresh
+# are rescanned.
+_search_local = threading.local()
+
+def open_search_index():
+    """Returns this thread's connection to the search index, creating the schema if needed."""
+    import sqlite3
+    conn = getattr(_search_local, 'conn', None)
+    if conn is not None:
+        return conn
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # Autocommit mode: transactions are started explicitly in refresh_search_index().
+    conn = sqlite3.connect(SEARCH_INDEX_FILE, timeout=5, isolation_level=None, factory=get_connection_factory())
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS meta (
+            name TEXT PRIMARY KEY,
+            value TEXT
+        );
+        CREATE TABLE IF NOT EXISTS directories (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS entries (
+            id INTEGER PRIMARY KEY,
+            path TEXT UNIQUE NOT NULL,
+            dir TEXT NOT NULL,
+            name TEXT NOT NULL,
+            type TEXT NOT NULL,
+            size INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS entries_dir ON entries (dir);
+        CREATE INDEX IF NOT EXISTS entries_name ON entries (name);
+    ''')
+    try:
+        conn.executescript('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+                name, path, content='entries', content_rowid='id', tokenize='trigram'
+            );
+            CREATE TRIGGER IF NOT EXISTS entries_ai AFTER INSERT ON entries BEGIN
+                INSERT INTO entries_fts (rowid, name, path) VALUES (new.id, new.name, new.path);
+            END;
+            CREATE TRIGGER IF NOT EXISTS entries_ad AFTER DELETE ON entries BEGIN
+                INSERT INTO entries_fts (entries_fts, rowid, name, path) VALUES ('delete', old.id, old.name, old.path);
+            END;
+        ''')
+    except sqlite3.OperationalError:
+        pass  # No FTS5 or no trigram tokenizer (SQLite < 3.34); queries fall back to table scans.
+    _search_local.conn = conn
+    return conn
+
+def search_index_has_fts(conn):
+    """Checks whether the index was created with the FTS5 trigram table."""
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'entries_fts'").fetchone()
+    return row is not None
+
+def rescan_search_directory(conn, vfs_dir, abs_dir, mtime_ns):
+    """Replaces the indexed entries of one directory. Returns the VFS paths of its subdirectories."""
+    conn.execute("DELETE FROM entries WHERE dir = ?", (vfs_dir,))
+    subdirectories = []
+    rows = []
+    with os.scandir(abs_dir) as it:
+        for entry in it:
+            if entry.name.startswith('.'):  # Hide dotfiles, as ls does
+                continue
+            vfs_path = abs_sys_to_relative_path(entry.path, FS_ROOT)
+            if entry.is_dir(follow_symlinks=False):
+                subdirectories.append(vfs_path)
+                rows.append((vfs_path, vfs_dir, entry.name, 'directory', None))
+            elif not entry.name.endswith('.py'):
+                try:
+                    size = entry.stat().st_size
+                except OSError:
+                    size = None
+                rows.append((vfs_path, vfs_dir, entry.name, 'file', size))
+    conn.executemany("INSERT INTO entries (path, dir, name, type, size) VALUES (?, ?, ?, ?, ?)", rows)
+    conn.execute("INSERT OR REPLACE INTO directories (path, mtime_ns) VALUES (?, ?)", (vfs_dir, mtime_ns))
+    return subdirectories
+
+def refresh_search_index(conn, force=False):
+    """Brings the index in line with FS_ROOT, rescanning only directories whose mtime changed."""
+    def is_fresh():
+        row = conn.execute("SELECT value FROM meta WHERE name = 'refreshed_at'").fetchone()
+        return row is not None and float(row[0]) + SEARCH_REFRESH_INTERVAL > time.time()
+
+    if not force and is_fresh():
+        return
+    # Take the write lock first, then check again: another process may have just refreshed.
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if not force and is_fresh():
+            conn.execute("COMMIT")
+            return
+
+        known = dict(conn.execute("SELECT path, mtime_ns FROM directories"))
+        seen = set()
+        stack = ['/']
+        while stack:
+            vfs_dir = stack.pop()
+            abs_dir = os.path.join(FS_ROOT, vfs_dir.lstrip('/'))
+            try:
+                mtime_ns = os.stat(abs_dir).st_mtime_ns
+            except OSError:
+                continue
+            seen.add(vfs_dir)
+            if known.get(vfs_dir) == mtime_ns:
+                # Unchanged: its subdirectories are already in the index.
+                stack.extend(row[0] for row in conn.execute(
+                    "SELECT path FROM entries WHERE dir = ? AND type = 'directory'", (vfs_dir,)))
+            else:
+                try:
+                    stack.extend(rescan_search_directory(conn, vfs_dir, abs_dir, mtime_ns))
+                except OSError:
+                    continue
+
+        for vfs_dir in known.keys() - seen:
+            conn.execute("DELETE FROM entries WHERE dir = ?", (vfs_dir,))
+            conn.execute("DELETE FROM directories WHERE path = ?", (vfs_dir,))
+        conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('refreshed_at', ?)", (str(time.time()),))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+def escape_like(text):
+    """Escapes LIKE wildcards so text is matched literally."""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def handle_search(abs_sys_path, query, mode='substring', scope='name', limit=None):
+    """Finds entries under a directory whose name (or full path) matches a query.
+
+    `mode` is 'substring' (case-insensitive), 'glob' or 'prefix'; `scope` is
+    'name' or 'path'.
+    """
+    if not query:
+        raise ValueError("Query is required")
+    if mode not in ('substring', 'glob', 'prefix'):
+        raise ValueError(f"Unknown search mode: {mode}")
+    if scope not in ('name', 'path'):
+        raise ValueError(f"Unknown search scope: {scope}")
+    if not os.path.isdir(abs_sys_path):
+        raise NotADirectoryError("Not a directory")
+    limit = SEARCH_DEFAULT_LIMIT if limit is None else max(min(limit, SEARCH_MAX_LIMIT), 1)
+
+    import sqlite3
+    conn = open_search_index()
+    try:
+        refresh_search_index(conn)
+    except sqlite3.OperationalError:
+        pass  # Another process holds the write lock for too long; answer from the current index.
+    use_fts = search_index_has_fts(conn)
+
+    # `scope` is one of two fixed column names, so it is safe to interpolate.
+    fts_source = "entries_fts JOIN entries e ON e.id = entries_fts.rowid"
+    source = "entries e"
+    conditions = []
+    params = []
+    if mode == 'prefix':
+        conditions.append(f"e.{scope} >= ?")
+        params.append(query)
+        upper_bound = prefix_upper_bound(query)
+        if upper_bound is not None:
+            conditions.append(f"e.{scope} < ?")
+            params.append(upper_bound)
+    elif mode == 'glob':
+        if use_fts:
+            source = fts_source
+            conditions.append(f"entries_fts.{scope} GLOB ?")
+        else:
+            conditions.append(f"e.{scope} GLOB ?")
+        params.append(query)
+    elif use_fts and len(query) >= 3:
+        # The trigram tokenizer matches a quoted phrase as a case-insensitive substring.
+        source = fts_source
+        conditions.append("entries_fts MATCH ?")
+        params.append(f'{scope} : "' + query.replace('"', '""') + '"')
+    else:
+        conditions.append(f"e.{scope} LIKE ? ESCAPE '\\'")
+        params.append(f"%{escape_like(query)}%")
+
+    vfs_root = abs_sys_to_relative_path(abs_sys_path, FS_ROOT)
+    if vfs_root != '/':
+        conditions.append("e.path >= ? AND e.path < ?")
+        params.extend([vfs_root + '/', prefix_upper_bound(vfs_root + '/')])
+
+    params.append(limit + 1)
+    rows = conn.execute(
+        f"SELECT e.path, e.type, e.size FROM {source} WHERE {' AND '.join(conditions)} ORDER BY e.path LIMIT ?",
+        params).fetchall()
+
+    results = [{"path": path, "type": entry_type, "size": size} for path, entry_type, size in rows[:limit]]
+    return {"results": results, "truncated": len(rows) > limit}
+
+# --- Thumbnails ---
+# Downscaled JPEG variants of images are kept under CACHE_DIR/thumbs. The cache
+# key is a hash of the source path, size, mtime and requested size, so any change
+# to the source yields a new key and stale variants are simply never read again;
+# sweep_cache() deletes them once the cache outgrows THUMBNAIL_CACHE_MAX_BYTES.
+# Long-running workers render in a process pool so resizing does not hold the GIL
+# of the request threads; CGI requests render in-process. The pool spawns fresh
+# interpreters rather than forking, as forking a process that already runs
+# threads can leave locks held forever in the child.
+_thumbnail_pool = None
+
+def load_pillow():
+    """Imports Pillow on first use. Returns False if it is not installed."""
+    global Image, ImageOps
+    if Image is None:
+        try:
+            from PIL import Image, ImageOps
+        except ImportError:
+            return False
+    return True
+
+def make_thumbnail_pool(max_workers=None):
+    """Returns a new process pool for render_thumbnail()."""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+def start_thumbnail_pool(max_workers=None):
+    """Creates the process pool used to render thumbnails in long-running mode."""
+    global _thumbnail_pool
+    if load_pillow() and _thumbnail_pool is None:
+        _thumbnail_pool = make_thumbnail_pool(max_workers)
+    return _thumbnail_pool
+
+def snap_thumbnail_size(size):
+    """Returns the smallest supported thumbnail size that is at least `size`."""
+    if size is None:
+        return THUMBNAIL_DEFAULT_SIZE
+    for supported in THUMBNAIL_SIZES:
+        if size <= supported:
+            return supported
+    return THUMBNAIL_SIZES[-1]
+
+def get_thumbnail_file(abs_sys_path, st, size):
+    """Returns the cache path for a thumbnail of a specific version of a file."""
+    key = f"{abs_sys_path}\0{st.st_size}\0{st.st_mtime_ns}\0{size}"
+    return get_cache_file('thumbs', key, '.jpg')
+
+def render_thumbnail(abs_sys_path, thumbnail_file, size):
+    """Renders a thumbnail to thumbnail_file. Runs in a worker process when a pool is available."""
+    load_pillow()
+    with Image.open(abs_sys_path) as img:
+        # For JPEGs this lets the decoder downscale while decoding, which is far
+        # cheaper than decoding the full image and resizing it afterwards.
+        img.draft('RGB', (size, size))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((size, size))
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        os.makedirs(os.path.dirname(thumbnail_file), exist_ok=True)
+        tmp_file = f"{thumbnail_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            img.save(tmp_file, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+            os.replace(tmp_file, thumbnail_file)
+        finally:
+            # Only left over if saving failed.
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+    return thumbnail_file
+
+def ensure_thumbnail(abs_sys_path, size, pool=None):
+    """Returns the path of an up-to-date thumbnail, rendering it if it is not cached yet."""
+    st = os.stat(abs_sys_path)
+    thumbnail_file = get_thumbnail_file(abs_sys_path, st, size)
+    cached = os.path.exists(thumbnail_file)
+    record_cache('thumbnail', cached)
+    if cached:
+        touch_cache_file(thumbnail_file)
+        return thumbnail_file
+    if pool is not None:
+        pool.submit(render_thumbnail, abs_sys_path, thumbnail_file, size).result()
+    else:
+        render_thumbnail(abs_sys_path, thumbnail_file, size)
+    maybe_sweep_cache('thumbs', THUMBNAIL_CACHE_MAX_BYTES)
+    return thumbnail_file
+
+def handle_thumbnail(abs_sys_path, size=None, range_header=None):
+    """Serves a downscaled JPEG version of an image."""
+    if not load_pillow():
+        raise RuntimeError("Thumbnails are not available: Pillow is not installed")
+    if not os.path.exists(abs_sys_path):
+        raise FileNotFoundError("No such file or directory")
+    if os.path.isdir(abs_sys_path):
+        raise IsADirectoryError("Is a directory")
+
+    try:
+        thumbnail_file = ensure_thumbnail(abs_sys_path, snap_thumbnail_size(size), _thumbnail_pool)
+    except (OSError, Image.DecompressionBombError):
+        raise ValueError("Cannot create a thumbnail for this file")
+    thumbnail_size = os.path.getsize(thumbnail_file)
+    start, length, partial = resolve_byte_range(thumbnail_size, range_header=range_header)
+    return FileResponse(thumbnail_file, start, length, thumbnail_size, partial)
+
+def warm_thumbnails(abs_sys_path, sizes, recursive=False, max_workers=None):
+    """Renders the missing thumbnails of every image in a directory. Returns (rendered, failed)."""
+    import mimetypes
+    images = []
+    for dir_path, dir_names, file_names in os.walk(abs_sys_path):
+        dir_names[:] = sorted(d for d in dir_names if not d.startswith('.')) if recursive else []
+        for name in sorted(file_names):
+            if name.startswith('.'):
+                continue
+            content_type = mimetypes.guess_type(name)[0] or ''
+            if content_type.startswith('image/'):
+                images.append(os.path.join(dir_path, name))
+
+    jobs = []
+    for image in images:
+        st = os.stat(image)
+        for size in sizes:
+            thumbnail_file = get_thumbnail_file(image, st, size)
+            if not os.path.exists(thumbnail_file):
+                jobs.append((image, thumbnail_file, size))
+
+    rendered = failed = 0
+    with make_thumbnail_pool(max_workers) as pool:
+        futures = [pool.submit(render_thumbnail, *job) for job in jobs]
+        for (image, _, size), future in zip(jobs, futures):
+            try:
+                future.result()
+                rendered += 1
+            except Exception as e:
+                failed += 1
+                print(f"{abs_sys_to_relative_path(image, FS_ROOT)} ({size}px): {e}", file=sys.stderr)
+    sweep_cache('thumbs', THUMBNAIL_CACHE_MAX_BYTES)
+    return rendered, failed
+
 def handle_ls(abs_sys_path):
     """Lists the contents of a directory, or details of a single file."""
-    if not os.path.exists(abs_sys_path):
+    try:
+        st = os.stat(abs_sys_path)
+    except OSError:
         raise FileNotFoundError("No such file or directory")
 
-    if os.path.isdir(abs_sys_path):
-        result = {"directories": [], "files": []}
-        with os.scandir(abs_sys_path) as it:
-            for entry in it:
-                if entry.name.startswith('.'):  # Hide dotfiles
-                    continue
-                if entry.is_dir():
-                    result["directories"].append({"name": entry.name})
-                elif not entry.name.endswith(".py"):
-                    try:
-                        size = os.path.getsize(entry.path)
-                    except OSError:
-                        size = None
-                    result["files"].append({"name": entry.name, "size": size})
-
-        # Sort by name
-        result["directories"].sort(key=lambda x: x['name'])
-        result["files"].sort(key=lambda x: x['name'])
-        return result
-    elif os.path.isfile(abs_sys_path):
+    if stat.S_ISDIR(st.st_mode):
+        return get_directory_listing(abs_sys_path, st.st_mtime_ns)[0]
+    elif stat.S_ISREG(st.st_mode):
         # If the path is a file, return a list containing only that file.
-        size = os.path.getsize(abs_sys_path)
         filename = os.path.basename(abs_sys_path)
-        return {"directories": [], "files": [{"name": filename, "size": size}]}
+        return {"directories": [], "files": [{"name": filename, "size": st.st_size}]}
     else:
         # Path exists but is not a regular file or directory (e.g., a socket or broken symlink)
         raise FileNotFoundError("Is not a file or directory")
 
-def handle_cat(abs_sys_path):
-    """Reads the content of a file."""
+class RangeNotSatisfiableError(ValueError):
+    """Raised when an HTTP Range header does not overlap the file."""
+
+    def __init__(self, size):
+        super().__init__("Requested range not satisfiable")
+        self.size = size
+
+class StreamResponse:
+    """A response whose body is written out in chunks instead of as one JSON document."""
+    status = '200 OK'
+    headers = []
+    # Headers added on top of the response's own, e.g. cache validators.
+    extra_headers = []
+
+    def get_headers(self):
+        return list(self.headers) + list(self.extra_headers)
+
+    def iter_body(self):
+        """Yields the body as a sequence of bytes objects."""
+        raise NotImplementedError
+
+class JsonResponse(StreamResponse):
+    """A JSON document that needs headers beyond the Content-Type."""
+
+    def __init__(self, response_data):
+        self.body = serialize_response(response_data).encode('utf-8')
+
+    @property
+    def headers(self):
+        return [('Content-Type', 'application/json'), ('Content-Length', str(len(self.body)))]
+
+    def iter_body(self):
+        yield self.body
+
+class NotModifiedResponse(StreamResponse):
+    """A 304 answer to a conditional request whose cached copy is still current."""
+    status = '304 Not Modified'
+
+    def __init__(self, etag, mtime):
+        self.extra_headers = cache_headers(etag, mtime)
+
+    def iter_body(self):
+        return iter(())
+
+class FileResponse(StreamResponse):
+    """A byte range of a file that is streamed to the client as-is instead of as JSON."""
+
+    def __init__(self, abs_sys_path, start, length, size, partial=False, content_type=None, content_encoding=None):
+        self.abs_sys_path = abs_sys_path
+        self.start = start
+        self.length = length
+        self.size = size
+        self.partial = partial
+        if content_type is None:
+            import mimetypes
+            content_type = mimetypes.guess_type(abs_sys_path)[0]
+        self.content_type = content_type or 'application/octet-stream'
+        # Set when the file is a precompressed copy of the resource being served.
+        self.content_encoding = content_encoding
+
+    @property
+    def status(self):
+        return '206 Partial Content' if self.partial else '200 OK'
+
+    @property
+    def headers(self):
+        headers = [
+            ('Content-Type', self.content_type),
+            ('Content-Length', str(self.length)),
+        ]
+        if self.content_encoding:
+            headers += [('Content-Encoding', self.content_encoding), ('Vary', 'Accept-Encoding')]
+        else:
+            headers.append(('Accept-Ranges', 'bytes'))
+        if self.partial:
+            end = self.start + self.length - 1
+            headers.append(('Content-Range', f'bytes {self.start}-{end}/{self.size}'))
+        return headers
+
+    def open(self):
+        """Opens the file positioned at the start of the range."""
+        f = open(self.abs_sys_path, 'rb')
+        f.seek(self.start)
+        return f
+
+    def iter_body(self):
+        return self.iter_chunks(self.open())
+
+    def iter_chunks(self, f):
+        """Yields the requested range in STREAM_CHUNK_SIZE pieces and closes the file."""
+        try:
+            remaining = self.length
+            while remaining > 0:
+                chunk = f.read(min(STREAM_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            f.close()
+
+class TextResponse(StreamResponse):
+    """A plain text document, e.g. the metrics."""
+
+    def __init__(self, text, content_type='text/plain; charset=utf-8'):
+        self.body = text.encode('utf-8')
+        self.content_type = content_type
+
+    @property
+    def headers(self):
+        return [('Content-Type', self.content_type), ('Content-Length', str(len(self.body))), ('Cache-Control', 'no-store')]
+
+    def iter_body(self):
+        yield self.body
+
+class NdjsonResponse(StreamResponse):
+    """A stream of JSON records, one per line, produced while the response is being sent."""
+    headers = [('Content-Type', 'application/x-ndjson')]
+
+    def __init__(self, batches):
+        # An iterable of record lists; each list is encoded and sent as one chunk.
+        self.batches = batches
+
+    def iter_body(self):
+        for batch in self.batches:
+            if batch:
+                yield ''.join(json.dumps(record) + '\n' for record in batch).encode('utf-8')
+
+class FileContentResponse(StreamResponse):
+    """The JSON answer of cat for a whole file, `{"content": "..."}`, encoded while the file is read.
+
+    Neither the text, its JSON form nor the encoded bytes are ever held in full.
+    """
+    headers = [('Content-Type', 'application/json')]
+
+    def __init__(self, abs_sys_path):
+        self.abs_sys_path = abs_sys_path
+
+    def iter_body(self):
+        # The same bytes json.dumps({"content": text}) gives: a string is escaped one
+        # character at a time, so its pieces can be escaped separately.
+        yield b'{"content": "'
+        with open(self.abs_sys_path, 'r', encoding='utf-8') as f:
+            while True:
+                text = f.read(STREAM_CHUNK_SIZE)
+                if not text:
+                    break
+                yield json.dumps(text)[1:-1].encode('utf-8')
+        yield b'"}'
+
+def check_utf8(abs_sys_path):
+    """Raises UnicodeDecodeError unless a file is valid UTF-8, reading it one chunk at a time."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    with open(abs_sys_path, 'rb') as f:
+        while True:
+            chunk = f.read(STREAM_CHUNK_SIZE)
+            decoder.decode(chunk, final=not chunk)
+            if not chunk:
+                break
+
+def make_etag(st):
+    """Builds an ETag from the mtime and size of a file or directory."""
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+def get_cache_validators(abs_sys_path):
+    """Returns (etag, mtime) for a path, or None if it cannot be stat'ed."""
+    try:
+        st = os.stat(abs_sys_path)
+    except OSError:
+        return None
+    if stat.S_ISDIR(st.st_mode):
+        # A listing shows the sizes of the files, which the directory's own mtime
+        # does not cover, so it is validated by its content instead.
+        _, etag, mtime = get_directory_listing(abs_sys_path, st.st_mtime_ns)
+        return etag, mtime
+    return make_etag(st), int(st.st_mtime)
+
+def format_http_date(timestamp):
+    """Formats a Unix timestamp as an HTTP date, e.g. `Sun, 06 Nov 1994 08:49:37 GMT`."""
+    # Spelled out instead of strftime's %a and %b, which follow the locale.
+    t = time.gmtime(timestamp)
+    day = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')[t.tm_wday]
+    month = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')[t.tm_mon - 1]
+    return f"{day}, {t.tm_mday:02d} {month} {t.tm_year} {t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d} GMT"
+
+def cache_headers(etag, mtime):
+    """Returns the validator and Cache-Control headers for a cacheable response."""
+    return [
+        ('ETag', etag),
+        ('Last-Modified', format_http_date(mtime)),
+        ('Cache-Control', FS_CACHE_CONTROL),
+    ]
+
+def is_not_modified(environ, etag, mtime):
+    """Checks the request's If-None-Match, or failing that If-Modified-Since, against a resource."""
+    if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since:
+        from email.utils import parsedate_to_datetime
+        try:
+            return mtime <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def add_cache_headers(response_data, etag, mtime):
+    """Attaches cache validators to a successful response."""
+    if isinstance(response_data, dict) and 'error' in response_data:
+        return response_data
+    if not isinstance(response_data, StreamResponse):
+        response_data = JsonResponse(response_data)
+    response_data.extra_headers = cache_headers(etag, mtime)
+    return response_data
+
+class CompressedResponse(StreamResponse):
+    """Wraps a response and compresses its body on the fly."""
+
+    def __init__(self, inner, encoding, sync=False):
+        self.inner = inner
+        self.encoding = encoding
+        self.sync = sync
+        self.status = inner.status
+
+    def get_headers(self):
+        # The length of the compressed body is not known up front, and byte ranges
+        # always refer to the uncompressed resource.
+        headers = [header for header in self.inner.headers if header[0] not in ('Content-Length', 'Accept-Ranges')]
+        headers += [('Content-Encoding', self.encoding), ('Vary', 'Accept-Encoding')]
+        return headers + encode_etag_header(self.inner.extra_headers, self.encoding)
+
+    def iter_body(self):
+        return compress_stream(self.inner.iter_body(), self.encoding, self.sync)
+
+def remove_stale_compressed_files(compressed_file):
+    """Deletes the copies of older versions of a file next to its current compressed copy."""
+    dir_path, name = os.path.split(compressed_file)
+    digest, version, _ = name.split('.', 2)
+    try:
+        names = os.listdir(dir_path)
+    except OSError:
+        return
+    for other in names:
+        parts = other.split('.')
+        if len(parts) == 3 and parts[0] == digest and parts[1] != version:
+            try:
+                os.remove(os.path.join(dir_path, other))
+            except OSError:
+                pass
+
+def get_compressed_file(abs_sys_path, encoding):
+    """Returns a precompressed copy of a file, creating it in the sidecar cache if needed.
+
+    The copies of a file share the hash of its path and carry its size and mtime
+    in their names, so writing the copy of a new version deletes the old ones.
+    """
+    st = os.stat(abs_sys_path)
+    compressed_file = get_cache_file('compressed', abs_sys_path, f".{st.st_size}-{st.st_mtime_ns}.{encoding}")
+    cached = os.path.exists(compressed_file)
+    record_cache('compressed', cached)
+    if cached:
+        touch_cache_file(compressed_file)
+        return compressed_file
+
+    def read_chunks(f):
+        while True:
+            chunk = f.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+    os.makedirs(os.path.dirname(compressed_file), exist_ok=True)
+    tmp_file = f"{compressed_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(abs_sys_path, 'rb') as src, open(tmp_file, 'wb') as dest:
+            for chunk in compress_stream(read_chunks(src), encoding):
+                dest.write(chunk)
+        os.replace(tmp_file, compressed_file)
+    finally:
+        # Only left over if compressing or writing failed.
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    remove_stale_compressed_files(compressed_file)
+    maybe_sweep_cache('compressed', COMPRESSED_CACHE_MAX_BYTES)
+    return compressed_file
+
+def compress_file_response(response, encoding):
+    """Serves a whole file from its precompressed sidecar. Falls back to on-the-fly compression."""
+    try:
+        compressed_file = get_compressed_file(response.abs_sys_path, encoding)
+    except OSError:
+        return CompressedResponse(response, encoding)
+    size = os.path.getsize(compressed_file)
+    compressed = FileResponse(compressed_file, 0, size, size, content_type=response.content_type, content_encoding=encoding)
+    compressed.extra_headers = encode_etag_header(response.extra_headers, encoding)
+    return compressed
+
+def maybe_compress(response_data, environ):
+    """Compresses a response with the best encoding the client accepts, if it is worth it."""
+    encoding = negotiate_encoding(environ.get('HTTP_ACCEPT_ENCODING'))
+    if encoding is None:
+        return response_data
+
+    if isinstance(response_data, NotModifiedResponse):
+        # Echo the tag of the compressed variant if that is what the client has cached.
+        if wants_encoded_etag(environ.get('HTTP_IF_NONE_MATCH'), encoding):
+            response_data.extra_headers = encode_etag_header(response_data.extra_headers, encoding)
+        return response_data
+    if isinstance(response_data, (dict, JsonBody)):
+        response_data = JsonResponse(response_data)
+    if isinstance(response_data, JsonResponse):
+        if len(response_data.body) < COMPRESS_MIN_SIZE:
+            return response_data
+        return CompressedResponse(response_data, encoding)
+    if isinstance(response_data, FileContentResponse):
+        return CompressedResponse(response_data, encoding)
+    if isinstance(response_data, NdjsonResponse):
+        return CompressedResponse(response_data, encoding, sync=True)
+    if isinstance(response_data, FileResponse):
+        if response_data.partial or response_data.length < COMPRESS_MIN_SIZE:
+            return response_data
+        if not is_compressible(response_data.content_type):
+            return response_data
+        return compress_file_response(response_data, encoding)
+    return response_data
+
+def precompress_directory(abs_sys_path, recursive=False):
+    """Creates the compressed sidecars of every compressible file in a directory. Returns the count."""
+    import mimetypes
+    count = 0
+    for dir_path, dir_names, file_names in os.walk(abs_sys_path):
+        dir_names[:] = sorted(d for d in dir_names if not d.startswith('.')) if recursive else []
+        for name in sorted(file_names):
+            file_path = os.path.join(dir_path, name)
+            if name.startswith('.') or not is_compressible(mimetypes.guess_type(name)[0]):
+                continue
+            if os.path.getsize(file_path) < COMPRESS_MIN_SIZE:
+                continue
+            for encoding in available_encodings():
+                get_compressed_file(file_path, encoding)
+                count += 1
+    sweep_cache('compressed', COMPRESSED_CACHE_MAX_BYTES)
+    return count
+
+def parse_int_param(value, name):
+    """Parses an optional integer query parameter."""
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"Invalid {name}: must be an integer")
+
+def resolve_byte_range(size, offset=None, length=None, range_header=None):
+    """Works out which bytes of a file to send.
+
+    `offset` may be negative to count from the end of the file (tail-style reads)
+    and both parameters are clamped to the file. An HTTP Range header takes
+    precedence; only a single range is honored and multi-range requests get the
+    whole file. Returns a (start, length, partial) tuple.
+    """
+    if range_header:
+        match = RANGE_HEADER_PATTERN.match(range_header.strip())
+        if match and (match.group(1) or match.group(2)):
+            first, last = match.groups()
+            if first:
+                start = int(first)
+                end = min(int(last), size - 1) if last else size - 1
+            else:
+                # A suffix range ("bytes=-500") asks for the last N bytes.
+                start = max(size - int(last), 0)
+                end = size - 1
+            if start >= size or end < start:
+                raise RangeNotSatisfiableError(size)
+            return start, end - start + 1, True
+
+    if offset is None and length is None:
+        return 0, size, False
+
+    start = offset or 0
+    if start < 0:
+        start = max(size + start, 0)
+    start = min(start, size)
+    available = size - start
+    length = available if length is None else max(min(length, available), 0)
+    return start, length, True
+
+def handle_cat(abs_sys_path, offset=None, length=None):
+    """Reads the content of a file, or only the byte range given by offset and length."""
     if not os.path.exists(abs_sys_path):
         raise FileNotFoundError("No such file or directory")
     if os.path.isdir(abs_sys_path):
         raise IsADirectoryError("Is a directory")
-    
-    with open(abs_sys_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-    return {"content": content}
+
+    if offset is None and length is None:
+        if os.path.getsize(abs_sys_path) > STREAM_CHUNK_SIZE:
+            # Once streaming has begun a decoding error can no longer be reported,
+            # so the file is checked first. Both passes only hold one chunk.
+            check_utf8(abs_sys_path)
+            return FileContentResponse(abs_sys_path)
+        with open(abs_sys_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        return {"content": content}
+
+    # Only the requested bytes are read. A slice may cut a multi-byte character
+    # in half, so undecodable bytes at the edges are replaced rather than rejected.
+    size = os.path.getsize(abs_sys_path)
+    start, length, _ = resolve_byte_range(size, offset, length)
+    with open(abs_sys_path, 'rb') as f:
+        f.seek(start)
+        content = f.read(length).decode('utf-8', errors='replace')
+    return {"content": content, "offset": start, "length": length, "size": size}
+
+def handle_cat_raw(abs_sys_path, offset=None, length=None, range_header=None):
+    """Streams the raw bytes of a file, honoring HTTP Range and offset/length."""
+    if not os.path.exists(abs_sys_path):
+        raise FileNotFoundError("No such file or directory")
+    if os.path.isdir(abs_sys_path):
+        raise IsADirectoryError("Is a directory")
+
+    size = os.path.getsize(abs_sys_path)
+    start, length, partial = resolve_byte_range(size, offset, length, range_header)
+    return FileResponse(abs_sys_path, start, length, size, partial)
+
+def walk_tree(abs_sys_path, max_depth, patterns, limit):
+    """Walks a directory depth-first in name order, yielding one list of records per directory.
+
+    Only the entries of the directories on the current path are held in memory.
+    Every directory is descended into, but with patterns given only entries whose
+    name matches one of them are reported. Symlinked directories are not followed.
+    """
+    counts = {"directories": 0, "files": 0, "size": 0}
+    emitted = 0
+    truncated = False
+    stack = [(abs_sys_path, 1)]
+
+    while stack and not truncated:
+        dir_path, depth = stack.pop()
+        batch = []
+        try:
+            with os.scandir(dir_path) as it:
+                entries = sorted((e for e in it if not e.name.startswith('.')), key=lambda e: e.name)
+        except OSError as e:
+            yield [{"path": abs_sys_to_relative_path(dir_path, FS_ROOT), "error": e.strerror or str(e)}]
+            continue
+
+        subdirectories = []
+        for entry in entries:
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if not is_dir and entry.name.endswith('.py'):
+                continue
+            if is_dir and depth < max_depth:
+                subdirectories.append((entry.path, depth + 1))
+            if patterns and not any(fnmatch.fnmatchcase(entry.name, p) for p in patterns):
+                continue
+            if emitted >= limit:
+                truncated = True
+                break
+
+            record = {"path": abs_sys_to_relative_path(entry.path, FS_ROOT), "depth": depth}
+            if is_dir:
+                record["type"] = "directory"
+                counts["directories"] += 1
+            else:
+                try:
+                    size = entry.stat().st_size
+                except OSError:
+                    size = None
+                record["type"] = "file"
+                record["size"] = size
+                counts["files"] += 1
+                counts["size"] += size or 0
+            batch.append(record)
+            emitted += 1
+
+        yield batch
+        # Push in reverse so the stack pops subdirectories in name order.
+        stack.extend(reversed(subdirectories))
+
+    yield [{"summary": dict(counts, truncated=truncated)}]
+
+def handle_tree(abs_sys_path, max_depth=None, patterns=None, limit=None):
+    """Streams a recursive listing of a directory as newline-delimited JSON."""
+    if not os.path.exists(abs_sys_path):
+        raise FileNotFoundError("No such file or directory")
+    if not os.path.isdir(abs_sys_path):
+        raise NotADirectoryError("Not a directory")
+
+    max_depth = TREE_MAX_DEPTH if max_depth is None else min(max_depth, TREE_MAX_DEPTH)
+    limit = TREE_MAX_ENTRIES if limit is None else min(limit, TREE_MAX_ENTRIES)
+    if max_depth < 1 or limit < 1:
+        raise ValueError("max_depth and limit must be positive")
+    return NdjsonResponse(walk_tree(abs_sys_path, max_depth, patterns or [], limit))
+
+def handle_complete(partial, vfs_pwd, dirs_only=False, limit=None):
+    """Completes the last component of a partial path from the path index.
+
+    Candidates whose name starts with the typed text come first, followed by
+    case-insensitive matches. Directory candidates end with '/'. `prefix` is the
+    part of the input before the candidates, so `prefix + candidate` is the
+    completed path.
+    """
+    prefix, slash, typed = partial.rpartition('/')
+    prefix += slash
+    vfs_dir = prefix or '.'
+
+    abs_dir = vfs_to_abs_sys_path(vfs_dir, vfs_pwd, FS_ROOT)
+    if abs_dir is None:
+        raise ValueError("Invalid path: Directory traversal attempt detected.")
+
+    limit = COMPLETE_DEFAULT_LIMIT if limit is None else max(min(limit, COMPLETE_MAX_LIMIT), 1)
+    response = {"prefix": prefix, "candidates": [], "truncated": False}
+    try:
+        st = os.stat(abs_dir)
+    except OSError:
+        return response
+    if not stat.S_ISDIR(st.st_mode):
+        return response
+
+    names, folded = get_directory_index(abs_dir, st.st_mtime_ns)
+
+    matches = []
+    index = bisect.bisect_left(names, typed)
+    while index < len(names) and names[index].startswith(typed):
+        matches.append(names[index])
+        index += 1
+
+    typed_folded = typed.lower()
+    index = bisect.bisect_left(folded, (typed_folded,))
+    exact = set(matches)
+    while index < len(folded) and folded[index][0].startswith(typed_folded):
+        if folded[index][1] not in exact:
+            matches.append(folded[index][1])
+        index += 1
+
+    if dirs_only:
+        matches = [name for name in matches if name.endswith('/')]
+    response["candidates"] = matches[:limit]
+    response["truncated"] = len(matches) > limit
+    return response
 
 def handle_resolve(abs_sys_path, must_be_dir):
     """Resolves a path and checks if it's a valid directory or file."""
@@ -126,6 +1252,75 @@ def handle_resolve(abs_sys_path, must_be_dir):
     # The leading slash is important for the frontend's virtual path representation.
     return {"path": abs_sys_to_relative_path(abs_sys_path, FS_ROOT)}
 
+def stat_path(vfs_path, vfs_pwd, must_be_dir=False):
+    """Resolves one path and describes it with a single os.stat() call."""
+    abs_sys_path = vfs_to_abs_sys_path(vfs_path, vfs_pwd, FS_ROOT)
+    if abs_sys_path is None:
+        raise ValueError("Invalid path: Directory traversal attempt detected.")
+    try:
+        st = os.stat(abs_sys_path)
+    except OSError:
+        raise FileNotFoundError("No such file or directory")
+    if must_be_dir and not stat.S_ISDIR(st.st_mode):
+        raise NotADirectoryError("Not a directory")
+
+    if stat.S_ISDIR(st.st_mode):
+        entry_type = "directory"
+    elif stat.S_ISREG(st.st_mode):
+        entry_type = "file"
+    else:
+        entry_type = "other"
+    return {
+        "path": abs_sys_to_relative_path(abs_sys_path, FS_ROOT),
+        "type": entry_type,
+        "size": st.st_size if entry_type == "file" else None,
+        "mtime": int(st.st_mtime),
+        "url": abs_sys_to_relative_path(abs_sys_path, WEBSITE_ROOT),
+    }
+
+def handle_stat(items, default_pwd):
+    """Resolves and describes a list of paths in one request.
+
+    Each item is either a path string or an object with `path` and optional
+    `pwd` and `must_be_dir`. Every item gets its own result, with an `error`
+    key instead of the details when it could not be resolved.
+    """
+    if not isinstance(items, list):
+        raise ValueError("items must be a JSON list")
+    if len(items) > STAT_MAX_ITEMS:
+        raise ValueError(f"At most {STAT_MAX_ITEMS} items can be resolved at once")
+
+    results = []
+    for item in items:
+        if isinstance(item, str):
+            item = {"path": item}
+        try:
+            if not isinstance(item, dict) or not isinstance(item.get("path"), str):
+                raise ValueError("Each item needs a path")
+            pwd = item.get("pwd") or default_pwd
+            if not isinstance(pwd, str):
+                raise ValueError("pwd must be a string")
+            # Like the query parameter, "false" means false.
+            must_be_dir = item.get("must_be_dir", False)
+            if isinstance(must_be_dir, str):
+                must_be_dir = must_be_dir.lower() == 'true'
+            elif not isinstance(must_be_dir, bool):
+                raise ValueError("must_be_dir must be a boolean")
+            results.append(stat_path(item["path"], pwd, must_be_dir))
+        except (OSError, ValueError) as e:
+            results.append({"error": str(e)})
+    return {"results": results}
+
+def read_json_body(environ):
+    """Reads a JSON request body, from wsgi.input or, under CGI, from stdin."""
+    return parse_json_body(environ.get('wsgi.input') or sys.stdin.buffer, environ)
+
+def handle_metrics():
+    """Returns the request metrics in the Prometheus text format, if server.conf enables the endpoint."""
+    if not metrics_endpoint_enabled():
+        return {"error": "Unknown action: metrics"}
+    return TextResponse(render_prometheus(), PROMETHEUS_CONTENT_TYPE)
+
 def handle_get_public_url(abs_sys_path):
     """Constructs a public-facing URL for a given virtual file path."""
     # The path passed here is already the safe, absolute path on the server.
@@ -136,15 +1331,55 @@ def handle_get_public_url(abs_sys_path):
 
 # --- Main Execution ---
 
-def main():
-    """Main CGI script execution function."""
-    print("Content-Type: application/json")
-    print() # Required blank line
+def dispatch_action(action, params, environ, abs_sys_path, vfs_pwd_param):
+    """Routes an action to its handler."""
+    if action == 'ls':
+        return handle_ls(abs_sys_path)
+    elif action == 'cat':
+        offset = parse_int_param(get_query_param(params, 'offset', None), 'offset')
+        length = parse_int_param(get_query_param(params, 'length', None), 'length')
+        if get_query_param(params, 'raw', 'false').lower() == 'true':
+            return handle_cat_raw(abs_sys_path, offset, length, environ.get('HTTP_RANGE'))
+        return handle_cat(abs_sys_path, offset, length)
+    elif action == 'complete':
+        dirs_only = get_query_param(params, 'dirs_only', 'false').lower() == 'true'
+        limit = parse_int_param(get_query_param(params, 'limit', None), 'limit')
+        # The raw, unresolved input: the last component is usually not a real path yet.
+        return handle_complete(get_query_param(params, 'path', ''), vfs_pwd_param, dirs_only, limit)
+    elif action == 'thumbnail':
+        size = parse_int_param(get_query_param(params, 'size', None), 'size')
+        return handle_thumbnail(abs_sys_path, size, environ.get('HTTP_RANGE'))
+    elif action == 'search':
+        limit = parse_int_param(get_query_param(params, 'limit', None), 'limit')
+        return handle_search(abs_sys_path, get_query_param(params, 'q'),
+                             get_query_param(params, 'mode', 'substring'),
+                             get_query_param(params, 'scope', 'name'), limit)
+    elif action == 'tree':
+        max_depth = parse_int_param(get_query_param(params, 'max_depth', None), 'max_depth')
+        limit = parse_int_param(get_query_param(params, 'limit', None), 'limit')
+        patterns = [p for p in params.get('pattern', []) if p]
+        return handle_tree(abs_sys_path, max_depth, patterns, limit)
+    elif action == 'resolve':
+        must_be_dir = get_query_param(params, 'must_be_dir', 'false').lower() == 'true'
+        # We use abs_sys_path here to ensure the path is valid before resolving
+        return handle_resolve(abs_sys_path, must_be_dir)
+    elif action == 'get_public_url':
+        return handle_get_public_url(abs_sys_path)
+    elif action == 'stat':
+        # The list comes from the `items` query parameter or from a JSON POST body.
+        body = read_json_body(environ)
+        if isinstance(body, dict):
+            items = body.get('items')
+        else:
+            items = json.loads(get_query_param(params, 'items', '[]'))
+        return handle_stat(items, vfs_pwd_param)
+    elif action == 'metrics':
+        return handle_metrics()
+    else:
+        return {"error": f"Unknown action: {action}"}
 
-    query = os.environ.get('QUERY_STRING', '')
-    params = urllib.parse.parse_qs(query)
-    response_data = {}
-    
+def handle_request(params, environ):
+    """Runs the requested action. Returns a JSON-serializable dict or a StreamResponse."""
     try:
         action = get_query_param(params, 'action')
         vfs_path_param = get_query_param(params, 'path', '.')
@@ -154,23 +1389,169 @@ def main():
         if abs_sys_path is None:
             raise ValueError("Invalid path: Directory traversal attempt detected.")
 
-        if action == 'ls':
-            response_data = handle_ls(abs_sys_path)
-        elif action == 'cat':
-            response_data = handle_cat(abs_sys_path)
-        elif action == 'resolve':
-            must_be_dir = get_query_param(params, 'must_be_dir', 'false').lower() == 'true'
-            # We use abs_sys_path here to ensure the path is valid before resolving
-            response_data = handle_resolve(abs_sys_path, must_be_dir)
-        elif action == 'get_public_url':
-            response_data = handle_get_public_url(abs_sys_path)
-        else:
-            response_data = {"error": f"Unknown action: {action}"}
+        # Responses derived from a single file or directory can be revalidated by
+        # the browser or proxy; answer a matching conditional request with a 304.
+        validators = None
+        if action in CACHEABLE_ACTIONS:
+            validators = get_cache_validators(abs_sys_path)
+            if validators and is_not_modified(environ, *validators):
+                return maybe_compress(NotModifiedResponse(*validators), environ)
 
+        response_data = dispatch_action(action, params, environ, abs_sys_path, vfs_pwd_param)
+        if validators:
+            response_data = add_cache_headers(response_data, *validators)
+        return maybe_compress(response_data, environ)
+
+    except RangeNotSatisfiableError:
+        raise
     except Exception as e:
-        response_data = {"error": str(e)}
+        return {"error": str(e)}
+
+def main():
+    """Main CGI script execution function."""
+    query = os.environ.get('QUERY_STRING', '')
+    params = urllib.parse.parse_qs(query)
+    request = begin_request(get_query_param(params, 'action'), os.environ)
+    status = '200 OK'
+
+    try:
+        response_data = handle_request(params, os.environ)
+    except RangeNotSatisfiableError as e:
+        status = '416 Range Not Satisfiable'
+        print(f"Status: {status}")
+        print(f"Content-Range: bytes */{e.size}")
+        print()
+        end_request(request, status)
+        return
+
+    try:
+        if isinstance(response_data, StreamResponse):
+            status = response_data.status
+            print(f"Status: {status}")
+            for name, value in response_data.get_headers():
+                print(f"{name}: {value}")
+            print() # Required blank line
+            sys.stdout.flush()
+            # Flush every chunk so the client sees progress while we are still reading.
+            for chunk in response_data.iter_body():
+                request.bytes_out += len(chunk)
+                sys.stdout.buffer.write(chunk)
+                sys.stdout.buffer.flush()
+            return
+
+        body = serialize_response(response_data)
+        request.bytes_out = len(body.encode('utf-8'))
+        print("Content-Type: application/json")
+        print() # Required blank line
+        print(body)
+    finally:
+        end_request(request, status)
+
+# --- WSGI Application ---
 
-    print(json.dumps(response_data))
+def application(environ, start_response):
+    """WSGI entry point for running Filesystem.py as a long-lived application."""
+    params = urllib.parse.parse_qs(environ.get('QUERY_STRING', ''))
+    request = begin_request(get_query_param(params, 'action'), environ)
+
+    try:
+        response_data = handle_request(params, environ)
+    except RangeNotSatisfiableError as e:
+        status = '416 Range Not Satisfiable'
+        start_response(status, [('Content-Range', f'bytes */{e.size}'), ('Content-Length', '0')])
+        return iter_with_metrics(request, status, [b''])
+
+    if isinstance(response_data, FileResponse):
+        start_response(response_data.status, response_data.get_headers())
+        f = response_data.open()
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        # The server's file wrapper (often sendfile) always reads to EOF, so it is
+        # only usable when the range runs to the end of the file.
+        if file_wrapper and response_data.start + response_data.length == response_data.size:
+            # The body is sent by the server, so this records the time to the first byte.
+            request.bytes_out = response_data.length
+            end_request(request, response_data.status)
+            return file_wrapper(f, STREAM_CHUNK_SIZE)
+        return iter_with_metrics(request, response_data.status, response_data.iter_chunks(f))
+
+    if isinstance(response_data, StreamResponse):
+        start_response(response_data.status, response_data.get_headers())
+        return iter_with_metrics(request, response_data.status, response_data.iter_body())
+
+    body = serialize_response(response_data).encode('utf-8')
+    start_response('200 OK', [
+        ('Content-Type', 'application/json'),
+        ('Content-Length', str(len(body))),
+    ])
+    return iter_with_metrics(request, '200 OK', [body])
+
+def serve(host, port):
+    """Runs the WSGI application on a local threaded server."""
+    start_thumbnail_pool()
+    with make_threaded_server(host, port, application) as httpd:
+        # Build the completion index in the background so the first Tab press is already fast.
+        threading.Thread(target=warm_path_index, daemon=True).start()
+        print(f"Serving Filesystem API on http://{host}:{port}/", file=sys.stderr)
+        httpd.serve_forever()
+
+def cli(argv):
+    """Command line entry point for running Filesystem.py outside of CGI."""
+    import argparse
+    parser = argparse.ArgumentParser(prog='Filesystem.py', description='Nnoitra Terminal read-only filesystem API.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = subparsers.add_parser('serve', help='Run as a long-lived WSGI server.')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8002)
+
+    index_parser = subparsers.add_parser('index', help='Bring the filename search index up to date.')
+    index_parser.add_argument('--rebuild', action='store_true', help='Discard the index and build it from scratch.')
+
+    thumbnails_parser = subparsers.add_parser('thumbnails', help='Pre-render the thumbnails of a directory.')
+    thumbnails_parser.add_argument('path', nargs='?', default='/', help='Directory inside the read-only filesystem.')
+    thumbnails_parser.add_argument('--size', type=int, action='append', help='Thumbnail size to render; may be repeated.')
+    thumbnails_parser.add_argument('--recursive', action='store_true', help='Include subdirectories.')
+    thumbnails_parser.add_argument('--workers', type=int, default=None, help='Number of worker processes.')
+
+    precompress_parser = subparsers.add_parser('precompress', help='Create the compressed copies of the text files in a directory.')
+    precompress_parser.add_argument('path', nargs='?', default='/', help='Directory inside the read-only filesystem.')
+    precompress_parser.add_argument('--recursive', action='store_true', help='Include subdirectories.')
+
+    subparsers.add_parser('metrics', help='Print the metrics collected in metrics-file by CGI requests.')
+
+    args = parser.parse_args(argv)
+    if args.command == 'serve':
+        serve(args.host, args.port)
+    elif args.command == 'index':
+        if args.rebuild:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(SEARCH_INDEX_FILE + suffix):
+                    os.remove(SEARCH_INDEX_FILE + suffix)
+        conn = open_search_index()
+        refresh_search_index(conn, force=True)
+        count = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        print(f"Indexed {count} entries under {FS_ROOT}")
+    elif args.command == 'thumbnails':
+        if not load_pillow():
+            parser.error("Pillow is not installed")
+        abs_sys_path = vfs_to_abs_sys_path(args.path, '/', FS_ROOT)
+        if abs_sys_path is None or not os.path.isdir(abs_sys_path):
+            parser.error(f"Not a directory: {args.path}")
+        sizes = sorted({snap_thumbnail_size(size) for size in (args.size or [THUMBNAIL_DEFAULT_SIZE])})
+        rendered, failed = warm_thumbnails(abs_sys_path, sizes, args.recursive, args.workers)
+        print(f"Rendered {rendered} thumbnails, {failed} failed")
+    elif args.command == 'precompress':
+        abs_sys_path = vfs_to_abs_sys_path(args.path, '/', FS_ROOT)
+        if abs_sys_path is None or not os.path.isdir(abs_sys_path):
+            parser.error(f"Not a directory: {args.path}")
+        count = precompress_directory(abs_sys_path, args.recursive)
+        print(f"Wrote {count} compressed files")
+    elif args.command == 'metrics':
+        sys.stdout.write(render_prometheus())
 
 if __name__ == "__main__":
-    main()
+    # A CGI request never carries command line arguments.
+    if 'GATEWAY_INTERFACE' in os.environ or len(sys.argv) == 1:
+        main()
+    else:
+        cli(sys.argv[1:])
@@ -0,0 +1,26 @@
+#!/usr/bin/python3
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Fast CGI entry point for Filesystem.py.
+
+Python compiles the script it is started with on every run, but loads the
+modules it imports from their cached bytecode. Pointing the filesystem-api
+attribute in index.html here instead of at Filesystem.py saves compiling the
+whole API on every request.
+"""
+from Filesystem import main
+
+main()
@@ -0,0 +1,397 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Request metrics shared by the API scripts, rendered in the Prometheus text format.
+
+A long-running server keeps the metrics in memory. A CGI process lives for one
+request, so when a metrics file is configured each process appends its numbers
+to that file as one JSON line before exiting, and readers add the lines up.
+"""
+import os
+import sys
+import json
+import time
+import threading
+from collections import Counter
+
+from Config import get_config_value, get_path_from_config
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; the metrics file is then appended to without a lock and never compacted.
+    fcntl = None
+
+# Upper bounds, in seconds, of the request latency histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# How often the slow request sampler looks at the stacks of running requests.
+SAMPLE_INTERVAL = 0.01
+# Number of distinct stacks reported for a slow request.
+SLOW_REQUEST_TOP_STACKS = 5
+# Once the metrics file grows past this many bytes, the next writer folds its lines into one.
+METRICS_COMPACT_BYTES = 1024 * 1024
+
+# Requests for an action the script does not have are recorded under this label,
+# so clients can't make up new series.
+UNKNOWN_ACTION = 'unknown'
+
+_settings = {'script': '', 'actions': frozenset(), 'metrics_file': None, 'slow_request_threshold': None}
+_lock = threading.Lock()
+_local = threading.local()
+# name -> {label tuple -> value}; histograms keep [bucket counts..., count, sum].
+_counters = {}
+_histograms = {}
+# thread id -> RequestMetrics, for the slow request sampler.
+_active_requests = {}
+_sampler_started = False
+_connection_factory = None
+
+def configure_metrics(script, actions):
+    """Names the script and the actions it dispatches, and reads metrics-file and
+    slow-request-threshold from server.conf. Both are off by default."""
+    _settings['script'] = script
+    _settings['actions'] = frozenset(actions)
+    _settings['metrics_file'] = get_path_from_config('metrics-file')
+    try:
+        _settings['slow_request_threshold'] = float(get_config_value('slow-request-threshold') or '')
+    except ValueError:
+        _settings['slow_request_threshold'] = None
+
+def metrics_endpoint_enabled():
+    """Checks whether server.conf turns on the ?action=metrics endpoint."""
+    return get_config_value('metrics-endpoint') == 'on'
+
+def labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+def inc(name, labels, amount=1):
+    """Adds to a counter."""
+    key = labels_key(labels)
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0) + amount
+
+def observe(name, labels, value):
+    """Records a value in a histogram with LATENCY_BUCKETS."""
+    key = labels_key(labels)
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        buckets = series.get(key)
+        if buckets is None:
+            buckets = series[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                buckets[i] += 1
+        buckets[-2] += 1
+        buckets[-1] += value
+
+def record_cache(cache, hit):
+    """Counts a lookup in one of the scripts' caches."""
+    inc('nnoitra_cache_lookups_total', {'script': _settings['script'], 'cache': cache, 'result': 'hit' if hit else 'miss'})
+
+class RequestMetrics:
+    """The numbers collected while one request is handled."""
+
+    def __init__(self, script, action, bytes_in):
+        self.script = script
+        self.action = action
+        self.bytes_in = bytes_in
+        self.bytes_out = 0
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.started = time.perf_counter()
+        self.thread_id = threading.get_ident()
+        self.samples = Counter()
+
+def current_request():
+    return getattr(_local, 'request', None)
+
+def begin_request(action, environ):
+    """Starts collecting metrics for the request handled by this thread."""
+    try:
+        bytes_in = int(environ.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        bytes_in = 0
+    if action not in _settings['actions']:
+        action = UNKNOWN_ACTION
+    request = RequestMetrics(_settings['script'], action, bytes_in)
+    _local.request = request
+    if _settings['slow_request_threshold'] is not None:
+        start_sampler()
+        with _lock:
+            _active_requests[request.thread_id] = request
+    return request
+
+def end_request(request, status):
+    """Records a finished request. `status` is the HTTP status line or code."""
+    duration = time.perf_counter() - request.started
+    if getattr(_local, 'request', None) is request:
+        _local.request = None
+    labels = {'script': request.script, 'action': request.action}
+    observe('nnoitra_request_duration_seconds', labels, duration)
+    inc('nnoitra_requests_total', dict(labels, status=str(status).split(' ')[0]))
+    inc('nnoitra_request_bytes_total', dict(labels, direction='in'), request.bytes_in)
+    inc('nnoitra_request_bytes_total', dict(labels, direction='out'), request.bytes_out)
+    inc('nnoitra_sql_statements_total', labels, request.sql_statements)
+    inc('nnoitra_sql_seconds_total', labels, request.sql_seconds)
+
+    if _settings['slow_request_threshold'] is not None:
+        with _lock:
+            _active_requests.pop(request.thread_id, None)
+        if request.samples:
+            report_slow_request(request, duration)
+    if _settings['metrics_file'] and 'GATEWAY_INTERFACE' in os.environ:
+        append_to_file(_settings['metrics_file'])
+
+def count_bytes(request, chunks):
+    """Passes the chunks of a response body through, adding up its size."""
+    for chunk in chunks:
+        request.bytes_out += len(chunk)
+        yield chunk
+
+def iter_with_metrics(request, status, chunks):
+    """Streams a response body and records the request once the last chunk is sent."""
+    try:
+        yield from count_bytes(request, chunks)
+    finally:
+        end_request(request, status)
+
+# --- SQL Instrumentation ---
+
+def get_connection_factory():
+    """Returns a sqlite3.Connection subclass, for sqlite3.connect(factory=...), that counts
+    and times the statements it executes for the current request.
+
+    The classes are built on first use so requests that never open a database don't import sqlite3.
+    """
+    global _connection_factory
+    if _connection_factory is not None:
+        return _connection_factory
+    import sqlite3
+
+    class InstrumentedCursor(sqlite3.Cursor):
+        def execute(self, *args):
+            start = time.perf_counter()
+            try:
+                return super().execute(*args)
+            finally:
+                record_sql(time.perf_counter() - start)
+
+        def executemany(self, *args):
+            start = time.perf_counter()
+            try:
+                return super().executemany(*args)
+            finally:
+                record_sql(time.perf_counter() - start)
+
+    class InstrumentedConnection(sqlite3.Connection):
+        def cursor(self, factory=InstrumentedCursor):
+            return super().cursor(factory)
+
+        def execute(self, *args):
+            return self.cursor().execute(*args)
+
+        def executemany(self, *args):
+            return self.cursor().executemany(*args)
+
+    _connection_factory = InstrumentedConnection
+    return _connection_factory
+
+def record_sql(seconds):
+    request = current_request()
+    if request is not None:
+        request.sql_statements += 1
+        request.sql_seconds += seconds
+
+# --- Slow Request Sampling ---
+
+def start_sampler():
+    """Starts the thread that samples the stacks of requests running longer than the threshold."""
+    global _sampler_started
+    with _lock:
+        if _sampler_started:
+            return
+        _sampler_started = True
+    threading.Thread(target=run_sampler, name='slow-request-sampler', daemon=True).start()
+
+def run_sampler():
+    while True:
+        time.sleep(SAMPLE_INTERVAL)
+        threshold = _settings['slow_request_threshold']
+        now = time.perf_counter()
+        with _lock:
+            slow = [r for r in _active_requests.values() if now - r.started >= threshold]
+        if not slow:
+            continue
+        frames = sys._current_frames()
+        for request in slow:
+            frame = frames.get(request.thread_id)
+            if frame is not None:
+                request.samples[format_stack(frame)] += 1
+
+def format_stack(frame):
+    """Collapses a stack into one `outer;...;inner` line, like flame graph tools expect."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+def report_slow_request(request, duration):
+    """Writes the most frequent stacks of a slow request to stderr (the server's error log)."""
+    total = sum(request.samples.values())
+    lines = [f"Slow request: {request.script} action={request.action} took {duration:.3f}s, {total} samples"]
+    for stack, count in request.samples.most_common(SLOW_REQUEST_TOP_STACKS):
+        lines.append(f"  {count:>5} {stack}")
+    print('\n'.join(lines), file=sys.stderr)
+
+# --- Export ---
+
+def snapshot():
+    """Returns a JSON-serializable copy of all metrics."""
+    with _lock:
+        return {
+            'counters': {name: [[list(k), v] for k, v in series.items()] for name, series in _counters.items()},
+            'histograms': {name: [[list(k), list(v)] for k, v in series.items()] for name, series in _histograms.items()},
+        }
+
+def merge_snapshot(target, source):
+    """Adds the numbers of one snapshot to another, in place."""
+    for kind in ('counters', 'histograms'):
+        for name, series in source.get(kind, {}).items():
+            merged = {tuple(map(tuple, k)): v for k, v in target.setdefault(kind, {}).get(name, [])}
+            for key, value in series:
+                key = tuple(map(tuple, key))
+                if kind == 'counters':
+                    merged[key] = merged.get(key, 0) + value
+                else:
+                    old = merged.get(key, [0] * len(value))
+                    merged[key] = [a + b for a, b in zip(old, value)]
+            target[kind][name] = [[list(k), v] for k, v in merged.items()]
+    return target
+
+def open_metrics_file(path, lock):
+    """Opens the metrics file for appending and takes `lock` on it.
+
+    Compaction replaces the file, so a writer that locked the old one tries again
+    with the new one. Returns None if a non-blocking lock is not available.
+    """
+    while True:
+        f = open(path, 'a', encoding='utf-8')
+        if not fcntl:
+            return f
+        try:
+            fcntl.flock(f, lock)
+        except BlockingIOError:
+            f.close()
+            return None
+        try:
+            if os.fstat(f.fileno()).st_ino == os.stat(path).st_ino:
+                return f
+        except FileNotFoundError:
+            pass
+        f.close()
+
+def read_metrics_file(path):
+    """Adds up the lines of a metrics file. Lines that don't parse, like one cut short
+    by a crash, are skipped."""
+    data = {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    merge_snapshot(data, json.loads(line))
+                except (ValueError, AttributeError):
+                    pass
+    except FileNotFoundError:
+        pass
+    return data
+
+def append_to_file(path):
+    """Appends this process's metrics to a metrics file shared by CGI processes.
+
+    Writers only share a lock, so they don't wait for each other.
+    """
+    data = snapshot()
+    # Only write each number once.
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+    if not data['counters'] and not data['histograms']:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    f = open_metrics_file(path, fcntl.LOCK_SH if fcntl else None)
+    with f:
+        f.write(json.dumps(data) + '\n')
+        f.flush()
+        size = os.fstat(f.fileno()).st_size
+    if size > METRICS_COMPACT_BYTES:
+        compact_metrics_file(path)
+
+def compact_metrics_file(path):
+    """Replaces the lines of the metrics file with their sum. Skipped if another
+    process has the file open; the next writer will try again."""
+    if not fcntl:
+        return False
+    f = open_metrics_file(path, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    if f is None:
+        return False
+    with f:
+        data = read_metrics_file(path)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as out:
+                out.write(json.dumps(data) + '\n')
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return True
+
+def load_metrics():
+    """Returns the metrics of this process plus those in the metrics file."""
+    data = snapshot()
+    path = _settings['metrics_file']
+    if path:
+        merge_snapshot(data, read_metrics_file(path))
+    return data
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for name, value in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+def render_prometheus():
+    """Renders all metrics in the Prometheus text exposition format."""
+    data = load_metrics()
+    lines = []
+    for name, series in sorted(data.get('counters', {}).items()):
+        lines.append(f'# TYPE {name} counter')
+        for key, value in series:
+            lines.append(f'{name}{format_labels(key)} {value}')
+    for name, series in sorted(data.get('histograms', {}).items()):
+        lines.append(f'# TYPE {name} histogram')
+        for key, values in series:
+            for bound, count in zip(LATENCY_BUCKETS, values):
+                lines.append(f'{name}_bucket{format_labels(key, [("le", bound)])} {count}')
+            lines.append(f'{name}_bucket{format_labels(key, [("le", "+Inf")])} {values[-2]}')
+            lines.append(f'{name}_count{format_labels(key)} {values[-2]}')
+            lines.append(f'{name}_sum{format_labels(key)} {values[-1]}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,255 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Incremental request body parsing shared by the API scripts."""
+import json
+from urllib.parse import parse_qsl
+
+# Bodies larger than this are rejected before any of it is read.
+MAX_BODY_SIZE = 4 * 1024 * 1024
+# Limit for a single field unless the caller raises it for a specific name.
+MAX_FIELD_SIZE = 1024 * 1024
+MAX_FIELDS = 256
+# Limit for the headers of one multipart part.
+MAX_PART_HEADER_SIZE = 8 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+
+class RequestBodyError(ValueError):
+    """Raised for a request body that is malformed or exceeds a limit."""
+
+    def __init__(self, message, status='400 Bad Request'):
+        super().__init__(message)
+        self.status = status
+
+class BodyReader:
+    """Reads exactly CONTENT_LENGTH bytes from an input stream, in chunks."""
+
+    def __init__(self, stream, content_length):
+        self.stream = stream
+        self.remaining = content_length
+
+    def read(self, size=READ_CHUNK_SIZE):
+        if self.remaining <= 0:
+            return b''
+        chunk = self.stream.read(min(size, self.remaining))
+        if not chunk:
+            raise RequestBodyError("Request body is shorter than its Content-Length.")
+        self.remaining -= len(chunk)
+        return chunk
+
+    def read_all(self):
+        chunks = []
+        while True:
+            chunk = self.read()
+            if not chunk:
+                return b''.join(chunks)
+            chunks.append(chunk)
+
+def get_content_length(environ, max_body_size):
+    """Returns the declared body length, rejecting oversized bodies before reading them."""
+    content_length = environ.get('CONTENT_LENGTH') or '0'
+    try:
+        content_length = int(content_length)
+    except ValueError:
+        raise RequestBodyError("Invalid Content-Length.")
+    if content_length < 0:
+        raise RequestBodyError("Invalid Content-Length.")
+    if content_length > max_body_size:
+        raise RequestBodyError(f"Request body exceeds {max_body_size} bytes.", '413 Content Too Large')
+    return content_length
+
+def parse_content_type(content_type):
+    """Splits a Content-Type header into its lowercased media type and a dict of parameters."""
+    media_type, *params = content_type.split(';')
+    parsed = {}
+    for param in params:
+        key, _, value = param.strip().partition('=')
+        value = value.strip()
+        if len(value) >= 2 and value[0] == value[-1] == '"':
+            value = value[1:-1]
+        parsed[key.lower()] = value
+    return media_type.strip().lower(), parsed
+
+def check_field(form_data, name, size, max_field_size, field_limits):
+    """Enforces the per-field and field count limits."""
+    if size > field_limits.get(name, max_field_size):
+        raise RequestBodyError(f"Field '{name}' is too large.", '413 Content Too Large')
+    if name not in form_data and len(form_data) >= MAX_FIELDS:
+        raise RequestBodyError("Too many fields.", '413 Content Too Large')
+
+def iter_multipart(reader, boundary):
+    """Yields (headers, value chunks) events from a multipart body as it is read.
+
+    Events are ('part', header bytes) when a part starts, ('data', bytes) for
+    each piece of its value and ('end', None) once the closing delimiter is seen.
+    """
+    delimiter = b'\r\n--' + boundary
+    # The first delimiter is not preceded by a line break.
+    buffer = b'\r\n'
+    state = 'preamble'
+    while True:
+        chunk = reader.read()
+        buffer += chunk
+        while True:
+            if state in ('preamble', 'data'):
+                index = buffer.find(delimiter)
+                if index < 0:
+                    # Hold back enough to recognise a delimiter split across chunks.
+                    keep = len(delimiter) - 1
+                    if state == 'data' and len(buffer) > keep:
+                        yield 'data', buffer[:-keep]
+                    buffer = buffer[-keep:]
+                    break
+                if state == 'data' and index:
+                    yield 'data', buffer[:index]
+                buffer = buffer[index + len(delimiter):]
+                state = 'delimiter'
+            if state == 'delimiter':
+                if len(buffer) < 2:
+                    break
+                if buffer.startswith(b'--'):
+                    yield 'end', None
+                    return
+                state = 'headers'
+            if state == 'headers':
+                index = buffer.find(b'\r\n\r\n')
+                if index < 0:
+                    if len(buffer) > MAX_PART_HEADER_SIZE:
+                        raise RequestBodyError("Multipart headers are too large.")
+                    break
+                # Skip the line break (or padding) that ends the delimiter line.
+                headers = buffer[buffer.find(b'\r\n') + 2:index]
+                buffer = buffer[index + 4:]
+                yield 'part', headers
+                state = 'data'
+        if not chunk:
+            raise RequestBodyError("Multipart body ended before its closing boundary.")
+
+def get_part_name(headers):
+    """Returns the field name of a multipart part, or None for parts without one."""
+    for line in headers.decode('utf-8', 'replace').split('\r\n'):
+        name, _, value = line.partition(':')
+        if name.strip().lower() == 'content-disposition':
+            _, params = parse_content_type(value)
+            # File uploads are not fields; none of the actions accept them.
+            if 'filename' in params:
+                return None
+            return params.get('name')
+    return None
+
+def parse_multipart(reader, boundary, max_field_size, field_limits):
+    """Parses multipart/form-data into a dict of field values, streaming each value."""
+    form_data = {}
+    name = None
+    value = []
+    size = 0
+    for event, data in iter_multipart(reader, boundary.encode('latin-1')):
+        if event == 'data':
+            if name is None:
+                continue
+            size += len(data)
+            check_field(form_data, name, size, max_field_size, field_limits)
+            value.append(data)
+            continue
+        if name is not None:
+            form_data[name] = b''.join(value).decode('utf-8')
+        if event == 'part':
+            name = get_part_name(data)
+            value = []
+            size = 0
+            if name is not None:
+                check_field(form_data, name, size, max_field_size, field_limits)
+    return form_data
+
+def parse_urlencoded(reader, max_field_size, field_limits):
+    """Parses an application/x-www-form-urlencoded body into a dict of field values."""
+    form_data = {}
+    body = reader.read_all().decode('utf-8')
+    try:
+        pairs = parse_qsl(body, keep_blank_values=True, strict_parsing=False, max_num_fields=MAX_FIELDS)
+    except ValueError:
+        raise RequestBodyError("Too many fields.", '413 Content Too Large')
+    for name, value in pairs:
+        check_field(form_data, name, len(value), max_field_size, field_limits)
+        form_data[name] = value
+    return form_data
+
+def parse_json_fields(reader, max_field_size, field_limits):
+    """Parses a JSON object body into a dict of field values.
+
+    Numbers and booleans are re-serialized, so handlers see the same strings as
+    they would from a form post. A null field is left out, as if it was not sent.
+    """
+    body = read_json(reader)
+    if body is None:
+        return {}
+    if not isinstance(body, dict):
+        raise RequestBodyError("JSON body must be an object.")
+    form_data = {}
+    for name, value in body.items():
+        if value is None:
+            continue
+        if isinstance(value, (dict, list)):
+            raise RequestBodyError(f"Field '{name}' must be a string, number or boolean.")
+        if not isinstance(value, str):
+            value = json.dumps(value)
+        check_field(form_data, name, len(value), max_field_size, field_limits)
+        form_data[name] = value
+    return form_data
+
+def read_json(reader):
+    """Decodes the whole of a bounded body as JSON. Returns None for a blank body."""
+    data = reader.read_all()
+    if not data.strip():
+        return None
+    try:
+        return json.loads(data.decode('utf-8'))
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        raise RequestBodyError("Invalid JSON body.")
+
+def parse_body(stream, environ, max_body_size=MAX_BODY_SIZE, max_field_size=MAX_FIELD_SIZE, field_limits=None):
+    """Parses a form or JSON request body into a dict of field values.
+
+    A missing body, or one of any other type, has no fields. Raises
+    RequestBodyError instead of returning partial data.
+    """
+    content_length = get_content_length(environ, max_body_size)
+    if not content_length:
+        return {}
+    reader = BodyReader(stream, content_length)
+    media_type, params = parse_content_type(environ.get('CONTENT_TYPE', ''))
+    field_limits = field_limits or {}
+    try:
+        if media_type == 'multipart/form-data':
+            if not params.get('boundary'):
+                raise RequestBodyError("Multipart body without a boundary.")
+            return parse_multipart(reader, params['boundary'], max_field_size, field_limits)
+        if media_type == 'application/x-www-form-urlencoded':
+            return parse_urlencoded(reader, max_field_size, field_limits)
+        if media_type == 'application/json':
+            return parse_json_fields(reader, max_field_size, field_limits)
+    except UnicodeDecodeError:
+        raise RequestBodyError("Field values must be UTF-8.")
+    return {}
+
+def parse_json_body(stream, environ, max_body_size=MAX_BODY_SIZE):
+    """Reads a JSON request body. Returns None if the request has no JSON body."""
+    media_type, _ = parse_content_type(environ.get('CONTENT_TYPE', ''))
+    if media_type != 'application/json':
+        return None
+    content_length = get_content_length(environ, max_body_size)
+    if not content_length:
+        return None
+    return read_json(BodyReader(stream, content_length))
@@ -65,19 +65,27 @@ export class ApiManager {
     }
 
     /**
-     * Makes a GET request to the backend API.
+     * Makes a GET request to the backend API. The browser caches the response
+     * if the server allows it, and revalidates it with If-None-Match.
      * @param {Object} [data={}] - An object containing data to be sent as URL query parameters.
+     * @param {string|null} [token=null] - The session token to include, if any. It is sent in
+     * the X-Token header, never in the URL, which ends up in logs and the browser history.
      * @returns {Promise<object>} The JSON response from the server.
      */
-    async get(data = {}) {
+    async get(data = {}, token = null) {
         const url = new URL(this.#apiEndpoint, window.location.origin);
         for (const [key, value] of Object.entries(data)) {
             url.searchParams.append(key, value);
         }
+        const headers = {};
+        if (token) {
+            headers['X-Token'] = token;
+        }
 
         log.log(`Making API call (GET): url=${url}`);
         const response = await fetch(url, {
-            method: 'GET'
+            method: 'GET',
+            headers
         });
 
         if (!response.ok) {
@@ -41,6 +41,9 @@ const HISTORY_CATEGORY = 'HISTORY';
  */
 class AccountingService extends BaseService {
     #apiManager;
+    #pendingOperations = [];
+    // Settles once every write queued so far has been sent.
+    #writesSettled = Promise.resolve();
 
     constructor(eventBus, config = {}) {
         super(eventBus);
@@ -184,12 +187,12 @@ class AccountingService extends BaseService {
             const node = { meta: { type: 'variable' }, content: payload.value };
             this.#makeStorageRequest('LOCAL', STORAGE_APIS.SET_NODE, { key: storageKey, node });
         } else {
-            const { value: token } = await this.request(EVENTS.VAR_GET_LOCAL_REQUEST, { key: ENV_VARS.TOKEN });
-            this.#apiManager.post('set_data', {
+            this.#queueRemoteOperation({
+                op: 'set',
                 category: payload.category,
                 key: payload.key,
-                value: payload.value,
-            }, token);
+                value: String(payload.value),
+            });
         }
     }
 
@@ -199,11 +202,50 @@ class AccountingService extends BaseService {
             const storageKey = `${GUEST_STORAGE_PREFIX}${payload.category}_${payload.key}`;
             this.#makeStorageRequest('LOCAL', STORAGE_APIS.DELETE_NODE, { key: storageKey });
         } else {
-            const { value: token } = await this.request(EVENTS.VAR_GET_LOCAL_REQUEST, { key: ENV_VARS.TOKEN });
-            this.#apiManager.post('delete_data', {
+            this.#queueRemoteOperation({
+                op: 'delete',
                 category: payload.category,
                 key: payload.key,
-            }, token);
+            });
+        }
+    }
+
+    /**
+     * Queues a remote write. All writes queued in the same tick are sent as a
+     * single `batch` request, so restoring many variables costs one round trip.
+     * Batches are sent one after the other, in the order they were queued.
+     * @param {object} operation - A batch operation (`op`, `category`, `key`, `value`).
+     * @private
+     */
+    #queueRemoteOperation(operation) {
+        this.#pendingOperations.push(operation);
+        if (this.#pendingOperations.length === 1) {
+            this.#writesSettled = this.#writesSettled
+                .then(() => new Promise(resolve => setTimeout(resolve, 0)))
+                .then(() => this.#flushRemoteOperations());
+        }
+    }
+
+    /**
+     * Waits until the queued writes have been sent, so a read that follows
+     * them sees their result instead of overtaking them.
+     * @private
+     */
+    async #waitForPendingWrites() {
+        await this.#writesSettled;
+    }
+
+    async #flushRemoteOperations() {
+        const operations = this.#pendingOperations;
+        this.#pendingOperations = [];
+        try {
+            const { value: token } = await this.request(EVENTS.VAR_GET_LOCAL_REQUEST, { key: ENV_VARS.TOKEN });
+            const result = await this.#apiManager.post('batch', { operations: JSON.stringify(operations) }, token);
+            if (result.status !== 'success') {
+                this.log.error('Failed to save remote data:', result.message);
+            }
+        } catch (error) {
+            this.log.error('Network or parsing error while saving remote data:', error);
         }
     }
 
@@ -220,6 +262,10 @@ class AccountingService extends BaseService {
                 // Read the existing history array.
                 const node = await this.#makeStorageRequest('LOCAL', STORAGE_APIS.GET_NODE, { key: historyKey, lockId });
                 const history = node?.content || [];
+                // Like the backend, don't store a command identical to the previous one.
+                if (history.length > 0 && history[history.length - 1] === payload.command) {
+                    return;
+                }
                 // Add the new command.
                 history.push(payload.command);
                 // Write the updated array back.
@@ -230,17 +276,17 @@ class AccountingService extends BaseService {
                 await this.#makeStorageRequest('LOCAL', STORAGE_APIS.UNLOCK_NODE, { key: historyKey, lockId });
             }
         } else {
-            // For logged-in users, continue saving each command individually to the remote backend.
+            // For logged-in users, append the command to the remote history, which the
+            // backend trims to HISTSIZE entries.
             const { value: token } = await this.request(EVENTS.VAR_GET_LOCAL_REQUEST, { key: ENV_VARS.TOKEN });
-            this.#apiManager.post('set_data', {
-                category: HISTORY_CATEGORY,
-                key: new Date().toISOString(),
-                value: command
+            this.#apiManager.post('history_append', {
+                command: payload.command,
+                histsize: payload.histsize
             }, token);
         }
     }
 
-    async #handleHistoryLoad({ respond }) {
+    async #handleHistoryLoad({ histsize, respond }) {
         const { value: user } = await this.request(EVENTS.VAR_GET_LOCAL_REQUEST, { key: ENV_VARS.USER });
         if (user === GUEST_USER) {
             // Read the single history key. This is a read-only operation, so no lock is needed.
@@ -250,14 +296,14 @@ class AccountingService extends BaseService {
             if (respond) respond({ history: historyArray });
         } else {
             try {
+                await this.#waitForPendingWrites();
                 const { value: token } = await this.request(EVENTS.VAR_GET_LOCAL_REQUEST, { key: ENV_VARS.TOKEN });
-                const result = await this.#apiManager.post('get_data', {
-                    category: HISTORY_CATEGORY
-                }, token);
+                // Only the last HISTSIZE entries are reachable from the shell.
+                const result = await this.#apiManager.post('history_tail', histsize ? { limit: histsize } : {}, token);
 
                 this.log.log("History data received from server:", result);
-                // The backend returns an object with timestamps as keys. We want the values, sorted by key (timestamp).
-                const sortedCommands = Object.keys(result.data || {}).sort().map(key => result.data[key]);
+                // The backend returns the entries oldest to newest.
+                const sortedCommands = (result.entries || []).map(entry => entry.command);
 
                 if (respond) {
                     respond({ history: sortedCommands });
@@ -306,11 +352,14 @@ class AccountingService extends BaseService {
             if (respond) respond({ variables });
         } else { // Logged-in user logic remains the same
             try {
+                await this.#waitForPendingWrites();
                 const { value: token } = await this.request(EVENTS.VAR_GET_LOCAL_REQUEST, { key: ENV_VARS.TOKEN });
 
-                const result = await this.#apiManager.post('get_data', {
-                    category: category,
-                    key: key // Pass key along, though backend might not use it for 'ENV'
+                // A GET, so the browser keeps the response and only revalidates it
+                // against the data's version on later loads.
+                const result = await this.#apiManager.get({
+                    action: 'get_data',
+                    category: category
                 }, token);
 
                 this.log.log("Remote variables received from server:", result);
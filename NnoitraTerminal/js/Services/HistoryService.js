@@ -81,20 +81,19 @@ class HistoryService extends BaseService{
         if (!trimmedCommand) return;
 
         // Lazily get HISTSIZE to pass along with the persist request.
-        const { value } = await this.request(EVENTS.VAR_GET_SYSTEM_REQUEST, { key: ENV_VARS.HISTSIZE });
-        const histsize = value || DEFAULT_HISTSIZE;
-
-        // Check against the last known command to prevent duplicates.
-        // We fetch it here to ensure we have the most recent state.
-        const { history: latestHistory } = await this.request(EVENTS.HISTORY_LOAD_REQUEST);
-        if (latestHistory.length > 0 && latestHistory[latestHistory.length - 1] === trimmedCommand) {
-            return;
-        }
+        const histsize = await this.#getHistsize();
 
+        // A command identical to the previous one is dropped by whoever stores the
+        // history, so there is no need to load it first.
         this.dispatch(EVENTS.COMMAND_PERSIST_REQUEST, { command: trimmedCommand, histsize });
         this.resetCursor();
     }
 
+    async #getHistsize() {
+        const { value } = await this.request(EVENTS.VAR_GET_SYSTEM_REQUEST, { key: ENV_VARS.HISTSIZE });
+        return value || DEFAULT_HISTSIZE;
+    }
+
     resetCursor() {
         this.#cursorIndex = 0;
         this.#isNavigating = false;
@@ -103,7 +102,7 @@ class HistoryService extends BaseService{
 
     async #handleGetPrevious() {
         if (!this.#isNavigating) {
-            const { history } = await this.request(EVENTS.HISTORY_LOAD_REQUEST);
+            const { history } = await this.request(EVENTS.HISTORY_LOAD_REQUEST, { histsize: await this.#getHistsize() });
             // History from accounting is oldest-to-newest. We need newest-to-oldest for navigation.
             this.#navigationHistoryCache = history.slice().reverse();
             this.#isNavigating = true;
@@ -134,7 +133,7 @@ class HistoryService extends BaseService{
         // The history is stored with the most recent command at index 0.
         // For display, we want oldest to newest. Accounting service now provides it in this order.
         (async () => {
-            const { history } = await this.request(EVENTS.HISTORY_LOAD_REQUEST);
+            const { history } = await this.request(EVENTS.HISTORY_LOAD_REQUEST, { histsize: await this.#getHistsize() });
             if (!history || history.length === 0) {
                 respond({ history: [] });
                 return;
@@ -0,0 +1,175 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Fixtures shared by the API tests: throwaway databases and file trees, and WSGI calls."""
+import io
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from urllib.parse import urlencode
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Api')
+sys.path.insert(0, API_DIR)
+
+import Accounting
+import Admission
+import Filesystem
+
+def call_wsgi(application, query=None, body=b'', method=None, headers=None, environ=None):
+    """Runs one request through a WSGI application. Returns (status, headers, body bytes).
+
+    `query` and a dict `body` are urlencoded; header names are given as in the
+    environ, e.g. HTTP_IF_NONE_MATCH.
+    """
+    if isinstance(body, dict):
+        body = urlencode(body).encode('utf-8')
+    request = {
+        'REQUEST_METHOD': method or ('POST' if body else 'GET'),
+        'QUERY_STRING': urlencode(query or {}, doseq=True),
+        'CONTENT_LENGTH': str(len(body)),
+        'REMOTE_ADDR': '192.0.2.1',
+        'wsgi.input': io.BytesIO(body),
+    }
+    if body and not (headers and 'CONTENT_TYPE' in headers):
+        request['CONTENT_TYPE'] = 'application/x-www-form-urlencoded'
+    request.update(headers or {})
+    request.update(environ or {})
+    started = {}
+
+    def start_response(status, response_headers):
+        started['status'] = status
+        started['headers'] = response_headers
+
+    chunks = application(request, start_response)
+    try:
+        data = b''.join(chunks)
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+    return started['status'], dict(started['headers']), data
+
+class TempDirTestCase(unittest.TestCase):
+    """Gives every test its own temporary directory and an easy way to swap module globals."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir, True)
+
+    def patch(self, target, name, value):
+        patcher = mock.patch.object(target, name, value)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+class AccountingTestCase(TempDirTestCase):
+    """Runs Accounting.py against a fresh database in a temporary directory."""
+
+    def setUp(self):
+        super().setUp()
+        self.db_file = os.path.join(self.tmp_dir, 'users.db')
+        self.patch(Accounting, 'DB_FILE', self.db_file)
+        self.patch(Accounting, 'DB_DIR', self.tmp_dir)
+        self.patch(Accounting, 'SHARD_DIR', os.path.join(self.tmp_dir, 'shards'))
+        self.patch(Accounting, 'DATA_SHARDS', 0)
+        self.patch(Accounting, '_session_cache', Accounting.SessionCache(Accounting.SESSION_CACHE_SIZE,
+                                                                          Accounting.SESSION_CACHE_TTL))
+        self.patch(Accounting, '_change_notifier', Accounting.ChangeNotifier())
+        self.admission_store = Admission.AdmissionStore(os.path.join(self.tmp_dir, 'admission.db'))
+        self.patch(Accounting, '_admission_store', self.admission_store)
+        self.addCleanup(self.close_connections)
+
+    def close_connections(self):
+        """Forgets every connection and initialized file, as a new process would."""
+        Accounting.release_db()
+        for pool in Accounting._db_pools.values():
+            while not pool.empty():
+                pool.get_nowait().close()
+        Accounting._db_pools.clear()
+        Accounting._db_initialized.clear()
+        conn = getattr(self.admission_store._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.admission_store._local.conn = None
+
+    def query(self, sql, params=(), path=None):
+        """Runs a query on its own connection, outside of the code under test."""
+        import sqlite3
+        conn = sqlite3.connect(path or self.db_file)
+        try:
+            rows = conn.execute(sql, params).fetchall()
+            conn.commit()
+            return rows
+        finally:
+            conn.close()
+
+    def call(self, action, fields=None, **kwargs):
+        """Sends an action with its fields in a POST body. Returns (status, headers, decoded JSON)."""
+        status, headers, body = call_wsgi(Accounting.application, {'action': action}, fields or {}, **kwargs)
+        return status, headers, json.loads(body) if body else None
+
+    def post(self, action, **fields):
+        """Sends an action and returns its decoded JSON answer."""
+        return self.call(action, fields)[2]
+
+    def login(self, username='alice', password='secret'):
+        """Creates a user if needed and returns a fresh session token."""
+        self.post('add_user', username=username, password=password)
+        response = self.post('login', username=username, password=password)
+        self.assertEqual(response['status'], 'success', response)
+        return response['token']
+
+class FilesystemTestCase(TempDirTestCase):
+    """Runs Filesystem.py against a small file tree in a temporary directory."""
+
+    def setUp(self):
+        super().setUp()
+        self.fs_root = os.path.join(self.tmp_dir, 'fs')
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        os.makedirs(self.fs_root)
+        self.patch(Filesystem, 'WEBSITE_ROOT', self.tmp_dir)
+        self.patch(Filesystem, 'FS_ROOT', self.fs_root)
+        self.patch(Filesystem, 'CACHE_DIR', self.cache_dir)
+        self.patch(Filesystem, 'SEARCH_INDEX_FILE', os.path.join(self.cache_dir, 'search.db'))
+        self.patch(Filesystem, '_listing_cache', Filesystem.OrderedDict())
+        self.patch(Filesystem, '_path_index', Filesystem.OrderedDict())
+        self.addCleanup(self.close_search_index)
+
+    def close_search_index(self):
+        conn = getattr(Filesystem._search_local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            Filesystem._search_local.conn = None
+
+    def write_file(self, vfs_path, content=b''):
+        """Creates a file in the tree, with its parent directories. Returns its system path."""
+        path = os.path.join(self.fs_root, vfs_path.lstrip('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content.encode('utf-8') if isinstance(content, str) else content)
+        return path
+
+    def call(self, action, **params):
+        """Sends a GET for an action. `headers` and `body` go to the request. Returns (status, headers, body bytes)."""
+        headers = params.pop('headers', None)
+        body = params.pop('body', b'')
+        return call_wsgi(Filesystem.application, dict(params, action=action), body, headers=headers)
+
+    def get(self, action, **params):
+        """Sends a GET for an action and returns its decoded JSON answer."""
+        status, _, body = self.call(action, **params)
+        return json.loads(body)
@@ -0,0 +1,112 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for the admission control of Api/Accounting.py and its shared state in Api/Admission.py."""
+import sqlite3
+import unittest
+from unittest import mock
+
+from support import Accounting, Admission, AccountingTestCase
+
+class AdmitRequestTests(AccountingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.login()
+        # Start from full buckets, as if alice had signed up a while ago.
+        self.query("DELETE FROM buckets", path=self.admission_store.path)
+
+    def attempt(self, username='alice'):
+        """Tries to log in. Returns (status, Retry-After header)."""
+        status, headers, _ = self.call('login', {'username': username, 'password': 'secret'})
+        return status, headers.get('Retry-After')
+
+    def store_rows(self, table):
+        return self.query(f"SELECT * FROM {table}", path=self.admission_store.path)
+
+    def test_rate_limit_per_address(self):
+        self.patch(Accounting, 'RATE_LIMITS', {('login', 'ip'): (2, 60)})
+        self.assertEqual(self.attempt()[0], '200 OK')
+        self.assertEqual(self.attempt()[0], '200 OK')
+        self.assertEqual(self.attempt(), ('429 Too Many Requests', '30'))
+
+    def test_concurrency_refusal_costs_no_tokens(self):
+        self.patch(Accounting, 'RATE_LIMITS', {('login', 'ip'): (1, 60)})
+        self.patch(Accounting, 'CONCURRENCY_LIMITS', {'login': 1})
+        slot_id = self.admission_store.acquire_slot('login', 1)
+        for _ in range(3):
+            self.assertEqual(self.attempt(), ('429 Too Many Requests', str(Accounting.CONCURRENCY_RETRY_AFTER)))
+        self.assertEqual(self.store_rows('buckets'), [])
+        self.admission_store.release_slot(slot_id)
+        self.assertEqual(self.attempt()[0], '200 OK')
+
+    def test_rate_refusal_gives_the_slot_back(self):
+        self.patch(Accounting, 'RATE_LIMITS', {('login', 'ip'): (1, 60)})
+        self.patch(Accounting, 'CONCURRENCY_LIMITS', {'login': 1})
+        self.assertEqual(self.attempt()[0], '200 OK')
+        self.assertEqual(self.attempt()[0], '429 Too Many Requests')
+        self.assertEqual(self.store_rows('slots'), [])
+
+    def test_usernames_are_not_stored(self):
+        self.patch(Accounting, 'RATE_LIMITS', {('login', 'user'): (1, 60)})
+        self.assertEqual(self.attempt('alice')[0], '200 OK')
+        self.assertEqual(self.attempt('alice')[0], '429 Too Many Requests')
+        self.assertEqual(self.attempt('bob')[0], '200 OK')
+        keys = [key for key, in self.query("SELECT key FROM buckets", path=self.admission_store.path)]
+        self.assertEqual(len(keys), 2)
+        self.assertFalse(any('alice' in key or 'bob' in key for key in keys))
+
+    def test_broken_state_file_does_not_block_requests(self):
+        with mock.patch.object(self.admission_store, 'acquire_slot', side_effect=sqlite3.OperationalError('locked')):
+            self.patch(Accounting, 'CONCURRENCY_LIMITS', {'login': 1})
+            self.assertEqual(self.attempt()[0], '200 OK')
+
+class AdmissionStoreTests(AccountingTestCase):
+
+    def take(self, key, capacity, period, now):
+        with mock.patch.object(Admission.time, 'time', return_value=now):
+            return self.admission_store.take_tokens([(key, capacity, period)])
+
+    def keys(self):
+        return {key for key, in self.query("SELECT key FROM buckets", path=self.admission_store.path)}
+
+    def test_full_buckets_are_removed(self):
+        self.patch(Admission, 'BUCKET_CLEANUP_ODDS', 1)
+        self.assertEqual(self.take('slow', 1, 60, 1000), 0)
+        self.assertEqual(self.take('fast', 2, 10, 1000), 0)
+        # 'fast' refills one token in 5 seconds, 'slow' needs 60.
+        self.assertEqual(self.take('other', 1, 60, 1006), 0)
+        self.assertEqual(self.keys(), {'slow', 'other'})
+        self.assertGreater(self.take('slow', 1, 60, 1006), 0)
+
+    def test_bucket_count_is_capped(self):
+        self.patch(Admission, 'BUCKET_CLEANUP_ODDS', 1)
+        self.patch(Admission, 'MAX_BUCKETS', 2)
+        for i, key in enumerate(('a', 'b', 'c')):
+            self.take(key, 1, 60, 1000 + i)
+        # The bucket closest to full goes first.
+        self.assertEqual(self.keys(), {'b', 'c'})
+
+    def test_old_state_file_is_replaced(self):
+        conn = sqlite3.connect(self.admission_store.path)
+        conn.execute("CREATE TABLE buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)")
+        conn.execute("INSERT INTO buckets VALUES ('a', 0, 0)")
+        conn.commit()
+        conn.close()
+        self.assertEqual(self.take('a', 1, 60, 1000), 0)
+        self.assertEqual(self.query("PRAGMA user_version", path=self.admission_store.path), [(Admission.STORE_VERSION,)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for the transactional batch action of Api/Accounting.py."""
+import json
+import sqlite3
+import unittest
+from unittest import mock
+
+from support import Accounting, AccountingTestCase
+
+class BatchTests(AccountingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.token = self.login()
+
+    def batch(self, *operations):
+        return self.post('batch', token=self.token, operations=json.dumps(operations))
+
+    def stored(self):
+        return self.query("SELECT category, key, value FROM user_data ORDER BY category, key")
+
+    def test_operations_apply_in_order(self):
+        response = self.batch(
+            {'op': 'set', 'category': 'ENV', 'key': 'A', 'value': '1'},
+            {'op': 'set', 'category': 'ENV', 'key': 'B', 'value': '2'},
+            {'op': 'delete', 'category': 'ENV', 'key': 'A'},
+            {'op': 'get', 'category': 'ENV'},
+        )
+        self.assertEqual(response, {'status': 'success', 'results': [
+            {'status': 'success'}, {'status': 'success'}, {'status': 'success'},
+            {'status': 'success', 'data': {'B': '2'}},
+        ]})
+        self.assertEqual(self.stored(), [('ENV', 'B', '2')])
+
+    def test_invalid_operation_rejects_the_whole_batch(self):
+        response = self.batch(
+            {'op': 'set', 'category': 'ENV', 'key': 'A', 'value': '1'},
+            {'op': 'set', 'category': 'ENV', 'key': 'B'},
+        )
+        self.assertEqual(response, {'status': 'error', 'message': 'Operation 1: key and value are required.'})
+        self.assertEqual(self.stored(), [])
+
+    def test_failure_part_way_rolls_back_earlier_writes(self):
+        real_store = Accounting.store_user_data
+        def store_then_fail(cursor, username, category, key, value):
+            if key == 'B':
+                raise sqlite3.OperationalError('disk I/O error')
+            real_store(cursor, username, category, key, value)
+
+        with mock.patch.object(Accounting, 'store_user_data', store_then_fail):
+            with self.assertRaises(sqlite3.OperationalError):
+                self.batch(
+                    {'op': 'set', 'category': 'ENV', 'key': 'A', 'value': '1'},
+                    {'op': 'set', 'category': 'ENV', 'key': 'B', 'value': '2'},
+                )
+        self.assertEqual(self.stored(), [])
+        # The rolled-back connection is usable by the next request.
+        self.assertEqual(self.batch({'op': 'set', 'category': 'ENV', 'key': 'C', 'value': '3'})['status'], 'success')
+        self.assertEqual(self.stored(), [('ENV', 'C', '3')])
+
+    def test_batch_size_is_limited(self):
+        operations = [{'op': 'get', 'category': 'ENV'}] * (Accounting.BATCH_MAX_OPERATIONS + 1)
+        self.assertEqual(self.batch(*operations)['status'], 'error')
+
+    def test_operations_must_be_a_json_list(self):
+        response = self.post('batch', token=self.token, operations='{"op": "get"}')
+        self.assertEqual(response, {'status': 'error', 'message': 'operations must be a JSON list.'})
+
+    def test_batch_needs_a_session(self):
+        response = self.post('batch', token='nope', operations='[]')
+        self.assertEqual(response['status'], 'error')
+
+if __name__ == '__main__':
+    unittest.main()
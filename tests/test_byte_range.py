@@ -0,0 +1,116 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for the byte ranges of cat: offset/length and HTTP Range, in Api/Filesystem.py."""
+import json
+import unittest
+
+from support import FilesystemTestCase
+from Filesystem import RangeNotSatisfiableError, resolve_byte_range
+
+SIZE = 100
+
+class OffsetLengthTests(unittest.TestCase):
+
+    def test_whole_file(self):
+        self.assertEqual(resolve_byte_range(SIZE), (0, SIZE, False))
+
+    def test_offset_and_length(self):
+        self.assertEqual(resolve_byte_range(SIZE, 10, 20), (10, 20, True))
+        self.assertEqual(resolve_byte_range(SIZE, 10), (10, 90, True))
+        self.assertEqual(resolve_byte_range(SIZE, None, 5), (0, 5, True))
+
+    def test_negative_offset_counts_from_the_end(self):
+        self.assertEqual(resolve_byte_range(SIZE, -10), (90, 10, True))
+        self.assertEqual(resolve_byte_range(SIZE, -10, 3), (90, 3, True))
+        self.assertEqual(resolve_byte_range(SIZE, -1000), (0, SIZE, True))
+
+    def test_clamped_to_the_file(self):
+        self.assertEqual(resolve_byte_range(SIZE, 90, 50), (90, 10, True))
+        self.assertEqual(resolve_byte_range(SIZE, 500, 10), (SIZE, 0, True))
+        self.assertEqual(resolve_byte_range(SIZE, 10, -5), (10, 0, True))
+
+    def test_empty_file(self):
+        self.assertEqual(resolve_byte_range(0), (0, 0, False))
+        self.assertEqual(resolve_byte_range(0, -10, 10), (0, 0, True))
+
+class RangeHeaderTests(unittest.TestCase):
+
+    def test_closed_range(self):
+        self.assertEqual(resolve_byte_range(SIZE, range_header='bytes=0-9'), (0, 10, True))
+        self.assertEqual(resolve_byte_range(SIZE, range_header=' bytes=10-10 '), (10, 1, True))
+
+    def test_open_ended_range(self):
+        self.assertEqual(resolve_byte_range(SIZE, range_header='bytes=95-'), (95, 5, True))
+
+    def test_end_past_the_file_is_clamped(self):
+        self.assertEqual(resolve_byte_range(SIZE, range_header='bytes=90-1000'), (90, 10, True))
+
+    def test_suffix_range(self):
+        self.assertEqual(resolve_byte_range(SIZE, range_header='bytes=-5'), (95, 5, True))
+        self.assertEqual(resolve_byte_range(SIZE, range_header='bytes=-500'), (0, SIZE, True))
+
+    def test_unsatisfiable(self):
+        for header in ('bytes=100-', 'bytes=200-300', 'bytes=50-40'):
+            with self.subTest(header=header):
+                with self.assertRaises(RangeNotSatisfiableError) as cm:
+                    resolve_byte_range(SIZE, range_header=header)
+                self.assertEqual(cm.exception.size, SIZE)
+
+    def test_unsupported_ranges_get_the_whole_file(self):
+        for header in ('bytes=0-1,5-6', 'items=0-9', 'bytes=-', 'bytes=a-b'):
+            with self.subTest(header=header):
+                self.assertEqual(resolve_byte_range(SIZE, range_header=header), (0, SIZE, False))
+
+    def test_range_header_takes_precedence(self):
+        self.assertEqual(resolve_byte_range(SIZE, 50, 10, 'bytes=0-4'), (0, 5, True))
+        # An unusable header falls back to offset and length.
+        self.assertEqual(resolve_byte_range(SIZE, 50, 10, 'bytes=0-1,5-6'), (50, 10, True))
+
+class CatTests(FilesystemTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.content = bytes(range(256)) * 4
+        self.write_file('/data.bin', self.content)
+
+    def test_raw_range_request(self):
+        status, headers, body = self.call('cat', path='/data.bin', raw='true', headers={'HTTP_RANGE': 'bytes=10-19'})
+        self.assertEqual(status, '206 Partial Content')
+        self.assertEqual(headers['Content-Range'], f'bytes 10-19/{len(self.content)}')
+        self.assertEqual(body, self.content[10:20])
+
+    def test_raw_whole_file(self):
+        status, headers, body = self.call('cat', path='/data.bin', raw='true')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(body, self.content)
+
+    def test_raw_unsatisfiable_range(self):
+        status, headers, body = self.call('cat', path='/data.bin', raw='true', headers={'HTTP_RANGE': 'bytes=5000-'})
+        self.assertEqual(status, '416 Range Not Satisfiable')
+        self.assertEqual(headers['Content-Range'], f'bytes */{len(self.content)}')
+
+    def test_tail_of_a_text_file(self):
+        self.write_file('/log.txt', 'first line\nlast line\n')
+        response = self.get('cat', path='/log.txt', offset='-10')
+        self.assertEqual(response, {'content': 'last line\n', 'offset': 11, 'length': 10, 'size': 21})
+
+    def test_slice_through_a_multibyte_character_is_replaced(self):
+        self.write_file('/utf8.txt', 'aé')
+        self.assertEqual(self.get('cat', path='/utf8.txt', offset='0', length='2')['content'], 'a\ufffd')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for the path completion action of Api/Filesystem.py."""
+import os
+import unittest
+
+from support import Filesystem, FilesystemTestCase
+
+class CompleteTests(FilesystemTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for name in ('Documents/x', 'downloads/x', 'docs.txt', 'Desktop.lnk', 'bin/ls'):
+            self.write_file('/home/' + name)
+
+    def complete(self, path, **params):
+        return self.get('complete', path=path, **params)
+
+    def test_exact_case_matches_come_first(self):
+        self.assertEqual(self.complete('/home/do'), {
+            'prefix': '/home/', 'candidates': ['docs.txt', 'downloads/', 'Documents/'], 'truncated': False,
+        })
+
+    def test_relative_to_pwd(self):
+        self.assertEqual(self.complete('b', pwd='/home')['candidates'], ['bin/'])
+        self.assertEqual(self.complete('bin/', pwd='/home'), {'prefix': 'bin/', 'candidates': ['ls'], 'truncated': False})
+
+    def test_dirs_only(self):
+        self.assertEqual(self.complete('/home/d', dirs_only='true')['candidates'], ['downloads/', 'Documents/'])
+
+    def test_limit(self):
+        response = self.complete('/home/', limit='2')
+        self.assertEqual(len(response['candidates']), 2)
+        self.assertTrue(response['truncated'])
+
+    def test_missing_directory_has_no_candidates(self):
+        self.assertEqual(self.complete('/nope/x')['candidates'], [])
+
+    def test_traversal_is_refused(self):
+        self.assertIn('error', self.complete('../../etc/pa'))
+
+    def test_new_entry_is_picked_up(self):
+        self.complete('/home/')
+        self.write_file('/home/dotfiles/x')
+        self.assertIn('dotfiles/', self.complete('/home/do')['candidates'])
+
+    def test_warm_index_covers_every_directory(self):
+        Filesystem.warm_path_index()
+        self.assertIn(os.path.join(self.fs_root, 'home', 'bin'), Filesystem._path_index)
+
+if __name__ == '__main__':
+    unittest.main()
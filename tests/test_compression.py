@@ -0,0 +1,110 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for response compression in Api/Compression.py and Api/Filesystem.py."""
+import gzip
+import json
+import os
+import unittest
+from unittest import mock
+
+from support import Filesystem, FilesystemTestCase
+from Compression import negotiate_encoding
+
+GZIP = {'HTTP_ACCEPT_ENCODING': 'gzip'}
+
+class NegotiationTests(unittest.TestCase):
+
+    def test_picks_an_accepted_encoding(self):
+        self.assertEqual(negotiate_encoding('gzip, deflate'), 'gzip')
+        self.assertEqual(negotiate_encoding('deflate, *'), negotiate_encoding('*'))
+
+    def test_refusals(self):
+        self.assertIsNone(negotiate_encoding(None))
+        self.assertIsNone(negotiate_encoding('identity'))
+        self.assertIsNone(negotiate_encoding('gzip;q=0'))
+        self.assertIsNone(negotiate_encoding('*;q=0'))
+
+class FileCompressionTests(FilesystemTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.text = 'All work and no play makes Jack a dull boy.\n' * 200
+        self.path = self.write_file('/docs/jack.txt', self.text)
+
+    def compressed_files(self):
+        return sorted(name for _, _, names in os.walk(os.path.join(self.cache_dir, 'compressed')) for name in names)
+
+    def test_raw_file_is_served_from_a_compressed_copy(self):
+        status, headers, body = self.call('cat', path='/docs/jack.txt', raw='true', headers=GZIP)
+        self.assertEqual(status, '200 OK')
+        self.assertEqual((headers['Content-Encoding'], headers['Vary']), ('gzip', 'Accept-Encoding'))
+        self.assertTrue(headers['ETag'].endswith('-gzip"'))
+        self.assertEqual(gzip.decompress(body).decode('utf-8'), self.text)
+        self.assertEqual(len(self.compressed_files()), 1)
+
+        with mock.patch.object(Filesystem, 'compress_stream', side_effect=AssertionError('compressed again')):
+            _, _, cached_body = self.call('cat', path='/docs/jack.txt', raw='true', headers=GZIP)
+        self.assertEqual(cached_body, body)
+
+    def test_compressed_etag_revalidates(self):
+        _, headers, _ = self.call('cat', path='/docs/jack.txt', raw='true', headers=GZIP)
+        status, headers_304, _ = self.call('cat', path='/docs/jack.txt', raw='true',
+                                           headers=dict(GZIP, HTTP_IF_NONE_MATCH=headers['ETag']))
+        self.assertEqual(status, '304 Not Modified')
+        self.assertEqual(headers_304['ETag'], headers['ETag'])
+
+    def test_new_version_replaces_the_old_copy(self):
+        self.call('cat', path='/docs/jack.txt', raw='true', headers=GZIP)
+        self.write_file('/docs/jack.txt', self.text * 2)
+        _, _, body = self.call('cat', path='/docs/jack.txt', raw='true', headers=GZIP)
+        self.assertEqual(gzip.decompress(body).decode('utf-8'), self.text * 2)
+        self.assertEqual(len(self.compressed_files()), 1)
+
+    def test_failed_compression_leaves_no_temporary_file(self):
+        def compress_stream(chunks, encoding):
+            yield b'partial'
+            raise OSError('disk full')
+
+        with mock.patch.object(Filesystem, 'compress_stream', compress_stream):
+            with self.assertRaises(OSError):
+                Filesystem.get_compressed_file(self.path, 'gzip')
+        self.assertEqual(self.compressed_files(), [])
+
+    def test_small_files_and_ranges_are_not_compressed(self):
+        self.write_file('/docs/short.txt', 'short')
+        _, headers, body = self.call('cat', path='/docs/short.txt', raw='true', headers=GZIP)
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(body, b'short')
+        status, headers, body = self.call('cat', path='/docs/jack.txt', raw='true',
+                                          headers=dict(GZIP, HTTP_RANGE='bytes=0-9'))
+        self.assertEqual(status, '206 Partial Content')
+        self.assertNotIn('Content-Encoding', headers)
+        self.assertEqual(body, self.text[:10].encode('utf-8'))
+
+    def test_json_cat_is_compressed_on_the_fly(self):
+        _, headers, body = self.call('cat', path='/docs/jack.txt', headers=GZIP)
+        self.assertEqual(headers['Content-Encoding'], 'gzip')
+        self.assertNotIn('Content-Length', headers)
+        self.assertEqual(json.loads(gzip.decompress(body))['content'], self.text)
+
+    def test_precompress_sweeps_the_cache(self):
+        with mock.patch.object(Filesystem, 'sweep_cache') as sweep_cache:
+            count = Filesystem.precompress_directory(os.path.join(self.fs_root, 'docs'))
+        self.assertEqual(count, len(Filesystem.available_encodings()))
+        sweep_cache.assert_called_once_with('compressed', Filesystem.COMPRESSED_CACHE_MAX_BYTES)
+
+if __name__ == '__main__':
+    unittest.main()
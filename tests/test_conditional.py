@@ -0,0 +1,64 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for the conditional requests of cat in Api/Filesystem.py."""
+import os
+import json
+import unittest
+
+from support import FilesystemTestCase
+
+MTIME = 1735689600  # Wed, 01 Jan 2025 00:00:00 GMT
+
+class ConditionalCatTests(FilesystemTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.path = self.write_file('/notes.txt', 'hello')
+        os.utime(self.path, (MTIME, MTIME))
+
+    def cat(self, **headers):
+        return self.call('cat', path='/notes.txt', headers=headers)
+
+    def test_validators_are_sent(self):
+        status, headers, body = self.cat()
+        self.assertEqual((status, json.loads(body)), ('200 OK', {'content': 'hello'}))
+        self.assertEqual(headers['Last-Modified'], 'Wed, 01 Jan 2025 00:00:00 GMT')
+        self.assertRegex(headers['ETag'], r'^"[0-9a-f]+-5"$')
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.cat()[1]['ETag']
+        status, headers, body = self.cat(HTTP_IF_NONE_MATCH=f'"other", {etag}')
+        self.assertEqual((status, body), ('304 Not Modified', b''))
+        self.assertEqual(headers['ETag'], etag)
+
+    def test_changed_file_is_sent_again(self):
+        etag = self.cat()[1]['ETag']
+        self.write_file('/notes.txt', 'hello, world')
+        status, headers, body = self.cat(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((status, json.loads(body)), ('200 OK', {'content': 'hello, world'}))
+        self.assertNotEqual(headers['ETag'], etag)
+
+    def test_if_modified_since(self):
+        self.assertEqual(self.cat(HTTP_IF_MODIFIED_SINCE='Wed, 01 Jan 2025 00:00:00 GMT')[0], '304 Not Modified')
+        self.assertEqual(self.cat(HTTP_IF_MODIFIED_SINCE='Tue, 31 Dec 2024 23:59:59 GMT')[0], '200 OK')
+        self.assertEqual(self.cat(HTTP_IF_MODIFIED_SINCE='yesterday')[0], '200 OK')
+
+    def test_if_none_match_wins_over_if_modified_since(self):
+        status, _, _ = self.cat(HTTP_IF_NONE_MATCH='"other"', HTTP_IF_MODIFIED_SINCE='Wed, 01 Jan 2025 00:00:00 GMT')
+        self.assertEqual(status, '200 OK')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for the ETag revalidation of get_data in Api/Accounting.py."""
+import json
+import unittest
+
+from support import Accounting, AccountingTestCase, call_wsgi
+
+class DataEtagTests(AccountingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.token = self.login()
+        self.post('set_data', token=self.token, category='ENV', key='home', value='/home/alice')
+
+    def get(self, headers=None, **fields):
+        """Sends get_data as a GET with the token in its header. Returns (status, headers, body bytes)."""
+        headers = dict(headers or {})
+        headers.setdefault('HTTP_X_TOKEN', self.token)
+        return call_wsgi(Accounting.application, dict(fields, action='get_data', category='ENV'), headers=headers)
+
+    def test_get_reads_the_token_from_its_header(self):
+        status, headers, body = self.get()
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(json.loads(body), {'status': 'success', 'data': {'home': '/home/alice'}})
+        self.assertEqual(headers['Cache-Control'], 'private, no-cache')
+        self.assertEqual(headers['Vary'], 'X-Token')
+
+    def test_token_in_the_query_string_is_ignored(self):
+        _, _, body = self.get(headers={'HTTP_X_TOKEN': ''}, token=self.token)
+        self.assertEqual(json.loads(body), {'status': 'error', 'message': 'Invalid or expired session.'})
+
+    def test_matching_etag_gets_a_304(self):
+        _, headers, _ = self.get()
+        status, headers_304, body = self.get(headers={'HTTP_IF_NONE_MATCH': headers['ETag']})
+        self.assertEqual((status, body), ('304 Not Modified', b''))
+        self.assertEqual(headers_304['ETag'], headers['ETag'])
+
+    def test_write_changes_the_etag(self):
+        _, headers, _ = self.get()
+        self.post('set_data', token=self.token, category='ENV', key='home', value='/srv')
+        status, new_headers, body = self.get(headers={'HTTP_IF_NONE_MATCH': headers['ETag']})
+        self.assertEqual(status, '200 OK')
+        self.assertNotEqual(new_headers['ETag'], headers['ETag'])
+        self.assertEqual(json.loads(body)['data'], {'home': '/srv'})
+
+    def test_other_categories_keep_their_etag(self):
+        _, headers, _ = self.get()
+        self.post('set_data', token=self.token, category='ALIAS', key='ll', value='ls -l')
+        status, _, _ = self.get(headers={'HTTP_IF_NONE_MATCH': headers['ETag']})
+        self.assertEqual(status, '304 Not Modified')
+
+    def test_etag_depends_on_the_page(self):
+        _, headers, _ = self.get()
+        _, page_headers, _ = self.get(limit='1')
+        self.assertNotEqual(page_headers['ETag'], headers['ETag'])
+
+    def test_post_with_a_matching_etag_is_refused(self):
+        _, headers, _ = self.get()
+        status, _, body = self.call('get_data', {'token': self.token, 'category': 'ENV'},
+                                    headers={'HTTP_IF_NONE_MATCH': headers['ETag']})
+        self.assertEqual(status, '412 Precondition Failed')
+        self.assertEqual(body, {'status': 'error', 'message': 'Precondition failed.'})
+
+    def test_304_echoes_the_tag_of_the_compressed_variant(self):
+        _, headers, _ = self.get()
+        gzip_etag = headers['ETag'][:-1] + '-gzip"'
+        status, headers_304, _ = self.get(headers={'HTTP_IF_NONE_MATCH': gzip_etag, 'HTTP_ACCEPT_ENCODING': 'gzip'})
+        self.assertEqual(status, '304 Not Modified')
+        self.assertEqual(headers_304['ETag'], gzip_etag)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for the append-only shell history of Api/Accounting.py."""
+import unittest
+from unittest import mock
+
+from support import Accounting, AccountingTestCase
+
+class HistoryTests(AccountingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.token = self.login()
+        self.patch(Accounting, 'HISTORY_DEFAULT_SIZE', 5)
+        self.patch(Accounting, 'HISTORY_MIN_SIZE', 3)
+
+    def append(self, *commands, **fields):
+        for command in commands:
+            response = self.post('history_append', token=self.token, command=command, **fields)
+            self.assertEqual(response['status'], 'success', response)
+        return response
+
+    def commands(self, response):
+        return [entry['command'] for entry in response['entries']]
+
+    def tail(self, **fields):
+        return self.commands(self.post('history_tail', token=self.token, **fields))
+
+    def test_tail_is_oldest_first(self):
+        self.append('ls', 'cd /', 'pwd')
+        self.assertEqual(self.tail(), ['ls', 'cd /', 'pwd'])
+        self.assertEqual(self.tail(limit='2'), ['cd /', 'pwd'])
+
+    def test_repeated_command_is_stored_once(self):
+        self.assertEqual(self.append('ls')['seq'], 1)
+        self.assertEqual(self.append('ls')['seq'], 1)
+        self.assertEqual(self.tail(), ['ls'])
+
+    def test_history_is_trimmed_to_the_server_size(self):
+        self.append(*[f'echo {i}' for i in range(8)])
+        self.assertEqual(self.tail(), [f'echo {i}' for i in range(3, 8)])
+        # A client cannot keep more than the server allows.
+        self.append('echo 8', histsize='1000')
+        self.assertEqual(len(self.tail()), 5)
+
+    def test_client_histsize_cannot_go_below_the_minimum(self):
+        self.append(*[f'echo {i}' for i in range(5)])
+        self.append('echo 5', histsize='1')
+        self.assertEqual(self.tail(), ['echo 3', 'echo 4', 'echo 5'])
+
+    def test_histories_are_per_user(self):
+        self.append('ls')
+        other = self.login('bob')
+        self.post('history_append', token=other, command='whoami')
+        self.assertEqual(self.tail(), ['ls'])
+
+    def test_range_pages_forward(self):
+        self.append('a', 'b', 'c', 'd')
+        response = self.post('history_range', token=self.token, start='2', limit='2')
+        self.assertEqual((self.commands(response), response['next_start']), (['b', 'c'], 4))
+        response = self.post('history_range', token=self.token, start='4')
+        self.assertEqual((self.commands(response), response['next_start']), (['d'], None))
+        response = self.post('history_range', token=self.token, start='1', end='2')
+        self.assertEqual(self.commands(response), ['a', 'b'])
+
+    def test_search_is_newest_first_and_continues_before_a_match(self):
+        self.append('git status', 'ls', 'git log', 'git diff')
+        response = self.post('history_search', token=self.token, query='git', limit='2')
+        self.assertEqual([(e['seq'], e['command']) for e in response['entries']], [(4, 'git diff'), (3, 'git log')])
+        response = self.post('history_search', token=self.token, query='git', before='3')
+        self.assertEqual(self.commands(response), ['git status'])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.post('history_append', token=self.token, command='ls', histsize='x'),
+                         {'status': 'error', 'message': 'histsize must be an integer.'})
+        self.assertEqual(self.post('history_tail', token=self.token, limit='0'),
+                         {'status': 'error', 'message': 'limit must be at least 1.'})
+        self.assertEqual(self.post('history_append', token=self.token),
+                         {'status': 'error', 'message': 'command is required.'})
+
+class HistorySizeConfigTests(unittest.TestCase):
+
+    def sizes(self, config):
+        with mock.patch.object(Accounting, 'get_config_value', config.get):
+            return Accounting.get_history_sizes_from_config()
+
+    def test_defaults(self):
+        self.assertEqual(self.sizes({}), (1000, 100))
+
+    def test_settings_are_kept_in_bounds(self):
+        self.assertEqual(self.sizes({'history-size': '50'}), (50, 50))
+        self.assertEqual(self.sizes({'history-size': '20000', 'history-min-size': '0'}), (Accounting.HISTORY_MAX_SIZE, 1))
+        self.assertEqual(self.sizes({'history-size': 'lots', 'history-min-size': '5000'}), (1000, 1000))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for the cached directory listings of ls in Api/Filesystem.py."""
+import os
+import unittest
+from unittest import mock
+
+from support import Filesystem, FilesystemTestCase
+
+class ListingTests(FilesystemTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write_file('/docs/b.txt', 'bb')
+        self.write_file('/docs/a.txt', 'a')
+        self.write_file('/docs/.hidden', 'x')
+        self.write_file('/docs/script.py', 'x')
+        os.makedirs(os.path.join(self.fs_root, 'docs', 'sub'))
+        self.docs = os.path.join(self.fs_root, 'docs')
+
+    def rewrite_in_place(self, vfs_path, content):
+        """Rewrites a file without changing the mtime of its directory, as an in-place edit does."""
+        st = os.stat(self.docs)
+        self.write_file(vfs_path, content)
+        os.utime(self.docs, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    def test_listing_is_sorted_and_hides_dotfiles_and_scripts(self):
+        self.assertEqual(self.get('ls', path='/docs'), {
+            'directories': [{'name': 'sub'}],
+            'files': [{'name': 'a.txt', 'size': 1}, {'name': 'b.txt', 'size': 2}],
+        })
+
+    def test_new_file_shows_up(self):
+        self.get('ls', path='/docs')
+        self.write_file('/docs/c.txt', 'ccc')
+        self.assertIn({'name': 'c.txt', 'size': 3}, self.get('ls', path='/docs')['files'])
+
+    def test_rewritten_file_shows_up_once_the_listing_is_rechecked(self):
+        self.get('ls', path='/docs')
+        self.rewrite_in_place('/docs/a.txt', 'a much longer text')
+        self.patch(Filesystem, 'LISTING_RECHECK_INTERVAL', 0)
+        self.assertIn({'name': 'a.txt', 'size': 18}, self.get('ls', path='/docs')['files'])
+
+    def test_etag_follows_the_listing_not_the_directory(self):
+        _, headers, _ = self.call('ls', path='/docs')
+        etag = headers['ETag']
+        status, _, body = self.call('ls', path='/docs', headers={'HTTP_IF_NONE_MATCH': etag})
+        self.assertEqual((status, body), ('304 Not Modified', b''))
+
+        self.rewrite_in_place('/docs/a.txt', 'a much longer text')
+        self.patch(Filesystem, 'LISTING_RECHECK_INTERVAL', 0)
+        status, headers, _ = self.call('ls', path='/docs', headers={'HTTP_IF_NONE_MATCH': etag})
+        self.assertEqual(status, '200 OK')
+        self.assertNotEqual(headers['ETag'], etag)
+
+    def test_same_content_keeps_its_etag(self):
+        _, headers, _ = self.call('ls', path='/docs')
+        self.rewrite_in_place('/docs/a.txt', 'z')
+        self.patch(Filesystem, 'LISTING_RECHECK_INTERVAL', 0)
+        status, _, _ = self.call('ls', path='/docs', headers={'HTTP_IF_NONE_MATCH': headers['ETag']})
+        self.assertEqual(status, '304 Not Modified')
+
+    def test_new_process_reads_the_listing_from_disk(self):
+        expected = self.get('ls', path='/docs')
+        self.patch(Filesystem, '_listing_cache', Filesystem.OrderedDict())
+        with mock.patch.object(Filesystem, 'scan_directory', side_effect=AssertionError('rescanned')):
+            self.assertEqual(self.get('ls', path='/docs'), expected)
+
+    def test_stale_disk_entry_is_rescanned(self):
+        self.get('ls', path='/docs')
+        self.write_file('/docs/c.txt', 'ccc')
+        self.patch(Filesystem, '_listing_cache', Filesystem.OrderedDict())
+        self.assertEqual(len(self.get('ls', path='/docs')['files']), 3)
+
+    def test_single_file(self):
+        self.assertEqual(self.get('ls', path='/docs/b.txt'), {'directories': [], 'files': [{'name': 'b.txt', 'size': 2}]})
+
+    def test_missing_path(self):
+        self.assertEqual(self.get('ls', path='/nope'), {'error': 'No such file or directory'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for the metrics file that CGI processes of the API scripts share."""
+import fcntl
+import os
+import unittest
+
+from support import TempDirTestCase
+
+import Metrics
+
+LABELS = {'script': 'Accounting.py', 'action': 'login'}
+
+class MetricsFileTests(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.tmp_dir, 'cache', 'metrics.json')
+        self.patch(Metrics, '_settings', dict(Metrics._settings, metrics_file=self.path))
+        self.patch(Metrics, '_counters', {})
+        self.patch(Metrics, '_histograms', {})
+
+    def record(self, seconds):
+        """Records one request as a CGI process would, and appends it to the file."""
+        Metrics.inc('nnoitra_requests_total', LABELS)
+        Metrics.observe('nnoitra_request_duration_seconds', LABELS, seconds)
+        Metrics.append_to_file(self.path)
+
+    def lines(self):
+        with open(self.path, encoding='utf-8') as f:
+            return f.read().splitlines()
+
+    def totals(self):
+        data = Metrics.load_metrics()
+        (_, requests), = data['counters']['nnoitra_requests_total']
+        (_, histogram), = data['histograms']['nnoitra_request_duration_seconds']
+        return requests, histogram[-2], histogram[-1]
+
+    def test_each_process_appends_a_line_and_readers_add_them_up(self):
+        self.record(0.5)
+        self.record(0.25)
+        self.assertEqual(len(self.lines()), 2)
+        self.assertEqual(self.totals(), (2, 2, 0.75))
+        # The numbers were handed over, so they are not counted again.
+        self.assertEqual(Metrics.snapshot(), {'counters': {}, 'histograms': {}})
+
+    def test_nothing_recorded_writes_nothing(self):
+        Metrics.append_to_file(self.path)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_writers_do_not_wait_for_each_other(self):
+        self.record(0.5)
+        with open(self.path, 'a', encoding='utf-8') as other:
+            fcntl.flock(other, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            self.record(0.5)
+            # Compaction is skipped while another process has the file open.
+            self.assertFalse(Metrics.compact_metrics_file(self.path))
+        self.assertEqual(self.totals(), (2, 2, 1.0))
+
+    def test_large_file_is_compacted(self):
+        self.record(0.5)
+        self.record(0.5)
+        self.patch(Metrics, 'METRICS_COMPACT_BYTES', 0)
+        self.record(0.5)
+        self.assertEqual(len(self.lines()), 1)
+        self.assertEqual(self.totals(), (3, 3, 1.5))
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ['metrics.json'])
+
+    def test_damaged_lines_are_skipped(self):
+        self.record(0.5)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write('{"counters": {"nnoitra_requests_tot\n[1, 2]\n')
+        self.record(0.5)
+        self.assertEqual(self.totals(), (2, 2, 1.0))
+
+if __name__ == '__main__':
+    unittest.main()
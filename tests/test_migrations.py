@@ -0,0 +1,141 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for the schema migrations and the session sweep of Api/Accounting.py."""
+import os
+import shutil
+import sqlite3
+import unittest
+from unittest import mock
+
+from support import Accounting, AccountingTestCase
+
+def create_baseline_db(path, history=()):
+    """Creates a database as the first schema version left it, with history kept in user_data."""
+    conn = sqlite3.connect(path)
+    for statement in Accounting.SCHEMA_MIGRATIONS[0]:
+        conn.execute(statement)
+    conn.executemany("INSERT INTO user_data (username, category, key, value) VALUES (?, ?, ?, ?)",
+                     [(username, Accounting.HISTORY_CATEGORY, key, command) for username, key, command in history])
+    conn.execute("INSERT INTO user_data (username, category, key, value) VALUES ('alice', 'ENV', 'PS1', '$ ')")
+    conn.execute("PRAGMA user_version = 1")
+    conn.commit()
+    conn.close()
+
+class MigrationTests(AccountingTestCase):
+
+    def indexes(self):
+        return {name for name, in self.query("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+    def test_new_database(self):
+        Accounting.init_db()
+        self.assertEqual(self.query("PRAGMA user_version"), [(len(Accounting.SCHEMA_MIGRATIONS),)])
+        self.assertEqual(self.query("PRAGMA journal_mode"), [('wal',)])
+        tables = {name for name, in self.query("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.assertTrue({'users', 'sessions', 'user_data', 'user_data_versions'} <= tables)
+        self.assertTrue({'sessions_expires_at', 'sessions_username'} <= self.indexes())
+
+    def test_upgrade_adds_the_session_indexes(self):
+        create_baseline_db(self.db_file)
+        Accounting.init_db()
+        self.assertEqual(self.query("PRAGMA user_version"), [(len(Accounting.SCHEMA_MIGRATIONS),)])
+        self.assertTrue({'sessions_expires_at', 'sessions_username'} <= self.indexes())
+        self.assertEqual(self.query("SELECT username, category, key, value FROM user_data"), [('alice', 'ENV', 'PS1', '$ ')])
+
+    def test_upgrade_moves_history_out_of_user_data(self):
+        create_baseline_db(self.db_file, [
+            ('alice', '2025-01-02T00:00:00', 'ls'),
+            ('alice', '2025-01-01T00:00:00', 'cd /'),
+            ('bob', '2025-01-01T00:00:00', 'whoami'),
+        ])
+        Accounting.init_db()
+        # Entries are numbered per user in the order of their old timestamp keys.
+        self.assertEqual(self.query("SELECT username, seq, command, created_at FROM history ORDER BY username, seq"), [
+            ('alice', 1, 'cd /', 1735689600),
+            ('alice', 2, 'ls', 1735776000),
+            ('bob', 1, 'whoami', 1735689600),
+        ])
+        self.assertEqual(self.query("SELECT username, category, key, value FROM user_data"), [('alice', 'ENV', 'PS1', '$ ')])
+
+    def test_migrating_twice_changes_nothing(self):
+        create_baseline_db(self.db_file, [('alice', '2025-01-01T00:00:00', 'ls')])
+        Accounting.init_db()
+        self.close_connections()
+        Accounting.init_db()
+        self.assertEqual(self.query("PRAGMA user_version"), [(len(Accounting.SCHEMA_MIGRATIONS),)])
+        self.assertEqual(self.query("SELECT COUNT(*) FROM user_data"), [(1,)])
+        self.assertEqual(self.query("SELECT username, seq, command FROM history"), [('alice', 1, 'ls')])
+
+    def test_old_file_restored_in_place_is_migrated(self):
+        # `cp backup.db users.db` keeps the inode, so nothing but the file itself
+        # can tell a new process that its schema is old again.
+        backup_file = os.path.join(self.tmp_dir, 'backup.db')
+        create_baseline_db(backup_file, [('alice', '2025-01-01T00:00:00', 'ls')])
+        shutil.copyfile(backup_file, self.db_file)
+        Accounting.ensure_db()
+        self.close_connections()
+
+        with open(backup_file, 'rb') as src, open(self.db_file, 'r+b') as dest:
+            dest.truncate()
+            dest.write(src.read())
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(self.db_file + suffix):
+                os.remove(self.db_file + suffix)
+
+        Accounting.ensure_db()
+        self.assertEqual(self.query("PRAGMA user_version"), [(len(Accounting.SCHEMA_MIGRATIONS),)])
+        self.assertEqual(self.query("SELECT username, seq, command FROM history"), [('alice', 1, 'ls')])
+
+    def test_old_sqlite_is_refused_before_migrating(self):
+        create_baseline_db(self.db_file, [('alice', '2025-01-01T00:00:00', 'ls')])
+        with mock.patch.object(Accounting.sqlite3, 'sqlite_version_info', (3, 24, 0)):
+            with self.assertRaisesRegex(RuntimeError, 'needs SQLite 3.25.0 or newer'):
+                Accounting.init_db()
+        self.assertEqual(self.query("PRAGMA user_version"), [(1,)])
+        # An up-to-date database needs no particular version.
+        self.close_connections()
+        Accounting.init_db()
+        with mock.patch.object(Accounting.sqlite3, 'sqlite_version_info', (3, 24, 0)):
+            Accounting.init_db()
+
+    def test_failed_migration_is_rolled_back(self):
+        Accounting.init_db()
+        conn = Accounting.get_db()
+        migrations = Accounting.SCHEMA_MIGRATIONS + [["CREATE TABLE extra (id INTEGER)", "NOT SQL"]]
+        with self.assertRaises(sqlite3.Error):
+            Accounting.migrate_db(conn, migrations)
+        self.assertEqual(self.query("PRAGMA user_version"), [(len(Accounting.SCHEMA_MIGRATIONS),)])
+        self.assertEqual(self.query("SELECT name FROM sqlite_master WHERE name = 'extra'"), [])
+
+class SessionSweepTests(AccountingTestCase):
+
+    def test_sweep_removes_only_expired_sessions(self):
+        live = self.login()
+        expired = [self.login() for _ in range(5)]
+        self.query(f"UPDATE sessions SET expires_at = ? WHERE token IN ({', '.join('?' * len(expired))})",
+                   (Accounting.current_timestamp() - 1, *expired))
+        # Small batches must still get through all of them.
+        self.assertEqual(Accounting.sweep_expired_sessions(batch_size=2), 5)
+        self.assertEqual(self.query("SELECT token FROM sessions"), [(live,)])
+        self.assertEqual(Accounting.sweep_expired_sessions(), 0)
+
+    def test_login_does_not_sweep(self):
+        token = self.login()
+        self.query("UPDATE sessions SET expires_at = ? WHERE token = ?", (Accounting.current_timestamp() - 1, token))
+        self.login()
+        self.assertEqual(self.query("SELECT COUNT(*) FROM sessions"), [(2,)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for the keyset-paginated reads of get_data in Api/Accounting.py."""
+import sys
+import json
+import unittest
+
+from support import AccountingTestCase
+from Common import prefix_upper_bound
+
+KEYS = ['alias_ll', 'alias_ls', 'editor', 'home', 'path', 'path_extra', 'shell']
+
+class PagingTests(AccountingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.token = self.login()
+        operations = [{'op': 'set', 'category': 'ENV', 'key': key, 'value': key.upper()} for key in KEYS]
+        self.post('batch', token=self.token, operations=json.dumps(operations))
+
+    def get_data(self, **fields):
+        return self.post('get_data', token=self.token, category='ENV', **fields)
+
+    def read_all_pages(self, limit, sort_order='ASC'):
+        cursor_field = 'after_key' if sort_order == 'ASC' else 'before_key'
+        keys = []
+        cursor = None
+        while True:
+            fields = {'limit': limit, 'sort_order': sort_order}
+            if cursor is not None:
+                fields[cursor_field] = cursor
+            response = self.get_data(**fields)
+            self.assertEqual(response['status'], 'success', response)
+            self.assertLessEqual(len(response['data']), limit)
+            keys += list(response['data'])
+            cursor = response['next_cursor']
+            if cursor is None:
+                return keys
+
+    def test_pages_ascending(self):
+        self.assertEqual(self.read_all_pages(3), KEYS)
+
+    def test_pages_descending(self):
+        self.assertEqual(self.read_all_pages(2, 'DESC'), KEYS[::-1])
+
+    def test_page_that_ends_exactly_at_the_last_row_reports_a_cursor(self):
+        response = self.get_data(limit=len(KEYS))
+        self.assertEqual(response['next_cursor'], KEYS[-1])
+        self.assertEqual(self.get_data(limit=3, after_key=KEYS[-1]), {'status': 'success', 'data': {}, 'next_cursor': None})
+
+    def test_prefix(self):
+        self.assertEqual(list(self.get_data(prefix='path')['data']), ['path', 'path_extra'])
+        self.assertEqual(list(self.get_data(prefix='alias_', limit=1, after_key='alias_ll')['data']), ['alias_ls'])
+
+    def test_key_range(self):
+        response = self.get_data(after_key='editor', before_key='path_extra')
+        self.assertEqual(list(response['data']), ['home', 'path'])
+        self.assertNotIn('next_cursor', response)
+
+    def test_invalid_limit(self):
+        self.assertEqual(self.get_data(limit='0'), {'status': 'error', 'message': 'limit must be a positive integer.'})
+        self.assertEqual(self.get_data(limit='ten')['status'], 'error')
+
+    def test_paging_needs_a_single_category(self):
+        response = self.post('get_data', token=self.token, category='ENV,ALIAS', limit=2)
+        self.assertEqual(response, {'status': 'error', 'message': 'Paging is only supported for a single category.'})
+
+    def test_several_categories_without_paging(self):
+        self.post('set_data', token=self.token, category='ALIAS', key='ll', value='ls -l')
+        response = self.post('get_data', token=self.token, category='ENV,ALIAS')
+        self.assertEqual(response['data']['ALIAS'], {'ll': 'ls -l'})
+        self.assertEqual(len(response['data']['ENV']), len(KEYS))
+
+class PrefixUpperBoundTests(unittest.TestCase):
+
+    def test_bumps_the_last_character(self):
+        self.assertEqual(prefix_upper_bound('abc'), 'abd')
+
+    def test_skips_characters_that_cannot_be_bumped(self):
+        self.assertEqual(prefix_upper_bound('a' + chr(sys.maxunicode)), 'b')
+        self.assertIsNone(prefix_upper_bound(chr(sys.maxunicode) * 2))
+        self.assertIsNone(prefix_upper_bound(''))
+
+if __name__ == '__main__':
+    unittest.main()
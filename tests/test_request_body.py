@@ -0,0 +1,180 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for the streaming request body parser in Api/RequestBody.py."""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Api'))
+
+from RequestBody import MAX_FIELD_SIZE, MAX_PART_HEADER_SIZE, RequestBodyError, parse_body
+
+BOUNDARY = 'XyZboundary42'
+
+class TrickleStream:
+    """An input stream that hands out at most `step` bytes per read, like a slow client."""
+
+    def __init__(self, data, step):
+        self.data = data
+        self.step = step
+        self.position = 0
+
+    def read(self, size):
+        chunk = self.data[self.position:self.position + min(size, self.step)]
+        self.position += len(chunk)
+        return chunk
+
+def multipart(fields, boundary=BOUNDARY):
+    """Encodes (name, value) pairs the way a browser's FormData does."""
+    body = b''
+    for name, value in fields:
+        body += (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n').encode('utf-8')
+        body += value.encode('utf-8') + b'\r\n'
+    return body + f'--{boundary}--\r\n'.encode('utf-8')
+
+def parse_multipart_body(body, step=None, content_length=None, **kwargs):
+    environ = {
+        'CONTENT_TYPE': f'multipart/form-data; boundary={BOUNDARY}',
+        'CONTENT_LENGTH': str(len(body) if content_length is None else content_length),
+    }
+    return parse_body(TrickleStream(body, step or len(body) or 1), environ, **kwargs)
+
+class MultipartTests(unittest.TestCase):
+    FIELDS = [('token', 'abc'), ('category', 'ENV'), ('value', 'line one\r\nline two\r\n')]
+
+    def test_fields(self):
+        self.assertEqual(parse_multipart_body(multipart(self.FIELDS)), dict(self.FIELDS))
+
+    def test_delimiter_split_across_reads(self):
+        body = multipart(self.FIELDS)
+        # Every read size cuts some delimiter, header block or CRLF at a different place.
+        for step in range(1, len(body) + 1):
+            with self.subTest(step=step):
+                self.assertEqual(parse_multipart_body(body, step), dict(self.FIELDS))
+
+    def test_empty_part(self):
+        fields = [('token', 'abc'), ('value', ''), ('key', 'k')]
+        for step in (1, 3, 1000):
+            with self.subTest(step=step):
+                self.assertEqual(parse_multipart_body(multipart(fields), step), dict(fields))
+
+    def test_boundary_look_alikes_in_values(self):
+        # Only CRLF followed by the whole "--boundary" ends a value; a client never sends that inside one.
+        look_alikes = [
+            f'--{BOUNDARY}',
+            f'--{BOUNDARY}--',
+            f'x\r\n--{BOUNDARY[:-1]}',
+            f'\r\n-{BOUNDARY}',
+            f'{BOUNDARY}\r\n{BOUNDARY}--',
+            f'\r\n--{BOUNDARY[:5]}',
+        ]
+        fields = [(f'field{i}', value) for i, value in enumerate(look_alikes)]
+        body = multipart(fields)
+        for step in (1, 2, 7, len(body)):
+            with self.subTest(step=step):
+                self.assertEqual(parse_multipart_body(body, step), dict(fields))
+
+    def test_preamble_and_epilogue_are_ignored(self):
+        body = b'preamble text\r\n' + multipart(self.FIELDS) + b'epilogue'
+        self.assertEqual(parse_multipart_body(body, 5), dict(self.FIELDS))
+
+    def test_file_parts_are_skipped(self):
+        body = (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="upload"; filename="a.txt"\r\n'
+                f'Content-Type: text/plain\r\n\r\nfile data\r\n').encode('utf-8') + multipart([('token', 'abc')])
+        self.assertEqual(parse_multipart_body(body), {'token': 'abc'})
+
+    def test_truncated_body(self):
+        body = multipart(self.FIELDS)
+        # The client promised more bytes than it sent.
+        with self.assertRaisesRegex(RequestBodyError, 'shorter than its Content-Length'):
+            parse_multipart_body(body[:-10], 4, content_length=len(body))
+        # The declared length is honest, but the closing delimiter never comes.
+        for cut in (len(body) - 4, len(body) // 2, 3):
+            with self.subTest(cut=cut), self.assertRaisesRegex(RequestBodyError, 'before its closing boundary'):
+                parse_multipart_body(body[:cut], 4)
+
+    def test_oversize_field(self):
+        body = multipart([('value', 'x' * (MAX_FIELD_SIZE + 1))])
+        with self.assertRaises(RequestBodyError) as cm:
+            parse_multipart_body(body, 64 * 1024)
+        self.assertEqual(cm.exception.status, '413 Content Too Large')
+        # A caller may allow a larger value for a specific field.
+        result = parse_multipart_body(body, 64 * 1024, field_limits={'value': MAX_FIELD_SIZE + 1})
+        self.assertEqual(len(result['value']), MAX_FIELD_SIZE + 1)
+
+    def test_oversize_part_headers(self):
+        body = f'--{BOUNDARY}\r\nX-Padding: {"a" * MAX_PART_HEADER_SIZE}'.encode('utf-8')
+        with self.assertRaisesRegex(RequestBodyError, 'headers are too large'):
+            parse_multipart_body(body, 1024, content_length=len(body) + 100)
+
+    def test_missing_boundary(self):
+        environ = {'CONTENT_TYPE': 'multipart/form-data', 'CONTENT_LENGTH': '4'}
+        with self.assertRaisesRegex(RequestBodyError, 'without a boundary'):
+            parse_body(TrickleStream(b'abcd', 4), environ)
+
+class BodyLimitTests(unittest.TestCase):
+
+    def test_oversize_body_is_rejected_before_reading(self):
+        environ = {'CONTENT_TYPE': 'application/x-www-form-urlencoded', 'CONTENT_LENGTH': str(10 ** 9)}
+        with self.assertRaises(RequestBodyError) as cm:
+            parse_body(TrickleStream(b'', 1), environ)
+        self.assertEqual(cm.exception.status, '413 Content Too Large')
+
+    def test_urlencoded_and_json_give_the_same_fields(self):
+        form = b'token=abc&value=a%26b'
+        json_body = b'{"token": "abc", "value": "a&b"}'
+        for content_type, body in (('application/x-www-form-urlencoded', form), ('application/json', json_body)):
+            with self.subTest(content_type=content_type):
+                environ = {'CONTENT_TYPE': content_type, 'CONTENT_LENGTH': str(len(body))}
+                self.assertEqual(parse_body(TrickleStream(body, 3), environ), {'token': 'abc', 'value': 'a&b'})
+
+    def test_other_content_types_have_no_fields(self):
+        for content_type in ('text/plain', ''):
+            with self.subTest(content_type=content_type):
+                environ = {'CONTENT_TYPE': content_type, 'CONTENT_LENGTH': '3'}
+                self.assertEqual(parse_body(TrickleStream(b'abc', 3), environ), {})
+        self.assertEqual(parse_body(TrickleStream(b'', 1), {}), {})
+
+class JsonFieldTests(unittest.TestCase):
+
+    def parse(self, body):
+        environ = {'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(body))}
+        return parse_body(TrickleStream(body, len(body) or 1), environ)
+
+    def test_scalars_read_like_form_values(self):
+        self.assertEqual(self.parse(b'{"limit": 10, "must_be_dir": false, "ratio": 0.5}'),
+                         {'limit': '10', 'must_be_dir': 'false', 'ratio': '0.5'})
+
+    def test_null_fields_are_left_out(self):
+        self.assertEqual(self.parse(b'{"token": "abc", "after_key": null}'), {'token': 'abc'})
+
+    def test_nested_values_are_rejected(self):
+        for body in (b'{"value": {"a": 1}}', b'{"value": [1, 2]}'):
+            with self.subTest(body=body), self.assertRaisesRegex(RequestBodyError, "Field 'value' must be a string"):
+                self.parse(body)
+
+    def test_blank_body_has_no_fields(self):
+        self.assertEqual(self.parse(b''), {})
+        self.assertEqual(self.parse(b' \r\n'), {})
+
+    def test_malformed_bodies(self):
+        with self.assertRaisesRegex(RequestBodyError, 'Invalid JSON body'):
+            self.parse(b'{"token": ')
+        with self.assertRaisesRegex(RequestBodyError, 'must be an object'):
+            self.parse(b'["token"]')
+
+if __name__ == '__main__':
+    unittest.main()
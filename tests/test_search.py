@@ -0,0 +1,78 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for the filename search index of Api/Filesystem.py."""
+import os
+import shutil
+import unittest
+from unittest import mock
+
+from support import Filesystem, FilesystemTestCase
+
+class SearchTests(FilesystemTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for path in ('/music/Song_One.mp3', '/music/song_two.ogg', '/docs/songbook.pdf',
+                     '/docs/notes/todo.txt', '/docs/notes/100%.txt', '/.hidden/song.mp3'):
+            self.write_file(path, 'x')
+
+    def search(self, q, path='/', **params):
+        response = self.get('search', path=path, q=q, **params)
+        self.assertNotIn('error', response)
+        return [result['path'] for result in response['results']]
+
+    def test_substring_is_case_insensitive(self):
+        self.assertEqual(self.search('song'), ['/docs/songbook.pdf', '/music/Song_One.mp3', '/music/song_two.ogg'])
+        self.assertEqual(self.search('so'), ['/docs/songbook.pdf', '/music/Song_One.mp3', '/music/song_two.ogg'])
+
+    def test_substring_without_fts(self):
+        with mock.patch.object(Filesystem, 'search_index_has_fts', return_value=False):
+            self.assertEqual(self.search('song'), ['/docs/songbook.pdf', '/music/Song_One.mp3', '/music/song_two.ogg'])
+            # LIKE wildcards in the query are matched literally.
+            self.assertEqual(self.search('0%'), ['/docs/notes/100%.txt'])
+
+    def test_glob_and_prefix(self):
+        self.assertEqual(self.search('*.mp3', mode='glob'), ['/music/Song_One.mp3'])
+        self.assertEqual(self.search('song', mode='prefix'), ['/docs/songbook.pdf', '/music/song_two.ogg'])
+
+    def test_path_scope(self):
+        self.assertEqual(self.search('/docs/notes/', mode='prefix', scope='path'),
+                         ['/docs/notes/100%.txt', '/docs/notes/todo.txt'])
+
+    def test_search_is_limited_to_the_directory(self):
+        self.assertEqual(self.search('o', path='/docs/notes'), ['/docs/notes/todo.txt'])
+
+    def test_limit(self):
+        response = self.get('search', path='/', q='song', limit='1')
+        self.assertEqual(len(response['results']), 1)
+        self.assertTrue(response['truncated'])
+
+    def test_changes_are_picked_up_on_refresh(self):
+        self.assertEqual(self.search('todo'), ['/docs/notes/todo.txt'])
+        self.write_file('/docs/todo-later.txt', 'x')
+        shutil.rmtree(os.path.join(self.fs_root, 'docs', 'notes'))
+        # Within the refresh interval the index is not rescanned.
+        self.assertEqual(self.search('todo'), ['/docs/notes/todo.txt'])
+        self.patch(Filesystem, 'SEARCH_REFRESH_INTERVAL', 0)
+        self.assertEqual(self.search('todo'), ['/docs/todo-later.txt'])
+
+    def test_invalid_queries(self):
+        self.assertEqual(self.get('search', path='/', q=''), {'error': 'Query is required'})
+        self.assertEqual(self.get('search', path='/', q='x', mode='regex'), {'error': 'Unknown search mode: regex'})
+        self.assertEqual(self.get('search', path='/music/song_two.ogg', q='x'), {'error': 'Not a directory'})
+
+if __name__ == '__main__':
+    unittest.main()
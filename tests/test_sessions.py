@@ -0,0 +1,73 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for the session cache and the deferred sliding-expiry writes of Api/Accounting.py."""
+import unittest
+from unittest import mock
+
+from support import Accounting, AccountingTestCase
+
+DAY = 24 * 3600
+
+class SessionTests(AccountingTestCase):
+
+    def expires_at(self, token):
+        return self.query("SELECT expires_at FROM sessions WHERE token = ?", (token,))[0][0]
+
+    def test_validate_does_not_write_a_fresh_session(self):
+        token = self.login()
+        expires_at = self.expires_at(token)
+        with mock.patch.object(Accounting, 'new_session_expiry', return_value=expires_at + DAY):
+            self.assertEqual(self.post('validate', token=token)['status'], 'success')
+        self.assertEqual(self.expires_at(token), expires_at)
+
+    def test_validate_extends_a_session_past_the_refresh_threshold(self):
+        token = self.login()
+        soon = Accounting.current_timestamp() + DAY
+        self.query("UPDATE sessions SET expires_at = ? WHERE token = ?", (soon, token))
+        Accounting._session_cache.invalidate(token)
+        self.assertEqual(self.post('validate', token=token)['status'], 'success')
+        self.assertGreater(self.expires_at(token), soon + 5 * DAY)
+
+    def test_cached_session_is_served_without_reading_the_table(self):
+        token = self.login()
+        self.query("DELETE FROM sessions WHERE token = ?", (token,))
+        self.assertEqual(self.post('validate', token=token)['status'], 'success')
+        # Once the entry outlives SESSION_CACHE_TTL the table is consulted again.
+        self.patch(Accounting, '_session_cache', Accounting.SessionCache(Accounting.SESSION_CACHE_SIZE, -1))
+        self.assertEqual(self.post('validate', token=token)['status'], 'error')
+
+    def test_logout_drops_the_cached_session(self):
+        token = self.login()
+        self.assertEqual(self.post('logout', token=token)['status'], 'success')
+        self.assertEqual(self.post('validate', token=token)['status'], 'error')
+
+    def test_expired_session_is_rejected_and_deleted(self):
+        token = self.login()
+        self.query("UPDATE sessions SET expires_at = ? WHERE token = ?", (Accounting.current_timestamp() - 1, token))
+        Accounting._session_cache.invalidate(token)
+        self.assertEqual(self.post('validate', token=token)['status'], 'error')
+        self.assertEqual(self.query("SELECT COUNT(*) FROM sessions WHERE token = ?", (token,)), [(0,)])
+
+    def test_password_change_revokes_the_other_cached_sessions(self):
+        token = self.login()
+        other = self.login()
+        response = self.post('change_password', token=token, old_password='secret', new_password='hunter2')
+        self.assertEqual(response['status'], 'success')
+        self.assertEqual(self.post('validate', token=other)['status'], 'error')
+        self.assertEqual(self.post('validate', token=token)['status'], 'success')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for the per-user sharding of user data in Api/Accounting.py."""
+import os
+import unittest
+
+from support import Accounting, AccountingTestCase
+
+USERS = ('alice', 'bob', 'carol', 'dave', 'erin')
+
+class ShardingTests(AccountingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tokens = {username: self.login(username) for username in USERS}
+
+    def write(self, username):
+        token = self.tokens[username]
+        self.post('set_data', token=token, category='ENV', key='USER', value=username)
+        self.post('history_append', token=token, command=f'echo {username}')
+
+    def read(self, username):
+        token = self.tokens[username]
+        data = self.post('get_data', token=token, category='ENV')['data']
+        history = [entry['command'] for entry in self.post('history_tail', token=token)['entries']]
+        return data, history
+
+    def expected(self, username):
+        return {'USER': username}, [f'echo {username}']
+
+    def rows(self, path, table='user_data'):
+        return self.query(f"SELECT username FROM {table} ORDER BY username", path=path)
+
+    def test_shard_is_stable_and_in_range(self):
+        self.patch(Accounting, 'DATA_SHARDS', 4)
+        shard_file = Accounting.get_shard_file('alice')
+        self.assertEqual(Accounting.get_shard_file('alice'), shard_file)
+        self.assertRegex(os.path.basename(shard_file), r'^user_data_00[0-3]\.db$')
+        self.patch(Accounting, 'DATA_SHARDS', 0)
+        self.assertEqual(Accounting.get_shard_file('alice'), self.db_file)
+
+    def test_data_and_history_live_in_the_user_shard(self):
+        self.patch(Accounting, 'DATA_SHARDS', 4)
+        self.write('alice')
+        self.assertEqual(self.read('alice'), self.expected('alice'))
+        shard_file = Accounting.get_shard_file('alice')
+        self.assertEqual(self.rows(shard_file), [('alice',)])
+        self.assertEqual(self.rows(shard_file, 'history'), [('alice',)])
+        self.assertEqual(self.rows(self.db_file), [])
+
+    def test_shard_files_get_the_shard_schema(self):
+        self.patch(Accounting, 'DATA_SHARDS', 4)
+        self.write('alice')
+        shard_file = Accounting.get_shard_file('alice')
+        self.assertEqual(self.query("PRAGMA user_version", path=shard_file), [(len(Accounting.SHARD_SCHEMA_MIGRATIONS),)])
+        tables = {name for name, in self.query("SELECT name FROM sqlite_master WHERE type = 'table'", path=shard_file)}
+        self.assertEqual(tables, set(Accounting.SHARDED_TABLES))
+
+    def test_reshard_moves_users_and_can_be_repeated(self):
+        for username in USERS:
+            self.write(username)
+
+        self.patch(Accounting, 'DATA_SHARDS', 3)
+        self.assertEqual(Accounting.reshard_user_data(), len(USERS))
+        self.assertEqual(Accounting.reshard_user_data(), 0)
+        self.assertEqual(self.rows(self.db_file) + self.rows(self.db_file, 'history'), [])
+        for username in USERS:
+            self.assertEqual(self.read(username), self.expected(username))
+            self.assertIn((username,), self.rows(Accounting.get_shard_file(username)))
+
+        # And back to a single file.
+        self.patch(Accounting, 'DATA_SHARDS', 0)
+        self.assertEqual(Accounting.reshard_user_data(), len(USERS))
+        self.assertEqual(self.rows(self.db_file), [(username,) for username in USERS])
+        for username in USERS:
+            self.assertEqual(self.read(username), self.expected(username))
+
+    def test_interrupted_reshard_is_completed_by_a_second_run(self):
+        self.write('alice')
+        self.patch(Accounting, 'DATA_SHARDS', 3)
+        shard_file = Accounting.get_shard_file('alice')
+        # A run that copied alice but died before deleting her from the old file.
+        Accounting.ensure_db(shard_file)
+        conn = Accounting.get_db(shard_file)
+        conn.execute("ATTACH DATABASE ? AS old", (self.db_file,))
+        for table in Accounting.SHARDED_TABLES:
+            conn.execute(f"INSERT INTO {table} SELECT * FROM old.{table}")
+        conn.commit()
+        conn.execute("DETACH DATABASE old")
+
+        self.assertEqual(Accounting.reshard_user_data(), 1)
+        self.assertEqual(self.rows(self.db_file), [])
+        self.assertEqual(self.read('alice'), self.expected('alice'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for the resolve and batched stat actions of Api/Filesystem.py."""
+import json
+import os
+import unittest
+
+from support import Filesystem, FilesystemTestCase
+
+class StatTests(FilesystemTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write_file('/home/notes.txt', 'hello')
+        self.mtime = int(os.stat(os.path.join(self.fs_root, 'home', 'notes.txt')).st_mtime)
+
+    def stat(self, items, pwd='/'):
+        body = json.dumps({'items': items}).encode('utf-8')
+        status, _, data = self.call('stat', pwd=pwd, body=body, headers={'CONTENT_TYPE': 'application/json'})
+        self.assertEqual(status, '200 OK')
+        return json.loads(data)['results']
+
+    def test_describes_files_and_directories(self):
+        self.assertEqual(self.stat(['/home/notes.txt', {'path': 'home'}]), [
+            {'path': '/home/notes.txt', 'type': 'file', 'size': 5, 'mtime': self.mtime, 'url': '/fs/home/notes.txt'},
+            {'path': '/home', 'type': 'directory', 'size': None,
+             'mtime': int(os.stat(os.path.join(self.fs_root, 'home')).st_mtime), 'url': '/fs/home'},
+        ])
+
+    def test_items_in_the_query_string(self):
+        _, _, data = self.call('stat', items=json.dumps(['notes.txt']), pwd='/home')
+        self.assertEqual(json.loads(data)['results'][0]['path'], '/home/notes.txt')
+
+    def test_relative_to_the_item_pwd(self):
+        self.assertEqual(self.stat([{'path': 'notes.txt', 'pwd': '/home'}])[0]['type'], 'file')
+
+    def test_must_be_dir(self):
+        results = self.stat([
+            {'path': '/home/notes.txt', 'must_be_dir': True},
+            {'path': '/home/notes.txt', 'must_be_dir': 'true'},
+            {'path': '/home/notes.txt', 'must_be_dir': False},
+            {'path': '/home/notes.txt', 'must_be_dir': 'false'},
+            {'path': '/home/notes.txt', 'must_be_dir': 1},
+            {'path': '/home', 'must_be_dir': True},
+        ])
+        self.assertEqual([result.get('error', result.get('type')) for result in results], [
+            'Not a directory', 'Not a directory', 'file', 'file', 'must_be_dir must be a boolean', 'directory',
+        ])
+
+    def test_each_item_gets_its_own_error(self):
+        results = self.stat(['/nope', {'pwd': '/'}, '../../etc/passwd', '/home/notes.txt'])
+        self.assertEqual(results[:3], [
+            {'error': 'No such file or directory'},
+            {'error': 'Each item needs a path'},
+            {'error': 'Invalid path: Directory traversal attempt detected.'},
+        ])
+        self.assertEqual(results[3]['type'], 'file')
+
+    def test_too_many_items(self):
+        body = json.dumps({'items': ['/'] * (Filesystem.STAT_MAX_ITEMS + 1)}).encode('utf-8')
+        _, _, data = self.call('stat', body=body, headers={'CONTENT_TYPE': 'application/json'})
+        self.assertEqual(json.loads(data), {'error': f'At most {Filesystem.STAT_MAX_ITEMS} items can be resolved at once'})
+
+class ResolveTests(FilesystemTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write_file('/home/notes.txt', 'hello')
+
+    def test_resolves_relative_paths(self):
+        self.assertEqual(self.get('resolve', path='../home/./notes.txt', pwd='/home'), {'path': '/home/notes.txt'})
+
+    def test_must_be_dir(self):
+        self.assertEqual(self.get('resolve', path='/home', must_be_dir='true'), {'path': '/home'})
+        self.assertEqual(self.get('resolve', path='/home/notes.txt', must_be_dir='true'), {'error': 'Not a directory'})
+        self.assertEqual(self.get('resolve', path='/home/notes.txt', must_be_dir='false'), {'path': '/home/notes.txt'})
+
+    def test_missing_path(self):
+        self.assertEqual(self.get('resolve', path='/nope'), {'error': 'No such file or directory'})
+
+if __name__ == '__main__':
+    unittest.main()
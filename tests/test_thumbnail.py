@@ -0,0 +1,107 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for the thumbnail cache of Api/Filesystem.py."""
+import io
+import os
+import time
+import unittest
+from unittest import mock
+
+from support import Filesystem, FilesystemTestCase
+
+@unittest.skipUnless(Filesystem.load_pillow(), 'Pillow is not installed')
+class ThumbnailTests(FilesystemTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.image = self.write_image('/photos/wide.png', (600, 300))
+
+    def write_image(self, vfs_path, size):
+        data = io.BytesIO()
+        Filesystem.Image.new('RGB', size, (200, 40, 40)).save(data, 'PNG')
+        return self.write_file(vfs_path, data.getvalue())
+
+    def cached_files(self):
+        return sorted(name for _, _, names in os.walk(os.path.join(self.cache_dir, 'thumbs')) for name in names)
+
+    def thumbnail(self, path='/photos/wide.png', **params):
+        status, _, body = self.call('thumbnail', path=path, **params)
+        self.assertEqual(status, '200 OK')
+        with Filesystem.Image.open(io.BytesIO(body)) as img:
+            return img.format, img.size
+
+    def test_renders_a_jpeg_within_the_snapped_size(self):
+        self.assertEqual(self.thumbnail(), ('JPEG', (256, 128)))
+        self.assertEqual(self.thumbnail(size='100'), ('JPEG', (128, 64)))
+
+    def test_cache_hit_does_not_render_again(self):
+        self.thumbnail()
+        with mock.patch.object(Filesystem, 'render_thumbnail', side_effect=AssertionError('rendered')):
+            self.thumbnail()
+
+    def test_changed_source_gets_a_new_thumbnail(self):
+        self.thumbnail()
+        self.write_image('/photos/wide.png', (300, 600))
+        self.assertEqual(self.thumbnail(), ('JPEG', (128, 256)))
+        self.assertEqual(len(self.cached_files()), 2)
+
+    def test_failed_render_leaves_no_temporary_file(self):
+        def save(img, path, *args, **kwargs):
+            with open(path, 'wb') as f:
+                f.write(b'partial')
+            raise OSError('disk full')
+
+        with mock.patch.object(Filesystem.Image.Image, 'save', save):
+            self.assertEqual(self.get('thumbnail', path='/photos/wide.png'),
+                             {'error': 'Cannot create a thumbnail for this file'})
+        self.assertEqual(self.cached_files(), [])
+
+    def test_not_an_image(self):
+        self.write_file('/photos/notes.txt', 'hello')
+        self.assertEqual(self.get('thumbnail', path='/photos/notes.txt'),
+                         {'error': 'Cannot create a thumbnail for this file'})
+
+    def test_sweep_deletes_the_least_recently_used_first(self):
+        for name in ('a', 'b', 'c'):
+            self.write_image(f'/photos/{name}.png', (600, 300))
+            self.thumbnail(f'/photos/{name}.png')
+        files = {name: Filesystem.get_thumbnail_file(os.path.join(self.fs_root, 'photos', f'{name}.png'),
+                                                     os.stat(os.path.join(self.fs_root, 'photos', f'{name}.png')), 256)
+                 for name in ('a', 'b', 'c')}
+        old = time.time() - 2 * Filesystem.CACHE_TOUCH_INTERVAL
+        for age, name in enumerate(('a', 'b', 'c')):
+            os.utime(files[name], (old + age, old + age))
+        # Reading 'a' marks it as recently used.
+        self.thumbnail('/photos/a.png')
+        leftover = files['b'] + '.1.1.tmp'
+        open(leftover, 'wb').close()
+        os.utime(leftover, (old, old))
+
+        self.assertEqual(Filesystem.sweep_cache('thumbs', os.path.getsize(files['a']) + 1), 2)
+        self.assertEqual([os.path.exists(files[name]) for name in ('a', 'b', 'c')], [True, False, False])
+        self.assertFalse(os.path.exists(leftover))
+
+    def test_warm_renders_the_missing_thumbnails_and_sweeps(self):
+        self.write_image('/photos/deep/tall.png', (300, 600))
+        self.write_file('/photos/readme.txt', 'x')
+        with mock.patch.object(Filesystem, 'sweep_cache') as sweep_cache:
+            self.assertEqual(Filesystem.warm_thumbnails(os.path.join(self.fs_root, 'photos'), [128, 256], True, 1), (4, 0))
+            sweep_cache.assert_called_once_with('thumbs', Filesystem.THUMBNAIL_CACHE_MAX_BYTES)
+        self.assertEqual(len(self.cached_files()), 4)
+        self.assertEqual(Filesystem.warm_thumbnails(os.path.join(self.fs_root, 'photos'), [128], True, 1), (0, 0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for the backup and NDJSON export/import commands of Api/Accounting.py."""
+import io
+import json
+import os
+import unittest
+
+from support import Accounting, AccountingTestCase
+
+class TransferTests(AccountingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for username in ('alice', 'bob'):
+            token = self.login(username)
+            self.post('set_data', token=token, category='ENV', key='USER', value=username)
+            self.post('history_append', token=token, command=f'echo {username}')
+
+    def move_to(self, name, shards=0):
+        """Points Accounting.py at a new, empty set of database files, as on another host."""
+        self.close_connections()
+        db_dir = os.path.join(self.tmp_dir, name)
+        self.patch(Accounting, 'DB_FILE', os.path.join(db_dir, 'users.db'))
+        self.patch(Accounting, 'DB_DIR', db_dir)
+        self.patch(Accounting, 'SHARD_DIR', os.path.join(db_dir, 'shards'))
+        self.patch(Accounting, 'DATA_SHARDS', shards)
+        self.patch(Accounting, '_session_cache', Accounting.SessionCache(Accounting.SESSION_CACHE_SIZE,
+                                                                          Accounting.SESSION_CACHE_TTL))
+        self.db_file = Accounting.DB_FILE
+
+    def export(self):
+        out = io.StringIO()
+        count = Accounting.export_ndjson(out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), count)
+        return lines
+
+    def check_accounts(self):
+        for username in ('alice', 'bob'):
+            response = self.post('login', username=username, password='secret')
+            self.assertEqual(response['status'], 'success', response)
+            token = response['token']
+            self.assertEqual(self.post('get_data', token=token, category='ENV')['data'], {'USER': username})
+            entries = self.post('history_tail', token=token)['entries']
+            self.assertEqual([entry['command'] for entry in entries], [f'echo {username}'])
+
+    def test_export_has_every_table(self):
+        tables = {json.loads(line)['table'] for line in self.export()}
+        self.assertEqual(tables, set(Accounting.EXPORT_TABLES))
+
+    def test_round_trip(self):
+        lines = self.export()
+        self.move_to('copy')
+        self.assertEqual(Accounting.import_ndjson(lines, batch_size=2), len(lines))
+        self.assertEqual(sorted(self.export()), sorted(lines))
+        self.check_accounts()
+
+    def test_import_routes_rows_to_shards(self):
+        lines = self.export()
+        self.move_to('sharded', shards=3)
+        Accounting.import_ndjson(lines)
+        self.check_accounts()
+        self.assertEqual(self.query("SELECT COUNT(*) FROM user_data"), [(0,)])
+        shard_file = Accounting.get_shard_file('alice')
+        self.assertEqual(self.query("SELECT value FROM user_data WHERE username = 'alice'", path=shard_file), [('alice',)])
+
+    def test_import_replaces_rows_with_the_same_key(self):
+        lines = self.export()
+        Accounting.import_ndjson(lines)
+        Accounting.import_ndjson(lines)
+        self.assertEqual(self.query("SELECT COUNT(*) FROM users"), [(2,)])
+        self.assertEqual(self.query("SELECT COUNT(*) FROM history"), [(2,)])
+
+    def test_import_rejects_unknown_tables_and_columns(self):
+        bad_lines = [
+            'not json',
+            json.dumps({'row': {}}),
+            json.dumps({'table': 'sqlite_master', 'row': {'name': 'x'}}),
+            json.dumps({'table': 'users', 'row': {'username': 'eve', 'is_admin': 1}}),
+        ]
+        messages = ['Line 1: not an export record.', 'Line 1: not an export record.',
+                    'Line 1: unknown table or columns.', 'Line 1: unknown table or columns.']
+        for line, message in zip(bad_lines, messages):
+            with self.subTest(line=line), self.assertRaisesRegex(ValueError, message):
+                Accounting.import_ndjson([line])
+        self.assertEqual(self.query("SELECT COUNT(*) FROM users"), [(2,)])
+
+    def test_backup_is_a_usable_copy(self):
+        self.patch(Accounting, 'DATA_SHARDS', 2)
+        self.assertEqual(Accounting.reshard_user_data(), 2)
+        backup_dir = os.path.join(self.tmp_dir, 'backup')
+        written = Accounting.backup_databases(backup_dir)
+        self.assertEqual(written, [os.path.join(backup_dir, os.path.relpath(path, Accounting.DB_DIR))
+                                   for path in Accounting.list_data_files()])
+
+        self.move_to('backup', shards=2)
+        self.check_accounts()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for the streamed recursive tree action of Api/Filesystem.py."""
+import json
+import unittest
+
+from support import FilesystemTestCase
+
+class TreeTests(FilesystemTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write_file('/a/one.txt', '1')
+        self.write_file('/a/deep/two.md', '22')
+        self.write_file('/b.txt', '333')
+        self.write_file('/.secret/x.txt', 'x')
+        self.write_file('/tool.py', 'x')
+
+    def tree(self, **params):
+        status, headers, body = self.call('tree', path='/', **params)
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(headers['Content-Type'], 'application/x-ndjson')
+        records = [json.loads(line) for line in body.decode('utf-8').splitlines()]
+        return records[:-1], records[-1]['summary']
+
+    def test_walks_depth_first_in_name_order(self):
+        records, summary = self.tree()
+        self.assertEqual([(r['path'], r['type'], r['depth']) for r in records], [
+            ('/a', 'directory', 1),
+            ('/b.txt', 'file', 1),
+            ('/a/deep', 'directory', 2),
+            ('/a/one.txt', 'file', 2),
+            ('/a/deep/two.md', 'file', 3),
+        ])
+        self.assertEqual(summary, {'directories': 2, 'files': 3, 'size': 6, 'truncated': False})
+
+    def test_max_depth(self):
+        records, _ = self.tree(max_depth='1')
+        self.assertEqual([r['path'] for r in records], ['/a', '/b.txt'])
+
+    def test_patterns_filter_what_is_reported_but_not_what_is_walked(self):
+        records, summary = self.tree(pattern=['*.md', 'one.*'])
+        self.assertEqual([r['path'] for r in records], ['/a/one.txt', '/a/deep/two.md'])
+        self.assertEqual(summary['files'], 2)
+
+    def test_limit_truncates(self):
+        records, summary = self.tree(limit='2')
+        self.assertEqual(len(records), 2)
+        self.assertTrue(summary['truncated'])
+
+    def test_file_is_not_a_tree(self):
+        self.assertEqual(self.get('tree', path='/b.txt'), {'error': 'Not a directory'})
+
+    def test_invalid_limits(self):
+        self.assertEqual(self.get('tree', path='/', max_depth='0'), {'error': 'max_depth and limit must be positive'})
+        self.assertEqual(self.get('tree', path='/', limit='x'), {'error': 'Invalid limit: must be an integer'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Tests for the change notifications of Api/Accounting.py."""
+import io
+import json
+import time
+import unittest
+from unittest import mock
+
+from support import Accounting, AccountingTestCase, call_wsgi
+
+EVENT_STREAM = {'HTTP_ACCEPT': 'text/event-stream'}
+
+class WatchTests(AccountingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.token = self.login()
+        self.post('set_data', token=self.token, category='ENV', key='home', value='/home/alice')
+        self.patch(Accounting, 'WATCH_TIMEOUT', 0)
+
+    def ticket(self):
+        response = self.post('watch_ticket', token=self.token)
+        self.assertEqual(response['status'], 'success', response)
+        return response['ticket']
+
+    def watch(self, headers=None, **params):
+        """Sends a GET for watch. Returns (status, headers, body bytes)."""
+        return call_wsgi(Accounting.application, dict(params, action='watch'), headers=headers)
+
+    def test_long_poll_with_a_ticket(self):
+        status, _, body = self.watch(ticket=self.ticket(), cursor='0')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(json.loads(body), {'status': 'success', 'cursor': 1,
+                                            'changes': [{'category': 'ENV', 'version': 1}]})
+
+    def test_long_poll_times_out_without_changes(self):
+        response = self.post('watch', token=self.token, cursor='1')
+        self.assertEqual(response, {'status': 'success', 'cursor': 1, 'changes': []})
+
+    def test_token_in_the_query_string_is_refused(self):
+        _, _, body = self.watch(token=self.token, cursor='0')
+        self.assertEqual(json.loads(body), {'status': 'error', 'message': 'Invalid or expired session.'})
+
+    def test_ticket_is_not_a_session_token(self):
+        self.assertEqual(self.post('validate', token=self.ticket())['status'], 'error')
+
+    def test_ticket_expires_and_dies_with_its_session(self):
+        ticket = self.ticket()
+        self.query("UPDATE watch_tickets SET expires_at = ?", (Accounting.current_timestamp() - 1,))
+        self.assertEqual(json.loads(self.watch(ticket=ticket)[2])['status'], 'error')
+
+        ticket = self.ticket()
+        # Issuing a ticket clears out the expired ones.
+        self.assertEqual(self.query("SELECT COUNT(*) FROM watch_tickets"), [(1,)])
+        self.post('logout', token=self.token)
+        self.assertEqual(json.loads(self.watch(ticket=ticket)[2])['status'], 'error')
+
+    def test_event_stream(self):
+        self.patch(Accounting, 'WATCH_STREAM_DURATION', 0.05)
+        status, headers, body = self.watch(EVENT_STREAM, ticket=self.ticket(), cursor='0')
+        self.assertEqual((status, headers['Content-Type']), ('200 OK', 'text/event-stream'))
+        self.assertIn(b'id: 1\nevent: change\ndata: {"category": "ENV", "version": 1}\n\n', body)
+
+    def test_event_stream_under_cgi_lasts_one_long_poll(self):
+        environ = dict(EVENT_STREAM, QUERY_STRING=f'ticket={self.ticket()}')
+        with mock.patch.object(Accounting, 'iter_change_events') as iter_change_events:
+            response = Accounting.handle_watch({}, environ)
+            self.assertIsInstance(response, Accounting.EventStream)
+            iter_change_events.assert_called_once_with('alice', 1, Accounting.WATCH_TIMEOUT)
+            Accounting.handle_watch({}, dict(environ, **{'wsgi.input': io.BytesIO()}))
+            self.assertEqual(iter_change_events.call_args.args[2], Accounting.WATCH_STREAM_DURATION)
+
+    def test_stream_holds_its_slot_until_it_ends(self):
+        self.patch(Accounting, 'CONCURRENCY_LIMITS', {'watch': 1})
+        environ = dict(EVENT_STREAM, QUERY_STRING=f'ticket={self.ticket()}', **{'wsgi.input': io.BytesIO()})
+        stream = Accounting.handle_request('watch', {}, environ)
+        self.assertIsInstance(stream, Accounting.EventStream)
+        expires_at = self.query("SELECT expires_at FROM slots", path=self.admission_store.path)[0][0]
+        self.assertGreater(expires_at, time.time() + Accounting.WATCH_STREAM_DURATION)
+
+        refused = Accounting.handle_request('watch', {'token': self.token}, {})
+        self.assertEqual(refused.status, '429 Too Many Requests')
+        # The client goes away after the first event.
+        self.assertEqual(next(stream.events), b'retry: 1000\n\n')
+        stream.events.close()
+        self.assertEqual(Accounting.handle_request('watch', {'token': self.token}, {})['status'], 'success')
+
+if __name__ == '__main__':
+    unittest.main()
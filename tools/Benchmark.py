@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+# Nnoitra Terminal
+# Copyright (C) 2025 Arefi
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Load-testing harness for the API scripts.
+
+Builds a throwaway copy of the Api directory with a synthetic accounts database
+and filesystem tree, drives the actions with concurrent clients, either as CGI
+processes (one per request, as under Apache) or against the `serve` mode, and
+reports throughput and p50/p95/p99 latency per action:
+
+    python3 tools/Benchmark.py --mode both --users 1000 --requests 500 --concurrency 8
+
+`--mode startup` measures the fixed cost of a CGI request instead. It compares
+the scripts with their *Cgi.py entry points one request at a time, and lists the
+imports each process pays for:
+
+    python3 tools/Benchmark.py --mode startup --requests 50
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import socket
+import hashlib
+import argparse
+import tempfile
+import compileall
+import subprocess
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_DIR = os.path.join(REPO_ROOT, 'Api')
+
+ACCOUNTING_ACTIONS = ('login', 'validate', 'get_data', 'set_data')
+FILESYSTEM_ACTIONS = ('ls', 'cat', 'resolve')
+ALL_ACTIONS = ACCOUNTING_ACTIONS + FILESYSTEM_ACTIONS
+# The small CGI entry points that load each script from its cached bytecode.
+CGI_ENTRY_POINTS = {'Accounting.py': 'AccountingCgi.py', 'Filesystem.py': 'FilesystemCgi.py'}
+# Number of slowest top-level imports listed per script by the startup mode.
+STARTUP_TOP_IMPORTS = 5
+
+BENCH_PASSWORD = 'benchmark'
+BENCH_CATEGORY = 'ENV'
+# Number of sessions shared by the clients of the token-based actions.
+TOKEN_POOL_SIZE = 64
+SERVER_START_TIMEOUT = 10
+
+# --- Synthetic Environment ---
+
+def build_workspace(root, args, rng):
+    """Creates an Api copy, accounts database and fs tree under root. Returns (api_dir, dirs, files)."""
+    api_dir = os.path.join(root, 'Api')
+    os.makedirs(api_dir)
+    for name in os.listdir(API_DIR):
+        if name.endswith('.py'):
+            shutil.copy(os.path.join(API_DIR, name), api_dir)
+    with open(os.path.join(api_dir, 'server.conf'), 'w') as f:
+        f.write('database-location = "../db/users.db"\n')
+        f.write('readonly-filesystem-location = "../fs"\n')
+        f.write('cache-location = "../cache"\n')
+        if args.shards:
+            f.write(f'data-shards = "{args.shards}"\n')
+        # All load comes from one address, so admission control would turn most of it away.
+        for setting in ('concurrency-limit-login', 'concurrency-limit-add_user', 'rate-limit-login-ip', 'rate-limit-login-user'):
+            f.write(f'{setting} = "0"\n')
+    # Compile the modules up front, as a deployment should, so CGI processes load
+    # them from cached bytecode even if the web server cannot write __pycache__.
+    compileall.compile_dir(api_dir, quiet=1)
+
+    seed_accounts(api_dir, args.users, args.keys)
+    dirs, files = build_fs_tree(os.path.join(root, 'fs'), args.dirs, args.files, args.file_size, rng)
+    return api_dir, dirs, files
+
+def iter_account_records(users, keys):
+    """Yields NDJSON export records for the synthetic users and their data."""
+    password_hash = hashlib.sha256(BENCH_PASSWORD.encode()).hexdigest()
+    for i in range(users):
+        yield {'table': 'users', 'row': {'username': f'user{i}', 'password_hash': password_hash}}
+    for i in range(users):
+        for k in range(keys):
+            row = {'username': f'user{i}', 'category': BENCH_CATEGORY, 'key': f'VAR{k}', 'value': f'value-{i}-{k}'}
+            yield {'table': 'user_data', 'row': row}
+
+def seed_accounts(api_dir, users, keys):
+    """Loads the synthetic accounts through Accounting.py's own import command."""
+    proc = subprocess.Popen([sys.executable, 'Accounting.py', 'import'], cwd=api_dir,
+                            stdin=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    for record in iter_account_records(users, keys):
+        proc.stdin.write(json.dumps(record) + '\n')
+    proc.stdin.close()
+    if proc.wait() != 0:
+        raise RuntimeError("Seeding the accounts database failed.")
+
+def build_fs_tree(fs_root, dir_count, file_count, file_size, rng):
+    """Creates dir_count directories of file_count text files. Returns their virtual paths."""
+    dirs, files = [], []
+    line = b'The quick brown fox jumps over the lazy dog.\n'
+    content = (line * (file_size // len(line) + 1))[:file_size]
+    for d in range(dir_count):
+        vfs_dir = f'/dir{d:04d}'
+        os.makedirs(fs_root + vfs_dir)
+        dirs.append(vfs_dir)
+        for f in range(file_count):
+            vfs_file = f'{vfs_dir}/file{f:04d}.txt'
+            with open(fs_root + vfs_file, 'wb') as out:
+                out.write(content)
+            files.append(vfs_file)
+    rng.shuffle(files)
+    return dirs, files
+
+# --- Targets ---
+
+def encode_multipart(fields):
+    """Encodes a dict of fields as multipart/form-data, as the frontend's FormData does."""
+    boundary = uuid.uuid4().hex
+    parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+             for name, value in fields.items()]
+    parts.append(f'--{boundary}--\r\n')
+    return ''.join(parts).encode('utf-8'), f'multipart/form-data; boundary={boundary}'
+
+class CgiTarget:
+    """Runs every request as a fresh CGI process, the way Apache would.
+
+    With `fast`, requests go through the *Cgi.py entry points instead of the scripts themselves.
+    """
+
+    def __init__(self, api_dir, fast=False):
+        self.api_dir = api_dir
+        self.fast = fast
+        self.name = 'cgi-fast' if fast else 'cgi'
+
+    def run(self, script, query, fields=None, extra_env=None):
+        """Runs one CGI process and returns the finished subprocess."""
+        body, content_type = encode_multipart(fields) if fields is not None else (b'', '')
+        env = {
+            'PATH': os.environ.get('PATH', ''),
+            'GATEWAY_INTERFACE': 'CGI/1.1',
+            'REQUEST_METHOD': 'POST' if fields is not None else 'GET',
+            'QUERY_STRING': urllib.parse.urlencode(query),
+            'CONTENT_TYPE': content_type,
+            'CONTENT_LENGTH': str(len(body)),
+            **(extra_env or {}),
+        }
+        entry_point = CGI_ENTRY_POINTS[script] if self.fast else script
+        return subprocess.run([sys.executable, entry_point], input=body, capture_output=True,
+                              cwd=self.api_dir, env=env)
+
+    def request(self, script, query, fields=None):
+        proc = self.run(script, query, fields)
+        head, _, payload = proc.stdout.partition(b'\n\n')
+        status = 200 if proc.returncode == 0 else 500
+        for line in head.decode('latin-1').splitlines():
+            if line.startswith('Status:'):
+                status = int(line.split()[1])
+        return status, payload
+
+    def close(self):
+        pass
+
+class ServeTarget:
+    """Sends requests to the scripts running in their long-lived `serve` mode."""
+    name = 'serve'
+
+    def __init__(self, api_dir):
+        self.ports = {}
+        self.processes = []
+        for script in ('Accounting.py', 'Filesystem.py'):
+            port = find_free_port()
+            self.processes.append(subprocess.Popen(
+                [sys.executable, script, 'serve', '--port', str(port)], cwd=api_dir,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+            self.ports[script] = port
+        for port in self.ports.values():
+            wait_for_port(port)
+
+    def request(self, script, query, fields=None):
+        conn = http.client.HTTPConnection('127.0.0.1', self.ports[script], timeout=60)
+        try:
+            path = '/?' + urllib.parse.urlencode(query)
+            if fields is None:
+                conn.request('GET', path)
+            else:
+                body, content_type = encode_multipart(fields)
+                conn.request('POST', path, body, {'Content-Type': content_type})
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+    def close(self):
+        for proc in self.processes:
+            proc.terminate()
+            proc.wait()
+
+def find_free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_for_port(port):
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Server on port {port} did not start.")
+
+# --- Workload ---
+
+class Workload:
+    """Builds randomized requests for each action against the synthetic data."""
+
+    def __init__(self, args, dirs, files, rng):
+        self.args = args
+        self.dirs = dirs
+        self.files = files
+        self.rng = rng
+        self.tokens = []
+
+    def login(self, target):
+        """Opens the shared session pool used by the token-based actions."""
+        self.tokens = []
+        for i in range(min(TOKEN_POOL_SIZE, self.args.users)):
+            status, body = target.request('Accounting.py', {'action': 'login'},
+                                          {'username': f'user{i}', 'password': BENCH_PASSWORD})
+            self.tokens.append(json.loads(body)['token'])
+
+    def make_request(self, action):
+        """Returns (script, query, fields) for one request of an action."""
+        rng = self.rng
+        user = f'user{rng.randrange(self.args.users)}'
+        token = rng.choice(self.tokens) if self.tokens else ''
+        if action == 'login':
+            return 'Accounting.py', {'action': 'login'}, {'username': user, 'password': BENCH_PASSWORD}
+        if action == 'validate':
+            return 'Accounting.py', {'action': 'validate'}, {'token': token}
+        if action == 'get_data':
+            return 'Accounting.py', {'action': 'get_data'}, {'token': token, 'category': BENCH_CATEGORY}
+        if action == 'set_data':
+            fields = {'token': token, 'category': 'BENCH', 'key': f'KEY{rng.randrange(1000)}', 'value': uuid.uuid4().hex}
+            return 'Accounting.py', {'action': 'set_data'}, fields
+        if action == 'ls':
+            return 'Filesystem.py', {'action': 'ls', 'path': rng.choice(self.dirs)}, None
+        if action == 'cat':
+            return 'Filesystem.py', {'action': 'cat', 'path': rng.choice(self.files)}, None
+        if action == 'resolve':
+            return 'Filesystem.py', {'action': 'resolve', 'path': rng.choice(self.files)}, None
+        raise ValueError(f"Unknown action: {action}")
+
+def is_success(script, status, body):
+    """Checks whether a response is a successful answer rather than an error."""
+    if status != 200:
+        return False
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return False
+    if script == 'Accounting.py':
+        return data.get('status') == 'success'
+    return 'error' not in data
+
+def run_action(target, workload, action, requests, concurrency):
+    """Sends `requests` requests of one action with `concurrency` clients. Returns its stats."""
+    prepared = [workload.make_request(action) for _ in range(requests)]
+
+    def send(request):
+        script, query, fields = request
+        start = time.perf_counter()
+        status, body = target.request(script, query, fields)
+        return time.perf_counter() - start, is_success(script, status, body)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, prepared))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        'mode': target.name,
+        'action': action,
+        'requests': requests,
+        'errors': sum(1 for _, ok in results if not ok),
+        'throughput': requests / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+def profile_imports(target, workload, action):
+    """Runs one CGI request of an action with -X importtime. Returns its import stats."""
+    script, query, fields = workload.make_request(action)
+    proc = target.run(script, query, fields, {'PYTHONPROFILEIMPORTTIME': '1'})
+    imports = []
+    for line in proc.stderr.decode('utf-8', 'replace').splitlines():
+        # "import time: <self us> | <cumulative us> | <name>", nested imports indented.
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if cumulative.strip().isdigit() and not name.startswith('  '):
+            imports.append((int(cumulative) / 1000, name.strip()))
+    imports.sort(reverse=True)
+    return {
+        'mode': target.name,
+        'action': action,
+        'import_ms': sum(ms for ms, _ in imports),
+        'top_imports': [{'module': name, 'ms': ms} for ms, name in imports[:STARTUP_TOP_IMPORTS]],
+    }
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+def print_report(results):
+    print(f"{'mode':<8} {'action':<10} {'requests':>8} {'errors':>6} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for r in results:
+        print(f"{r['mode']:<8} {r['action']:<10} {r['requests']:>8} {r['errors']:>6} {r['throughput']:>9.1f} "
+              f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+
+def print_import_report(profiles):
+    print(f"{'mode':<8} {'action':<10} {'import ms':>9}  slowest imports")
+    for p in profiles:
+        top = ', '.join(f"{i['module']} {i['ms']:.1f}" for i in p['top_imports'])
+        print(f"{p['mode']:<8} {p['action']:<10} {p['import_ms']:>9.1f}  {top}")
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the Nnoitra Terminal API scripts.')
+    parser.add_argument('--mode', choices=('cgi', 'cgi-fast', 'serve', 'both', 'startup'), default='both',
+                        help='both runs cgi and serve; startup compares the fixed cost of cgi and cgi-fast.')
+    parser.add_argument('--actions', nargs='+', choices=ALL_ACTIONS, default=list(ALL_ACTIONS))
+    parser.add_argument('--requests', type=int, default=200, help='Requests per action.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients.')
+    parser.add_argument('--users', type=int, default=100, help='Synthetic accounts.')
+    parser.add_argument('--keys', type=int, default=50, help='user_data rows per account.')
+    parser.add_argument('--shards', type=int, default=0, help='data-shards setting of the synthetic install.')
+    parser.add_argument('--dirs', type=int, default=20, help='Directories in the synthetic fs tree.')
+    parser.add_argument('--files', type=int, default=50, help='Files per directory.')
+    parser.add_argument('--file-size', type=int, default=4096, help='Size of each file in bytes.')
+    parser.add_argument('--seed', type=int, default=1, help='Seed for the generated requests.')
+    parser.add_argument('--workdir', help='Build the synthetic install here and keep it (default: a temp dir).')
+    parser.add_argument('--json', help='Also write the results to this file.')
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    root = args.workdir or tempfile.mkdtemp(prefix='nnoitra-bench-')
+    try:
+        print(f"Building synthetic install in {root}", file=sys.stderr)
+        api_dir, dirs, files = build_workspace(root, args, rng)
+        workload = Workload(args, dirs, files, rng)
+
+        if args.mode == 'both':
+            modes = ('cgi', 'serve')
+        elif args.mode == 'startup':
+            modes = ('cgi', 'cgi-fast')
+        else:
+            modes = (args.mode,)
+        # One request at a time, so the latency is the cost of a single process.
+        concurrency = 1 if args.mode == 'startup' else args.concurrency
+        results = []
+        profiles = []
+        for mode in modes:
+            target = ServeTarget(api_dir) if mode == 'serve' else CgiTarget(api_dir, fast=mode == 'cgi-fast')
+            try:
+                workload.login(target)
+                for action in args.actions:
+                    print(f"Running {mode} {action}...", file=sys.stderr)
+                    results.append(run_action(target, workload, action, args.requests, concurrency))
+                    if args.mode == 'startup':
+                        profiles.append(profile_imports(target, workload, action))
+            finally:
+                target.close()
+    finally:
+        if not args.workdir:
+            shutil.rmtree(root, ignore_errors=True)
+
+    print_report(results)
+    if profiles:
+        print()
+        print_import_report(profiles)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'results': results, 'imports': profiles} if profiles else results, f, indent=2)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])